@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Modules here import each other flat (ex. 'from ticker import Ticker'), and marcopolo.py shares the package's name,
+# so 'python -m marcopolo' runs with this directory first on the path and the package itself unloaded
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+sys.modules.pop('marcopolo', None)
+
+from supervisor import main
+
+main()
@@ -0,0 +1,294 @@
+import hashlib
+import hmac
+import json
+import logging
+from multiprocessing.dummy import Process as Thread
+import threading
+import time
+
+import money
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Poloniex push API channel for private account notifications
+ACCOUNT_CHANNEL = 1000
+
+
+class AccountNotifier(object):
+
+    def __init__(self, api_key, secret, markets=None, ws_url='wss://api2.poloniex.com/'):
+        self.api_key = api_key
+        self.secret = secret
+
+        # Currency pair id -> market name (ex. 182 -> 'BTC_STR'), taken from returnTicker()
+        self.markets = {}
+
+        if markets:
+            for market in markets:
+                self.markets[int(markets[market]['id'])] = market
+
+        # Only needed once a notifier is created (live mode), so not loaded on import
+        import websocket
+
+        self.ws = websocket.WebSocketApp(ws_url,
+                                         on_message=self.on_message,
+                                         on_error=self.on_error,
+                                         on_close=self.on_close)
+
+        self.ws.on_open = self.on_open
+
+        self.connected = False
+        self.subscribed = False
+
+        self.last_update = None
+
+        # orderNumber -> dict(market, type, rate, amount, startingAmount, date)
+        self.open_orders = {}
+
+        # orderNumber -> reason order left the book ('filled' or 'canceled')
+        self.closed_orders = {}
+
+        # orderNumber -> list of fills in returnOrderTrades() format
+        self.order_trades = {}
+
+        # currency -> accumulated balance change since subscription
+        self.balance_changes = {}
+
+        self.listeners = []
+
+        self.update_condition = threading.Condition()
+
+        # Incremented on every processed account update, used by waiters to detect changes
+        self.update_count = 0
+
+
+    def add_listener(self, callback):
+        # callback(update_type, data) is called from the websocket thread for each update
+        self.listeners.append(callback)
+
+
+    def on_message(self, ws, message):
+        message = json.loads(message)
+
+        if 'error' in message:
+            logger.error(message['error'])
+
+            return
+
+        if message[0] != ACCOUNT_CHANNEL:
+            return
+
+        if message[1] == 1:
+            logger.debug('Subscribed to account notifications.')
+
+            self.subscribed = True
+
+            return
+
+        if message[1] == 0:
+            logger.debug('Unsubscribed from account notifications.')
+
+            self.subscribed = False
+
+            return
+
+        with self.update_condition:
+            for update in message[2]:
+                try:
+                    if update[0] == 'n':
+                        AccountNotifier.on_new_order(self, update)
+
+                    elif update[0] == 'o':
+                        AccountNotifier.on_order_update(self, update)
+
+                    elif update[0] == 't':
+                        AccountNotifier.on_trade(self, update)
+
+                    elif update[0] == 'b':
+                        AccountNotifier.on_balance(self, update)
+
+                    else:
+                        continue
+
+                    for callback in self.listeners:
+                        try:
+                            callback(update[0], update)
+
+                        except Exception as e:
+                            logger.exception('Exception in account notification listener.')
+                            logger.exception(e)
+
+                except Exception as e:
+                    logger.exception('Exception while processing account update: ' + str(update))
+                    logger.exception(e)
+
+            self.last_update = time.time()
+
+            self.update_count += 1
+
+            self.update_condition.notify_all()
+
+
+    def on_new_order(self, update):
+        # ['n', currencyPairId, orderNumber, orderType, rate, amount, date, originalAmount, clientOrderId]
+        order_number = int(update[2])
+
+        self.open_orders[order_number] = dict(orderNumber=order_number,
+                                              market=self.markets.get(int(update[1])),
+                                              type='buy' if int(update[3]) == 1 else 'sell',
+                                              rate=float(update[4]),
+                                              amount=float(update[5]),
+                                              startingAmount=float(update[7]) if len(update) > 7 else float(update[5]),
+                                              date=update[6])
+
+        logger.debug('New order: ' + str(self.open_orders[order_number]))
+
+
+    def on_order_update(self, update):
+        # ['o', orderNumber, newAmount, updateType, clientOrderId]
+        order_number = int(update[1])
+
+        new_amount = float(update[2])
+
+        if new_amount > 0:
+            if order_number in self.open_orders:
+                self.open_orders[order_number]['amount'] = new_amount
+
+            return
+
+        self.open_orders.pop(order_number, None)
+
+        if len(update) > 3 and update[3] == 'c':
+            self.closed_orders[order_number] = 'canceled'
+
+        else:
+            self.closed_orders[order_number] = 'filled'
+
+        logger.debug('Order #' + str(order_number) + ' closed (' + self.closed_orders[order_number] + ').')
+
+
+    def on_trade(self, update):
+        # ['t', tradeID, rate, amount, feeMultiplier, fundingType, orderNumber, totalFee, date, clientOrderId, tradeTotal]
+        order_number = int(update[6])
+
+        rate = float(update[2])
+        amount = float(update[3])
+
+        trade = dict(tradeID=int(update[1]),
+                     rate=rate,
+                     amount=amount,
+                     fee=float(update[4]),
+                     total=money.to_value(money.mul(money.to_units(update[2]), money.to_units(update[3]))),
+                     date=update[8] if len(update) > 8 else None,
+                     orderNumber=order_number)
+
+        if order_number in self.open_orders:
+            trade['currencyPair'] = self.open_orders[order_number]['market']
+            trade['type'] = self.open_orders[order_number]['type']
+
+        if order_number not in self.order_trades:
+            self.order_trades[order_number] = []
+
+        self.order_trades[order_number].append(trade)
+
+        logger.debug('Trade: ' + str(trade))
+
+
+    def on_balance(self, update):
+        # ['b', currencyId, wallet, amount]
+        if update[2] != 'e':
+            return
+
+        currency_id = int(update[1])
+
+        self.balance_changes[currency_id] = money.to_value(money.to_units(self.balance_changes.get(currency_id, 0)) + money.to_units(update[3]))
+
+
+    def on_error(self, ws, error):
+        logger.error(error)
+
+
+    def on_close(self, ws, *args):
+        logger.debug('Account websocket closed.')
+
+        with self.update_condition:
+            self.connected = False
+            self.subscribed = False
+
+            self.update_condition.notify_all()
+
+
+    def on_open(self, ws):
+        payload = 'nonce=' + str(int(time.time() * 1000000))
+
+        sign = hmac.new(self.secret.encode('utf-8'), payload.encode('utf-8'), hashlib.sha512).hexdigest()
+
+        self.ws.send(json.dumps({'command': 'subscribe',
+                                 'channel': ACCOUNT_CHANNEL,
+                                 'key': self.api_key,
+                                 'payload': payload,
+                                 'sign': sign}))
+
+        self.connected = True
+
+        logger.debug('Account notification subscription requested.')
+
+
+    def start(self):
+        self.t = Thread(target=self.ws.run_forever)
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.debug('Account notifier thread started.')
+
+
+    def stop(self):
+        self.ws.close()
+
+        self.t.join()
+
+        logger.debug('Account notifier thread joined.')
+
+
+    def ready(self):
+        return self.connected == True and self.subscribed == True
+
+
+    def is_open(self, order_number):
+        # Returns True/False from pushed state, or None if the notifier can't answer (fall back to REST)
+        if self.ready() == False:
+            return None
+
+        order_number = int(order_number)
+
+        with self.update_condition:
+            if order_number in self.open_orders:
+                return True
+
+            if order_number in self.closed_orders:
+                return False
+
+        return None
+
+
+    def close_reason(self, order_number):
+        return self.closed_orders.get(int(order_number))
+
+
+    def get_order_trades(self, order_number):
+        with self.update_condition:
+            return list(self.order_trades.get(int(order_number), []))
+
+
+    def wait_for_update(self, timeout):
+        # Blocks until any account update arrives or timeout elapses. Returns True if woken by an update.
+        with self.update_condition:
+            update_count = self.update_count
+
+            self.update_condition.wait(timeout)
+
+            return self.update_count != update_count
@@ -0,0 +1,364 @@
+import json
+import logging
+from multiprocessing.dummy import Process as Thread
+import os
+import queue
+import re
+import time
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Slack truncates long messages, so merged posts are split below this length
+max_post_length = 3500
+
+
+def load_channel_cache(cache_path, ttl):
+    # name -> channel ID, or {} if the cache is missing, unreadable or older than ttl seconds
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            cache = json.load(file)
+
+        if time.time() - cache['time'] > ttl:
+            return {}
+
+        return cache['channels']
+
+    except Exception:
+        return {}
+
+
+def save_channel_cache(cache_path, channels):
+    try:
+        with open(cache_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(dict(time=time.time(), channels=channels), file)
+
+        os.replace(cache_path + '.tmp', cache_path)
+
+    except Exception as e:
+        logger.exception('Exception while writing Slack channel cache.')
+        logger.exception(e)
+
+
+def resolve_channels(slack_client, names, cache_path, ttl=86400):
+    # Channel names -> IDs, listing channels/groups from the API only for names missing from the cache
+    channels = load_channel_cache(cache_path, ttl)
+
+    missing = [name for name in names if name not in channels]
+
+    if len(missing) > 0:
+        for method, key in [('channels.list', 'channels'), ('groups.list', 'groups')]:
+            result = slack_client.api_call(method)
+
+            if result.get('ok'):
+                for chan in result[key]:
+                    if chan['name'] in missing:
+                        channels[chan['name']] = chan['id']
+
+            else:
+                logger.error(method + ' API call failed: ' + str(result.get('error')))
+
+            missing = [name for name in names if name not in channels]
+
+            if len(missing) == 0:
+                break
+
+        if len(missing) > 0:
+            logger.error('No valid Slack channel found for: ' + ', '.join(missing))
+
+        save_channel_cache(cache_path, channels)
+
+    return {name: channels[name] for name in names if name in channels}
+
+
+def connect_slack(token, targets, cache_path, ttl=86400):
+    # targets: alert target -> channel name. Returns (client, target -> channel ID) for AlertDispatcher(connect=...)
+    from slackclient import SlackClient
+
+    slack_client = SlackClient(token)
+
+    channels = resolve_channels(slack_client, list(targets.values()), cache_path, ttl=ttl)
+
+    for target in targets:
+        if targets[target] in channels:
+            logger.info('Slack channel for ' + target + ': #' + targets[target] + ' (' + channels[targets[target]] + ')')
+
+    return slack_client, {target: channels[targets[target]] for target in targets if targets[target] in channels}
+
+
+def similarity_key(message):
+    # Messages differing only in numbers (times, prices, counts) are treated as the same alert
+    return re.sub(r'\d+(\.\d+)?', '#', message)
+
+
+class AlertDispatcher(object):
+
+    def __init__(self, slack_client, bot_user=None, bot_icon=None, max_queue=1000, channel_interval=1.0, poll_interval=0.25,
+                 connect=None, channels=None, reconnect_interval=60, max_pending=100):
+        self.slack_client = slack_client
+
+        # Optional callable returning (client, target -> channel ID), run on the worker so startup never waits on Slack
+        self.connect = connect
+
+        # Alerts may be sent to a target (ex. 'alerts') before its channel ID is known
+        self.channels = channels if channels is not None else {}
+
+        self.reconnect_interval = reconnect_interval
+
+        self.connect_time = None
+
+        self.bot_user = bot_user
+        self.bot_icon = bot_icon
+
+        # Senders never wait on a full queue; overflowing alerts are counted and dropped
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        # Minimum seconds between posts to the same channel (Slack allows about one per second)
+        self.channel_interval = channel_interval
+
+        self.poll_interval = poll_interval
+
+        # channel_id -> [[similarity key, first message, count], ...] waiting for the channel's next post
+        self.pending = {}
+
+        # Distinct alerts kept per channel while Slack is unreachable; further new ones are counted as dropped
+        self.max_pending = max_pending
+
+        # channel_id -> earliest time of next post
+        self.next_post = {}
+
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self.running = False
+
+
+    def send(self, channel_id, message):
+        # Called from websocket callbacks and trading threads, so it only ever enqueues
+        if (self.slack_client is None and self.connect is None) or channel_id is None:
+            return False
+
+        try:
+            self.queue.put_nowait((channel_id, message))
+
+        except queue.Full:
+            self.dropped += 1
+
+            return False
+
+        return True
+
+
+    def collect(self, channel_id, message):
+        pending = self.pending.setdefault(channel_id, [])
+
+        key = similarity_key(message)
+
+        for entry in pending:
+            if entry[0] == key:
+                entry[2] += 1
+
+                self.merged += 1
+
+                return
+
+        if len(pending) >= self.max_pending:
+            self.dropped += 1
+
+            return
+
+        pending.append([key, message, 1])
+
+
+    def format(self, entries):
+        # One post per channel per interval; repeats of a similar message are shown once with a count.
+        # Returns [(text, entries in it), ...] so a post that couldn't be sent can be put back.
+        posts = []
+
+        post = ''
+        post_entries = []
+
+        for entry in entries:
+            key, message, count = entry
+
+            line = message if count == 1 else message + ' _(x' + str(count) + ')_'
+
+            if len(post) > 0 and len(post) + len(line) + 1 > max_post_length:
+                posts.append((post, post_entries))
+
+                post = ''
+                post_entries = []
+
+            post = post + '\n' + line if len(post) > 0 else line
+
+            post_entries.append(entry)
+
+        if len(post) > 0:
+            posts.append((post, post_entries))
+
+        return posts
+
+
+    def post(self, channel_id, text):
+        # True if posted, False if rejected or failed, None if rate limited (next_post is pushed back by Retry-After)
+        try:
+            result = self.slack_client.api_call('chat.postMessage',
+                                                channel=self.channels.get(channel_id, channel_id),
+                                                text=text,
+                                                username=self.bot_user,
+                                                icon_url=self.bot_icon)
+
+            if isinstance(result, dict) and result.get('ok') == False:
+                # Slack asks for a pause when rate limited
+                if result.get('error') == 'ratelimited':
+                    retry_after = float(result.get('headers', {}).get('Retry-After', 1))
+
+                    logger.warning('Slack alerts rate limited. Retrying in ' + str(retry_after) + ' seconds.')
+
+                    self.next_post[channel_id] = time.time() + retry_after
+
+                    return None
+
+                logger.error('Slack alert rejected: ' + str(result.get('error')))
+
+                self.failed += 1
+
+                return False
+
+            self.sent += 1
+
+            return True
+
+        except Exception as e:
+            logger.exception('Exception while posting Slack alert.')
+            logger.exception(e)
+
+            self.failed += 1
+
+            return False
+
+
+    def health(self):
+        return dict(connected=self.slack_client is not None,
+                    queue_depth=self.queue.qsize(),
+                    queue_max=self.queue.maxsize,
+                    pending=sum([len(entries) for entries in list(self.pending.values())]),
+                    sent=self.sent,
+                    merged=self.merged,
+                    dropped=self.dropped,
+                    failed=self.failed)
+
+
+    def connected(self):
+        if self.slack_client is not None:
+            return True
+
+        if self.connect is None or (self.connect_time is not None and time.time() - self.connect_time < self.reconnect_interval):
+            return False
+
+        self.connect_time = time.time()
+
+        try:
+            self.slack_client, channels = self.connect()
+
+            self.channels.update(channels)
+
+            logger.debug('Slack client initialized.')
+
+            return True
+
+        except Exception as e:
+            logger.exception('Exception while initializing Slack client.')
+            logger.exception(e)
+
+            return False
+
+
+    def flush(self, force=False):
+        # Alerts stay pending until the client is connected
+        if AlertDispatcher.connected(self) == False:
+            return
+
+        now = time.time()
+
+        for channel_id in list(self.pending):
+            if force == False and self.next_post.get(channel_id, 0) > now:
+                continue
+
+            entries = self.pending.pop(channel_id)
+
+            posts = AlertDispatcher.format(self, entries)
+
+            for index in range(len(posts)):
+                if AlertDispatcher.post(self, channel_id, posts[index][0]) == None:
+                    # Rate limited: this post and the rest go back to pending until Retry-After has passed
+                    requeued = [entry for text, post_entries in posts[index:] for entry in post_entries]
+
+                    self.pending[channel_id] = requeued + self.pending.get(channel_id, [])
+
+                    break
+
+            self.next_post[channel_id] = max(self.next_post.get(channel_id, 0), time.time() + self.channel_interval)
+
+
+    def drain(self):
+        while True:
+            try:
+                channel_id, message = self.queue.get_nowait()
+
+            except queue.Empty:
+                return
+
+            AlertDispatcher.collect(self, channel_id, message)
+
+
+    def run(self):
+        AlertDispatcher.connected(self)
+
+        while self.running == True:
+            try:
+                try:
+                    channel_id, message = self.queue.get(timeout=self.poll_interval)
+
+                    AlertDispatcher.collect(self, channel_id, message)
+
+                except queue.Empty:
+                    pass
+
+                # Whatever else arrived in the same burst joins the pending post
+                AlertDispatcher.drain(self)
+
+                AlertDispatcher.flush(self)
+
+            except Exception as e:
+                logger.exception('Exception in alert dispatcher loop.')
+                logger.exception(e)
+
+        # Alerts queued before shutdown (ex. shutdown notices) are still delivered
+        AlertDispatcher.drain(self)
+
+        AlertDispatcher.flush(self, force=True)
+
+
+    def start(self):
+        self.running = True
+
+        self.t = Thread(target=self.run)
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.debug('Alert dispatcher started.')
+
+
+    def stop(self):
+        self.running = False
+
+        self.t.join()
+
+        logger.debug('Alert dispatcher stopped. Sent: ' + str(self.sent) + ', merged: ' + str(self.merged) +
+                     ', dropped: ' + str(self.dropped) + ', failed: ' + str(self.failed))
@@ -0,0 +1,135 @@
+import argparse
+import datetime
+import logging
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+import money
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Parameters that identify a parameter set in per-parameter reports
+parameter_fields = ['profit_level', 'stop_level', 'price_tolerance', 'entry_timeout', 'spend_proportion', 'trail_level']
+
+
+class TradeArchive(object):
+
+    def __init__(self, collection):
+        # Completed trades, one document per trade_id, with PnL precomputed so reports only sum
+        self.collection = collection
+
+        self.collection.create_index([('market', ASCENDING), ('close_time', DESCENDING)])
+        self.collection.create_index([('close_time', DESCENDING)])
+        self.collection.create_index([('result', ASCENDING), ('close_time', DESCENDING)])
+
+
+    def archive(self, trade_doc, close_time):
+        spend = trade_doc['buy']['spend_actual']
+        gain = trade_doc['sell']['gain_actual']
+
+        pnl = money.to_value(money.to_units(gain) - money.to_units(spend)) if gain != None and spend != None else None
+
+        archived = dict(trade_doc,
+                        _id=trade_doc.get('trade_id', trade_doc['market'] + '-' + str(close_time)),
+                        close_time=close_time,
+                        result=trade_doc['sell']['result'],
+                        spend=spend,
+                        gain=gain,
+                        pnl=pnl,
+                        pnl_pct=round(pnl / spend, 6) if pnl != None and spend else None)
+
+        # Upsert so archiving again after a crash between archive and delete is harmless
+        self.collection.replace_one({'_id': archived['_id']}, archived, upsert=True)
+
+        return archived
+
+
+    def match_stage(self, start=None, end=None, market=None, result=None):
+        query = {}
+
+        if start != None or end != None:
+            query['close_time'] = {}
+
+            if start != None:
+                query['close_time']['$gte'] = start
+
+            if end != None:
+                query['close_time']['$lt'] = end
+
+        if market != None:
+            query['market'] = market
+
+        if result != None:
+            query['result'] = result
+
+        return {'$match': query}
+
+
+    def summarize(self, group_id, start=None, end=None, market=None, result=None, sort=None):
+        pipeline = [TradeArchive.match_stage(self, start, end, market, result),
+                    {'$project': {'market': 1, 'close_time': 1, 'result': 1, 'parameters': 1, 'spend': 1, 'gain': 1, 'pnl': 1, 'pnl_pct': 1}},
+                    {'$group': {'_id': group_id,
+                                'trades': {'$sum': 1},
+                                'target': {'$sum': {'$cond': [{'$eq': ['$result', 'target']}, 1, 0]}},
+                                'stop': {'$sum': {'$cond': [{'$eq': ['$result', 'stop']}, 1, 0]}},
+                                'spend': {'$sum': '$spend'},
+                                'gain': {'$sum': '$gain'},
+                                'pnl': {'$sum': '$pnl'},
+                                'mean_pnl_pct': {'$avg': '$pnl_pct'},
+                                'first_close': {'$min': '$close_time'},
+                                'last_close': {'$max': '$close_time'}}},
+                    {'$sort': sort if sort != None else {'pnl': -1}}]
+
+        return list(self.collection.aggregate(pipeline))
+
+
+    def pnl_by_market(self, start=None, end=None, result=None):
+        return TradeArchive.summarize(self, '$market', start=start, end=end, result=result)
+
+
+    def pnl_by_day(self, start=None, end=None, market=None, result=None):
+        return TradeArchive.summarize(self, {'$dateToString': {'format': '%Y-%m-%d', 'date': '$close_time'}},
+                                      start=start, end=end, market=market, result=result, sort={'_id': 1})
+
+
+    def pnl_by_parameters(self, start=None, end=None, market=None, result=None):
+        return TradeArchive.summarize(self, {field: '$parameters.' + field for field in parameter_fields},
+                                      start=start, end=end, market=market, result=result)
+
+
+if __name__ == '__main__':
+    import settings
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('report', type=str, choices=['market', 'day', 'parameters'], help='Group PnL by market, day or parameter set.')
+    parser.add_argument('-m', '--mongo', type=str, default=None, help='MongoDB URI (default from config).')
+    parser.add_argument('-s', '--start', type=str, default=None, help='Close time from (YYYY-MM-DD).')
+    parser.add_argument('-e', '--end', type=str, default=None, help='Close time before (YYYY-MM-DD).')
+    parser.add_argument('--market', type=str, default=None, help='Limit to one market.')
+    parser.add_argument('--result', type=str, default=None, choices=['target', 'stop'], help='Limit to one result.')
+    args = parser.parse_args()
+
+    start = datetime.datetime.strptime(args.start, '%Y-%m-%d') if args.start != None else None
+    end = datetime.datetime.strptime(args.end, '%Y-%m-%d') if args.end != None else None
+
+    mongo_uri = args.mongo if args.mongo != None else settings.mongo_uri(settings.load_config())
+
+    trade_archive = TradeArchive(MongoClient(mongo_uri).marcopolo['trade_archive'])
+
+    if args.report == 'market':
+        rows = trade_archive.pnl_by_market(start=start, end=end, result=args.result)
+
+    elif args.report == 'day':
+        rows = trade_archive.pnl_by_day(start=start, end=end, market=args.market, result=args.result)
+
+    else:
+        rows = trade_archive.pnl_by_parameters(start=start, end=end, market=args.market, result=args.result)
+
+    print('{:<48} {:>7} {:>7} {:>6} {:>14} {:>10}'.format('group', 'trades', 'target', 'stop', 'pnl', 'mean %'))
+
+    for row in rows:
+        print('{:<48} {:>7} {:>7} {:>6} {:>14.8f} {:>10}'.format(str(row['_id'])[:48], row['trades'], row['target'], row['stop'],
+                                                                row['pnl'] or 0.0,
+                                                                '-' if row['mean_pnl_pct'] is None else '{:.3f}'.format(row['mean_pnl_pct'] * 100)))
@@ -0,0 +1,407 @@
+import argparse
+import csv
+import datetime
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+
+import money
+import tradelogic
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+outcome_fields = ['market', 'time', 'close_time', 'result', 'buy_target', 'price_actual', 'spend_actual', 'amount_actual',
+                  'sell_target', 'stop', 'threshold', 'stop_activations', 'gain_actual', 'profit', 'profit_pct']
+
+
+class MarketData(object):
+
+    def __init__(self, market, times, bid_low, bid_high, ask, bid_open, ask_open):
+        # One row per tick or candle, in simulated time order. Falling conditions test bid_low, rising ones
+        # bid_high, entry tests ask; *_open is the fill price when a condition already holds as the row opens.
+        self.market = market
+
+        self.time = np.ascontiguousarray(times, dtype=np.float64)
+        self.bid_low = np.ascontiguousarray(bid_low, dtype=np.float64)
+        self.bid_high = np.ascontiguousarray(bid_high, dtype=np.float64)
+        self.ask = np.ascontiguousarray(ask, dtype=np.float64)
+        self.bid_open = np.ascontiguousarray(bid_open, dtype=np.float64)
+        self.ask_open = np.ascontiguousarray(ask_open, dtype=np.float64)
+
+
+    def __len__(self):
+        return len(self.time)
+
+
+    @classmethod
+    def from_candles(cls, market, candles):
+        # candles as returned by returnChartData()
+        times = [candle['date'] for candle in candles]
+        lows = [candle['low'] for candle in candles]
+        highs = [candle['high'] for candle in candles]
+        opens = [candle['open'] for candle in candles]
+
+        return cls(market, times, lows, highs, lows, opens, opens)
+
+
+    @classmethod
+    def from_ticks(cls, market, times, bids, asks):
+        return cls(market, times, bids, bids, asks, bids, asks)
+
+
+    def save(self, path):
+        # Single (6, rows) float64 .npy so load() can map it read-only without copying
+        np.save(path, np.vstack([self.time, self.bid_low, self.bid_high, self.ask, self.bid_open, self.ask_open]))
+
+
+    @classmethod
+    def load(cls, market, path, mmap_mode='r'):
+        columns = np.load(path, mmap_mode=mmap_mode)
+
+        return cls(market, *columns)
+
+
+    @classmethod
+    def from_ticker_docs(cls, market, ticker_docs):
+        # Stored ticker records with 'received', 'highestBid' and 'lowestAsk'
+        return cls.from_ticks(market,
+                              [doc['received'] for doc in ticker_docs],
+                              [doc['highestBid'] for doc in ticker_docs],
+                              [doc['lowestAsk'] for doc in ticker_docs])
+
+
+    @classmethod
+    def from_tick_archive(cls, archive, market, start=None, end=None):
+        # archive is a tickarchive.TickArchive; prices come back from int64 units in one vectorized pass
+        ticks = archive.range(market, start, end)
+
+        return cls.from_ticks(market, ticks['time'], money.to_value_array(ticks['bid']), money.to_value_array(ticks['ask']))
+
+
+def next_index(condition, start, end):
+    # First index in [start, end) where condition(lo, hi) is True, scanning doubling windows so the
+    # cost follows the distance to the event rather than the length of the data
+    size = 256
+
+    lo = start
+
+    while lo < end:
+        hi = min(end, lo + size)
+
+        hits = np.flatnonzero(condition(lo, hi))
+
+        if len(hits) > 0:
+            return lo + int(hits[0])
+
+        lo = hi
+
+        size *= 2
+
+    return None
+
+
+def timestamp_to_datetime(timestamp):
+    return datetime.datetime.utcfromtimestamp(float(timestamp))
+
+
+class Backtester(object):
+
+    def __init__(self, maker_fee=0.001, taker_fee=0.002, balance=10):
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+
+        # Base currency balance spend_proportion is applied to (debug_mode uses 10)
+        self.balance = balance
+
+
+    def run_trade(self, data, start, buy_target, profit_level, stop_level, stop_price=None,
+                  spend_proportion=0.01, price_tolerance=0.001, entry_timeout=5, taker_fee_ok=True):
+        # Runs one trade cycle from row start. Returns (trade_doc, index of last row used).
+        # When one candle satisfies both a rising and a falling condition the falling (stop) side is taken first.
+        n = len(data)
+
+        buy_max = tradelogic.buy_max_price(buy_target, price_tolerance)
+        sell_price = tradelogic.target_price(buy_target, profit_level)
+
+        if stop_price == None:
+            stop_price = tradelogic.stop_loss_price(buy_target, stop_level)
+
+        spend_amount = money.to_value(money.scaled(money.to_units(self.balance), spend_proportion))
+
+        abort_timestamp = float(data.time[start]) + entry_timeout * 60
+
+        trade_doc = dict(market=data.market, time=timestamp_to_datetime(data.time[start]), close_time=None,
+                         buy=dict(target=buy_target,
+                                  max=buy_max,
+                                  spend=spend_amount,
+                                  spend_actual=None,
+                                  amount_actual=None,
+                                  price_actual=None,
+                                  abort_time=timestamp_to_datetime(abort_timestamp),
+                                  complete=False),
+                         sell=dict(target=sell_price,
+                                   amount=None,
+                                   stop=stop_price,
+                                   threshold=None,
+                                   gain_actual=None,
+                                   amount_actual=None,
+                                   complete=False,
+                                   result=None,
+                                   stop_active=None,
+                                   stop_activations=0),
+                         fees=dict(maker=self.maker_fee, taker=self.taker_fee),
+                         parameters=dict(market=data.market,
+                                         buy_target=buy_target,
+                                         profit_level=profit_level,
+                                         stop_level=stop_level,
+                                         stop_price=stop_price,
+                                         spend_proportion=spend_proportion,
+                                         price_tolerance=price_tolerance,
+                                         entry_timeout=entry_timeout,
+                                         taker_fee_ok=taker_fee_ok))
+
+        ## Entry buy ##
+        entry = next_index(lambda lo, hi: tradelogic.entry_price_ok(data.ask[lo:hi], buy_max) | (data.time[lo:hi] >= abort_timestamp),
+                           start, n)
+
+        if entry == None or data.time[entry] >= abort_timestamp:
+            trade_doc['sell']['result'] = 'aborted'
+
+            end = n - 1 if entry == None else entry
+
+            trade_doc['close_time'] = timestamp_to_datetime(data.time[end])
+
+            return trade_doc, end
+
+        entry_price = float(min(data.ask_open[entry], buy_max) if data.ask_open[entry] > data.ask[entry] else data.ask[entry])
+
+        buy_amount = tradelogic.entry_buy_amount(spend_amount, entry_price)
+
+        spend_units = money.mul(money.to_units(entry_price), money.to_units(buy_amount))
+        amount_units = money.scaled(money.to_units(buy_amount), 1 - self.taker_fee)
+
+        spend_actual = money.to_value(spend_units)
+        amount_actual = money.to_value(amount_units)
+
+        trade_doc['buy']['spend_actual'] = spend_actual
+        trade_doc['buy']['amount_actual'] = amount_actual
+        trade_doc['buy']['price_actual'] = money.to_value(money.div(spend_units, amount_units))
+        trade_doc['buy']['complete'] = True
+
+        trade_doc['sell']['amount'] = amount_actual
+
+        baseline = tradelogic.threshold_baseline(trade_doc['buy']['price_actual'], buy_target)
+
+        threshold = tradelogic.monitor_threshold(baseline, stop_price, price_tolerance)
+
+        trade_doc['sell']['threshold'] = threshold
+
+        ## Monitor ##
+        stop_active = False
+
+        i = entry + 1
+
+        while i < n:
+            if stop_active == False:
+                k = next_index(lambda lo, hi: tradelogic.below_threshold(data.bid_low[lo:hi], threshold) |
+                                              (data.bid_high[lo:hi] >= sell_price), i, n)
+
+                if k == None:
+                    break
+
+                if tradelogic.below_threshold(data.bid_low[k], threshold):
+                    stop_active = True
+
+                    trade_doc['sell']['stop_activations'] += 1
+
+                else:
+                    trade_doc['sell']['amount_actual'] = amount_actual
+                    trade_doc['sell']['gain_actual'] = money.to_value(money.scaled(money.mul(amount_units, money.to_units(sell_price)), 1 - self.maker_fee))
+                    trade_doc['sell']['complete'] = True
+                    trade_doc['sell']['result'] = 'target'
+
+                    i = k
+
+                    break
+
+            else:
+                k = next_index(lambda lo, hi: tradelogic.stop_triggered(data.bid_low[lo:hi], stop_price) |
+                                              tradelogic.above_threshold(data.bid_high[lo:hi], threshold), i, n)
+
+                if k == None:
+                    break
+
+                if tradelogic.stop_triggered(data.bid_low[k], stop_price):
+                    stop_fill = float(min(stop_price, data.bid_open[k]))
+
+                    trade_doc['sell']['amount_actual'] = amount_actual
+                    trade_doc['sell']['gain_actual'] = money.to_value(money.scaled(money.mul(amount_units, money.to_units(stop_fill)), 1 - self.taker_fee))
+                    trade_doc['sell']['complete'] = True
+                    trade_doc['sell']['result'] = 'stop'
+
+                    i = k
+
+                    break
+
+                stop_active = False
+
+            i = k + 1
+
+        trade_doc['sell']['stop_active'] = stop_active
+
+        end = min(i, n - 1)
+
+        trade_doc['close_time'] = timestamp_to_datetime(data.time[end]) if trade_doc['sell']['complete'] == True else None
+
+        return trade_doc, end
+
+
+    def run(self, data, entries=None, **parameters):
+        # entries: list of (timestamp, buy_target). Without entries, a new trade is entered at the ask
+        # as soon as the previous one closes. parameters are create_trade() keyword arguments.
+        trades = []
+
+        n = len(data)
+
+        if entries != None:
+            for timestamp, buy_target in entries:
+                start = int(np.searchsorted(data.time, timestamp))
+
+                if start >= n:
+                    break
+
+                trade_doc, end = Backtester.run_trade(self, data, start, buy_target, **parameters)
+
+                trades.append(trade_doc)
+
+            return trades
+
+        start = 0
+
+        while start < n:
+            trade_doc, end = Backtester.run_trade(self, data, start, float(data.ask_open[start]), **parameters)
+
+            trades.append(trade_doc)
+
+            if trade_doc['sell']['complete'] == False and trade_doc['sell']['result'] != 'aborted':
+                break
+
+            start = end + 1
+
+        return trades
+
+
+def outcome_table(trades):
+    rows = []
+
+    for trade_doc in trades:
+        profit = None
+        profit_pct = None
+
+        if trade_doc['sell']['gain_actual'] != None:
+            profit = money.to_value(money.to_units(trade_doc['sell']['gain_actual']) - money.to_units(trade_doc['buy']['spend_actual']))
+            profit_pct = round(profit / trade_doc['buy']['spend_actual'], 6)
+
+        rows.append(dict(market=trade_doc['market'],
+                         time=trade_doc['time'],
+                         close_time=trade_doc['close_time'],
+                         result=trade_doc['sell']['result'],
+                         buy_target=trade_doc['buy']['target'],
+                         price_actual=trade_doc['buy']['price_actual'],
+                         spend_actual=trade_doc['buy']['spend_actual'],
+                         amount_actual=trade_doc['buy']['amount_actual'],
+                         sell_target=trade_doc['sell']['target'],
+                         stop=trade_doc['sell']['stop'],
+                         threshold=trade_doc['sell']['threshold'],
+                         stop_activations=trade_doc['sell']['stop_activations'],
+                         gain_actual=trade_doc['sell']['gain_actual'],
+                         profit=profit,
+                         profit_pct=profit_pct))
+
+    return rows
+
+
+def summarize(trades):
+    rows = outcome_table(trades)
+
+    closed = [row for row in rows if row['profit'] != None]
+
+    return dict(trades=len(rows),
+                closed=len(closed),
+                target=len([row for row in closed if row['result'] == 'target']),
+                stop=len([row for row in closed if row['result'] == 'stop']),
+                aborted=len([row for row in rows if row['result'] == 'aborted']),
+                profit=money.to_value(money.total([row['profit'] for row in closed])),
+                spend=money.to_value(money.total([row['spend_actual'] for row in closed])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('market', type=str, help='Market to backtest (ex. BTC_STR).')
+    parser.add_argument('-c', '--candles', type=str, default=None, help='JSON file of returnChartData() candles (fetched if omitted).')
+    parser.add_argument('-t', '--ticks', type=str, default=None, help='Tick archive directory to replay instead of candles.')
+    parser.add_argument('-p', '--period', type=int, default=300, help='Candle period in seconds when fetching.')
+    parser.add_argument('--cache', type=str, default=None, help='Candle cache directory for fetched candles (default cache/candles).')
+    parser.add_argument('-s', '--start', type=float, default=None, help='Start timestamp (fetching defaults to 30 days ago).')
+    parser.add_argument('-e', '--end', type=float, default=None, help='End timestamp (fetching defaults to now).')
+    parser.add_argument('--profit', type=float, default=0.015, help='profit_level')
+    parser.add_argument('--stop', type=float, default=0.01, help='stop_level')
+    parser.add_argument('--tolerance', type=float, default=0.001, help='price_tolerance')
+    parser.add_argument('--timeout', type=float, default=5, help='entry_timeout (minutes)')
+    parser.add_argument('--spend', type=float, default=0.01, help='spend_proportion')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write per-trade outcome table to this CSV file.')
+    args = parser.parse_args()
+
+    if args.ticks != None:
+        from tickarchive import TickArchive
+
+        data = MarketData.from_tick_archive(TickArchive(args.ticks), args.market, start=args.start, end=args.end)
+
+    elif args.candles != None:
+        with open(args.candles, 'r', encoding='utf-8') as file:
+            candles = json.load(file)
+
+        data = MarketData.from_candles(args.market, candles)
+
+    else:
+        from candles import CandleStore
+        from exchange import get_client
+        import settings
+
+        end = args.end if args.end != None else time.time()
+        start = args.start if args.start != None else end - 30 * 86400
+
+        # Only ranges missing from the cache are requested
+        candle_store = CandleStore(get_client(), root=args.cache if args.cache != None else settings.candle_cache_default)
+
+        candles = candle_store.candles(args.market, args.period, start, end)
+
+        logger.info('Loaded ' + str(len(candles)) + ' candles (' + str(candle_store.requests) + ' chart data request(s)).')
+
+        data = MarketData.from_candles(args.market, candles)
+
+    run_start = time.perf_counter()
+
+    trades = Backtester().run(data, profit_level=args.profit, stop_level=args.stop, price_tolerance=args.tolerance,
+                              entry_timeout=args.timeout, spend_proportion=args.spend)
+
+    logger.info('Backtested ' + str(len(data)) + ' rows in ' + str(round(time.perf_counter() - run_start, 3)) + ' s.')
+
+    logger.info('Summary: ' + str(summarize(trades)))
+
+    output = open(args.output, 'w', newline='') if args.output != None else sys.stdout
+
+    writer = csv.DictWriter(output, fieldnames=outcome_fields)
+
+    writer.writeheader()
+
+    for row in outcome_table(trades):
+        writer.writerow(row)
+
+    if args.output != None:
+        output.close()
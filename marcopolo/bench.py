@@ -0,0 +1,414 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import bson
+
+from clock import VirtualClock
+from simulator import ExchangeSimulator
+from tracing import percentile
+import tradelogic
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Module loggers quieted while measuring so log formatting isn't what gets measured
+quiet_loggers = ['marcopolo', 'ticker', 'simulator', 'exchange', 'trailing', 'triggers', 'tracing', 'candles']
+
+verbose = False
+
+# Fresh-interpreter import time budgets (p50, microseconds) for modules other programs embed
+import_budgets = {'ticker': 75000, 'marcopolo': 120000}
+
+# Dependencies an embedding program should not pay for just by importing the module
+heavy_modules = ['pymongo', 'websocket', 'slackclient', 'poloniex', 'requests', 'numpy']
+
+
+def summarize_samples(name, samples, total):
+    result = dict(iterations=len(samples),
+                  total_s=round(total, 6),
+                  ops_per_s=round(len(samples) / total, 1),
+                  mean_us=round(sum(samples) / len(samples), 3),
+                  p50_us=round(percentile(samples, 50), 3),
+                  p99_us=round(percentile(samples, 99), 3),
+                  max_us=round(max(samples), 3))
+
+    logger.info(name + ': ' + str(result['ops_per_s']) + ' ops/s, p50 ' + str(result['p50_us']) + ' us, p99 ' + str(result['p99_us']) + ' us')
+
+    return result
+
+
+def measure(name, fn, iterations, warmup=10):
+    # Modules set their own level when first imported, so this runs after each benchmark's imports
+    if verbose == False:
+        for logger_name in quiet_loggers:
+            logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+    for _ in range(min(warmup, iterations)):
+        fn()
+
+    samples = []
+
+    run_start = time.perf_counter()
+
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+
+        fn()
+
+        samples.append((time.perf_counter() - call_start) * 1000000)
+
+    total = time.perf_counter() - run_start
+
+    return summarize_samples(name, samples, total)
+
+
+def import_engine():
+    import marcopolo
+    import ticker
+
+    return marcopolo, ticker
+
+
+def import_time(module, iterations):
+    # Each sample is a fresh interpreter, since a module is only imported once per process
+    code = ('import json, sys, time\n'
+            'start = time.perf_counter()\n'
+            'import ' + module + '\n'
+            'elapsed = time.perf_counter() - start\n'
+            'print(json.dumps([elapsed, [name for name in ' + json.dumps(heavy_modules) + ' if name in sys.modules]]))\n')
+
+    samples = []
+    loaded = set()
+
+    run_start = time.perf_counter()
+
+    for _ in range(iterations):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL)
+
+        elapsed, heavy = json.loads(output.decode().strip().splitlines()[-1])
+
+        samples.append(elapsed * 1000000)
+
+        loaded.update(heavy)
+
+    result = summarize_samples('import_' + module, samples, time.perf_counter() - run_start)
+
+    result['budget_us'] = import_budgets.get(module)
+    result['heavy_modules'] = sorted(loaded)
+
+    result['over_budget'] = len(loaded) > 0 or (result['budget_us'] != None and result['p50_us'] > result['budget_us'])
+
+    if result['over_budget'] == True:
+        logger.warning('import ' + module + ' over budget: p50 ' + str(result['p50_us']) + ' us (budget ' + str(result['budget_us']) +
+                       ' us), heavy modules loaded: ' + str(result['heavy_modules']))
+
+    return result
+
+
+def bench_import_ticker(iterations):
+    return import_time('ticker', iterations)
+
+
+def bench_import_marcopolo(iterations):
+    return import_time('marcopolo', iterations)
+
+
+def mongo_stand_in():
+    # In-memory stand-in for a MongoDB server (dev dependency)
+    import mongomock
+
+    return mongomock.MongoClient()
+
+
+def ticker_messages(markets, count):
+    # Channel 1002 ticker updates cycling through markets: [1002, null, [id, last, ask, bid, change, baseVol, quoteVol, frozen, high, low]]
+    messages = []
+
+    for x in range(count):
+        market_id = x % markets
+
+        price = 0.0001 * (1 + (x % 97) / 1000)
+
+        messages.append(json.dumps([1002, None, [market_id, str(price), str(round(price * 1.001, 8)), str(round(price * 0.999, 8)),
+                                                 '0.01', '100.0', '1000000.0', 0, str(price * 1.05), str(price * 0.95)]]))
+
+    return messages
+
+
+def seed_ticker(db, markets):
+    for market_id in range(markets):
+        db.update_one({'_id': 'BTC_M' + str(market_id)}, {'$set': {'id': market_id, 'highestBid': 0.0001, 'lowestAsk': 0.00010001}}, upsert=True)
+
+
+def bench_on_message(iterations, markets=100):
+    TickerGenerator = import_engine()[1].TickerGenerator
+
+    db = mongo_stand_in().poloniex['ticker']
+
+    seed_ticker(db, markets)
+
+    slack_info = dict(client=None, channels=dict(alerts=(None, None), exceptions=(None, None)))
+
+    ticker_generator = TickerGenerator(slack_info, None, db=db)
+
+    messages = iter(ticker_messages(markets, iterations + 10))
+
+    return measure('ticker_on_message', lambda: ticker_generator.on_message(None, next(messages)), iterations)
+
+
+def bench_ticker_call(iterations, markets=100):
+    Ticker = import_engine()[1].Ticker
+
+    db = mongo_stand_in().poloniex['ticker']
+
+    seed_ticker(db, markets)
+
+    ticker = Ticker(None, db=db)
+
+    return measure('ticker_call', lambda: ticker('BTC_M' + str(markets // 2)), iterations)
+
+
+def bench_book_walk(iterations, levels=100):
+    simulator = ExchangeSimulator(seed=0, depth_levels=levels)
+
+    simulator.set_quote('BTC_STR', 0.0001, 0.00010001)
+
+    bids = simulator.returnOrderBook(currencyPair='BTC_STR', depth=levels)['bids']
+
+    # Amount reaching roughly three quarters of the way down the book
+    amount = sum([bid[1] for bid in bids]) * 0.75
+
+    return measure('book_walk', lambda: tradelogic.depth_price(bids, amount), iterations)
+
+
+def bench_tick_archive_scan(iterations, markets=100, rows=20000):
+    import numpy as np
+
+    import tickarchive
+
+    directory = tempfile.TemporaryDirectory()
+
+    rng = np.random.RandomState(0)
+
+    day = '2018-06-18'
+
+    for market_id in range(markets):
+        ticks = np.zeros(rows, dtype=tickarchive.row_dtype)
+
+        ticks['time'] = tickarchive.day_start(day) + np.sort(rng.uniform(0, 86400, rows))
+        ticks['bid'] = 10000 + rng.randint(-500, 500, rows)
+        ticks['ask'] = ticks['bid'] + 1
+
+        os.makedirs(os.path.join(directory.name, day), exist_ok=True)
+
+        tickarchive.write_day(os.path.join(directory.name, day, 'BTC_M' + str(market_id) + tickarchive.file_suffix), 'BTC_M' + str(market_id), day, ticks)
+
+    def scan():
+        # Maps every market of the day afresh and touches every price once, as a backtest pass would
+        for tick_file in tickarchive.TickArchive(directory.name).scan(day).values():
+            (tick_file['ask'] - tick_file['bid']).min()
+
+    result = measure('tick_archive_scan', scan, iterations, warmup=1)
+
+    directory.cleanup()
+
+    return result
+
+
+def example_trade_doc(market='BTC_STR'):
+    return dict(market=market, trade_id='5b2705f8c9e77c0001a1b2c3', time=datetime.datetime.now(),
+                buy=dict(target=3.53e-05, max=3.54e-05, spend=0.1, spend_actual=0.1, amount_actual=2832.86,
+                         price_actual=3.53e-05, abort_time=datetime.datetime.now(), complete=True,
+                         spend_filled=0.1, amount_filled=2832.86, order_count=2),
+                sell=dict(target=3.58e-05, amount=2832.86, stop=3.49e-05, trail=None, high_water=None, threshold=3.52e-05,
+                          gain_actual=None, amount_actual=None, complete=False, result=None, order_number=None,
+                          stop_active=False, order=10000000003, order_count=3, cancel_count=2),
+                fees=dict(maker=0.001, taker=0.002),
+                parameters=dict(market=market, buy_target=3.53e-05, profit_level=0.015, stop_level=0.01, stop_price=None,
+                                spend_proportion=0.01, price_tolerance=0.001, entry_timeout=5, taker_fee_ok=True, trail_level=None))
+
+
+def bench_trade_doc_update(iterations):
+    db = mongo_stand_in().marcopolo['trades']
+
+    trade_doc = example_trade_doc()
+
+    db.update_one({'_id': 'BTC_STR'}, {'$set': trade_doc}, upsert=True)
+
+    return measure('trade_doc_update', lambda: db.update_one({'_id': 'BTC_STR'}, {'$set': trade_doc}), iterations)
+
+
+def bench_trade_doc_encode(iterations):
+    # Client-side cost of every full-document $set, independent of the stand-in's storage speed
+    trade_doc = {'$set': example_trade_doc()}
+
+    return measure('trade_doc_encode', lambda: bson.BSON.encode(trade_doc), iterations)
+
+
+class ReplayMarket(object):
+
+    # Public market data stand-in following a scheduled price path on a VirtualClock
+
+    def __init__(self, clock, market, path, interval=60):
+        self.market = market
+
+        self.price = path[0]
+
+        for x in range(len(path)):
+            clock.schedule(x * interval, self.set_price, path[x])
+
+
+    def set_price(self, price):
+        self.price = price
+
+
+    def returnTicker(self):
+        return {self.market: dict(last=self.price, highestBid=self.price, lowestAsk=round(self.price + 1e-08, 8))}
+
+
+    def returnChartData(self, currencyPair, period, start, end=None):
+        return [dict(date=start, high=self.price, low=self.price, open=self.price, close=round(self.price + 1e-08, 8))]
+
+
+def bench_trade_cycle(iterations):
+    marcopolo, ticker = import_engine()
+
+    MarcoPolo = marcopolo.MarcoPolo
+    Ticker = ticker.Ticker
+
+    client = mongo_stand_in()
+
+    ticker = Ticker(None, db=client.poloniex['ticker'])
+
+    # Alternating target exit and stop-loss exit
+    paths = [[0.0001, 0.0001, 0.000101, 0.000102],
+             [0.0001, 0.0000995, 0.0000992, 0.0000989, 0.0000985]]
+
+    cycles = [0]
+
+    def trade_cycle():
+        clock = VirtualClock(start=1500000000)
+
+        marcopolo = MarcoPolo(None, ws_ticker=False, debug_mode=True, clock=clock, db=client.marcopolo['trades'], ticker=ticker,
+                              simulator=ExchangeSimulator(seed=cycles[0], time_source=clock.time))
+
+        path = paths[cycles[0] % len(paths)]
+
+        marcopolo.public = ReplayMarket(clock, 'BTC_STR', path)
+
+        marcopolo.create_trade('BTC_STR', path[0], 0.01, 0.01, price_tolerance=0.001, clean_db=True)
+
+        marcopolo.run_trade_cycle()
+
+        cycles[0] += 1
+
+    return measure('trade_cycle', trade_cycle, iterations, warmup=2)
+
+
+# name -> (function, default iterations)
+benchmarks = [('import_ticker', bench_import_ticker, 20),
+              ('import_marcopolo', bench_import_marcopolo, 20),
+              ('ticker_on_message', bench_on_message, 20000),
+              ('ticker_call', bench_ticker_call, 20000),
+              ('book_walk', bench_book_walk, 100000),
+              ('tick_archive_scan', bench_tick_archive_scan, 20),
+              ('trade_doc_update', bench_trade_doc_update, 5000),
+              ('trade_doc_encode', bench_trade_doc_encode, 20000),
+              ('trade_cycle', bench_trade_cycle, 200)]
+
+
+def run(names=None, scale=1.0):
+    report = dict(time=datetime.datetime.utcnow().isoformat(sep=' ', timespec='seconds'),
+                  python=platform.python_version(),
+                  platform=platform.platform(),
+                  commit=None,
+                  results={})
+
+    try:
+        report['commit'] = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+
+    except Exception:
+        pass
+
+    for name, fn, iterations in benchmarks:
+        if names != None and name not in names:
+            continue
+
+        try:
+            report['results'][name] = fn(max(1, int(iterations * scale)))
+
+        except Exception as e:
+            logger.exception('Benchmark ' + name + ' failed.')
+            logger.exception(e)
+
+            report['results'][name] = dict(error=str(e))
+
+    return report
+
+
+def compare(report, baseline, threshold=1.2):
+    # Ratio of p50 latency against a previous report; above threshold counts as a regression
+    rows = []
+
+    for name in report['results']:
+        current = report['results'][name]
+        previous = baseline['results'].get(name)
+
+        if previous == None or 'p50_us' not in current or 'p50_us' not in previous:
+            continue
+
+        ratio = round(current['p50_us'] / previous['p50_us'], 3) if previous['p50_us'] > 0 else None
+
+        rows.append(dict(name=name, baseline_p50_us=previous['p50_us'], p50_us=current['p50_us'], ratio=ratio,
+                         regression=ratio != None and ratio > threshold))
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write JSON report to this file (default stdout).')
+    parser.add_argument('-b', '--baseline', type=str, default=None, help='Previous JSON report to compare against.')
+    parser.add_argument('-t', '--threshold', type=float, default=1.2, help='p50 ratio above baseline reported as a regression.')
+    parser.add_argument('-s', '--scale', type=float, default=1.0, help='Multiplier on default iteration counts.')
+    parser.add_argument('-n', '--names', type=str, nargs='*', default=None, help='Benchmarks to run (default all).')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='Keep module debug logging while measuring.')
+    args = parser.parse_args()
+
+    verbose = args.verbose
+
+    report = run(names=args.names, scale=args.scale)
+
+    regressions = []
+
+    if args.baseline != None:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            report['comparison'] = compare(report, json.load(file), threshold=args.threshold)
+
+        regressions = [row['name'] for row in report['comparison'] if row['regression'] == True]
+
+        for row in report['comparison']:
+            logger.info(row['name'] + ': ' + str(row['ratio']) + 'x baseline p50' + (' (REGRESSION)' if row['regression'] == True else ''))
+
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    else:
+        print(json.dumps(report, indent=2))
+
+    # Import budgets are absolute, so they are checked with or without a baseline
+    regressions += [name for name in report['results'] if report['results'][name].get('over_budget') == True]
+
+    if len(regressions) > 0:
+        sys.exit(1)
@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from clock import Clock
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def subtract(start, end, covered):
+    # [start, end) minus sorted, non-overlapping [s, e) intervals -> list of [s, e) gaps
+    gaps = []
+
+    for covered_start, covered_end in covered:
+        if covered_end <= start:
+            continue
+
+        if covered_start >= end:
+            break
+
+        if covered_start > start:
+            gaps.append([start, covered_start])
+
+        start = max(start, covered_end)
+
+    if start < end:
+        gaps.append([start, end])
+
+    return gaps
+
+
+def merge(covered, start, end):
+    intervals = sorted(covered + [[start, end]])
+
+    merged = [intervals[0]]
+
+    for interval_start, interval_end in intervals[1:]:
+        if interval_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], interval_end)
+
+        else:
+            merged.append([interval_start, interval_end])
+
+    return merged
+
+
+class CandleStore(object):
+
+    def __init__(self, client, root=None, clock=None, refresh_interval=30):
+        # client: anything with returnChartData() (public exchange client or a stand-in)
+        self.client = client
+
+        # Directory completed candles are persisted to, one JSON file per market and period (None keeps them in memory)
+        self.root = root
+
+        self.clock = clock if clock != None else Clock()
+
+        # Seconds a cached copy of the still-forming candle is served before it is fetched again
+        self.refresh_interval = refresh_interval
+
+        self.lock = threading.Lock()
+
+        # (market, period) -> dict(candles={date: candle}, covered=[[start, end), ...]) of completed candles
+        self.series = {}
+
+        # (market, period) -> (fetch time, candles from the forming candle on)
+        self.forming = {}
+
+        self.requests = 0
+        self.hits = 0
+
+
+    def path(self, market, period):
+        return os.path.join(self.root, market + '_' + str(period) + '.json')
+
+
+    def load(self, market, period):
+        if (market, period) not in self.series:
+            series = dict(candles={}, covered=[])
+
+            if self.root != None and os.path.exists(CandleStore.path(self, market, period)):
+                try:
+                    with open(CandleStore.path(self, market, period), 'r', encoding='utf-8') as file:
+                        stored = json.load(file)
+
+                    series = dict(candles={candle['date']: candle for candle in stored['candles']}, covered=stored['covered'])
+
+                except Exception as e:
+                    logger.exception('Exception while loading candle cache for ' + market + '.')
+                    logger.exception(e)
+
+            self.series[(market, period)] = series
+
+        return self.series[(market, period)]
+
+
+    def save(self, market, period):
+        if self.root == None:
+            return
+
+        series = self.series[(market, period)]
+
+        try:
+            os.makedirs(self.root, exist_ok=True)
+
+            path = CandleStore.path(self, market, period)
+
+            with open(path + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump(dict(covered=series['covered'], candles=[series['candles'][date] for date in sorted(series['candles'])]), file)
+
+            os.replace(path + '.tmp', path)
+
+        except Exception as e:
+            logger.exception('Exception while writing candle cache for ' + market + '.')
+            logger.exception(e)
+
+
+    def fetch(self, market, period, start, end):
+        # Candles dated in [start, end]; Poloniex answers an empty range with a single all-zero candle
+        self.requests += 1
+
+        candles = self.client.returnChartData(currencyPair=market, period=period, start=int(start), end=int(end))
+
+        return [candle for candle in candles if candle['date'] != 0]
+
+
+    def candles(self, market, period, start, end=None):
+        # Candles of market/period dated from the one containing start through end (default now), like returnChartData().
+        # Completed candles are fetched once per gap in coverage; the forming candle at most once per refresh_interval.
+        now = self.clock.time()
+
+        end = now if end == None else min(end, now)
+
+        first = int(start) // period * period
+        last = int(end) // period * period
+
+        # Dates before this are complete and never change
+        complete = int(now) // period * period
+
+        with self.lock:
+            series = CandleStore.load(self, market, period)
+
+            gaps = subtract(first, min(last + period, complete), series['covered'])
+
+            for gap_start, gap_end in gaps:
+                for candle in CandleStore.fetch(self, market, period, gap_start, gap_end - 1):
+                    if candle['date'] < complete:
+                        series['candles'][candle['date']] = candle
+
+                series['covered'] = merge(series['covered'], gap_start, gap_end)
+
+            if len(gaps) > 0:
+                CandleStore.save(self, market, period)
+
+                logger.debug('Fetched ' + str(len(gaps)) + ' missing range(s) of ' + market + ' ' + str(period) + ' s candles.')
+
+            else:
+                self.hits += 1
+
+            result = [series['candles'][date] for date in sorted(series['candles']) if first <= date <= last]
+
+            if last >= complete:
+                fetched, forming = self.forming.get((market, period), (None, []))
+
+                if fetched == None or now - fetched >= self.refresh_interval or (len(forming) > 0 and forming[0]['date'] < complete):
+                    forming = CandleStore.fetch(self, market, period, complete, now)
+
+                    self.forming[(market, period)] = (now, forming)
+
+                result += [candle for candle in forming if complete <= candle['date'] <= last]
+
+        return result
+
+
+    def latest(self, market, period=300):
+        # Most recent candle, forming or not (None if the market has none)
+        candles = CandleStore.candles(self, market, period, self.clock.time() - period)
+
+        return candles[-1] if len(candles) > 0 else None
+
+
+    def stats(self):
+        return dict(requests=self.requests, hits=self.hits, series=len(self.series))
+
+
+if __name__ == '__main__':
+    import settings
+    from exchange import get_client
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('market', type=str, help='Market (ex. BTC_STR).')
+    parser.add_argument('-p', '--period', type=int, default=300, help='Candle period in seconds.')
+    parser.add_argument('-s', '--start', type=float, default=None, help='Start timestamp (default 30 days ago).')
+    parser.add_argument('-e', '--end', type=float, default=None, help='End timestamp (default now).')
+    parser.add_argument('-r', '--root', type=str, default=settings.candle_cache_default, help='Candle cache directory.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write candles to this JSON file.')
+    args = parser.parse_args()
+
+    store = CandleStore(get_client(), root=args.root)
+
+    end = args.end if args.end != None else time.time()
+    start = args.start if args.start != None else end - 30 * 86400
+
+    candles = store.candles(args.market, args.period, start, end)
+
+    logger.info(str(len(candles)) + ' candles (' + str(store.requests) + ' request(s)).')
+
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(candles, file)
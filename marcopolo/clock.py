@@ -0,0 +1,116 @@
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+
+class Clock(object):
+
+    # Wall clock used by default; VirtualClock replaces it for debug and simulated runs
+
+    def time(self):
+        return time.time()
+
+
+    def now(self):
+        return datetime.datetime.now()
+
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+    def wait(self, event, timeout):
+        # threading.Event.wait() with the clock's notion of time
+        return event.wait(timeout)
+
+
+    def schedule(self, delay, callback, *args):
+        timer = threading.Timer(delay, callback, args=args)
+
+        timer.daemon = True
+
+        timer.start()
+
+        return timer
+
+
+class VirtualClock(Clock):
+
+    def __init__(self, start=None):
+        # Time only moves when sleep()/wait()/advance() is called, and jumps straight to each scheduled event
+        self.current = start if start is not None else time.time()
+
+        # (due time, sequence, callback, args); sequence keeps same-time events in scheduling order
+        self.events = []
+
+        self.seq = itertools.count()
+
+        self.lock = threading.RLock()
+
+
+    def time(self):
+        return self.current
+
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.current)
+
+
+    def schedule(self, delay, callback, *args):
+        with self.lock:
+            event = (self.current + delay, next(self.seq), callback, args)
+
+            heapq.heappush(self.events, event)
+
+        return event
+
+
+    def schedule_at(self, timestamp, callback, *args):
+        return VirtualClock.schedule(self, max(0, timestamp - self.current), callback, *args)
+
+
+    def pending(self):
+        return len(self.events)
+
+
+    def run_next(self, until):
+        # Runs the earliest event due at or before until; False if there is none
+        with self.lock:
+            if len(self.events) == 0 or self.events[0][0] > until:
+                return False
+
+            due, seq, callback, args = heapq.heappop(self.events)
+
+            self.current = max(self.current, due)
+
+        callback(*args)
+
+        return True
+
+
+    def advance(self, seconds):
+        until = self.current + seconds
+
+        while VirtualClock.run_next(self, until):
+            pass
+
+        self.current = max(self.current, until)
+
+
+    def sleep(self, seconds):
+        VirtualClock.advance(self, seconds)
+
+
+    def wait(self, event, timeout):
+        # Returns as soon as an event callback sets event, at that event's time
+        until = self.current + timeout
+
+        while event.is_set() == False:
+            if VirtualClock.run_next(self, until) == False:
+                self.current = max(self.current, until)
+
+                break
+
+        return event.is_set()
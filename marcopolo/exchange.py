@@ -0,0 +1,241 @@
+import bisect
+import logging
+import threading
+import time
+
+from poloniex import Poloniex
+import requests
+from requests.adapters import HTTPAdapter
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Upper bucket bounds in milliseconds (last bucket catches everything above)
+latency_buckets_ms = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Shared clients keyed by API key (None for public-only client)
+clients = {}
+clients_lock = threading.Lock()
+
+
+class LatencyHistogram(object):
+
+    def __init__(self, buckets=latency_buckets_ms):
+        self.buckets = list(buckets)
+
+        self.counts = [0] * (len(self.buckets) + 1)
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def observe(self, elapsed_ms):
+        self.counts[bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+
+        self.count += 1
+        self.total += elapsed_ms
+
+        if elapsed_ms > self.max:
+            self.max = elapsed_ms
+
+
+    def percentile(self, p):
+        # Upper bound of the bucket containing the requested percentile
+        if self.count == 0:
+            return None
+
+        rank = p / 100 * self.count
+
+        cumulative = 0
+
+        for x in range(0, len(self.counts)):
+            cumulative += self.counts[x]
+
+            if cumulative >= rank:
+                if x < len(self.buckets):
+                    return round(min(self.buckets[x], self.max), 3)
+
+                return round(self.max, 3)
+
+        return round(self.max, 3)
+
+
+    def as_dict(self):
+        return dict(count=self.count,
+                    mean_ms=round(self.total / self.count, 3) if self.count > 0 else None,
+                    p50_ms=self.percentile(50),
+                    p99_ms=self.percentile(99),
+                    max_ms=round(self.max, 3),
+                    buckets=dict(zip([str(bucket) for bucket in self.buckets] + ['inf'], self.counts)))
+
+
+class RateLimiter(object):
+
+    def __init__(self, limit=6):
+        # Stands in for the client's request semaphore: acquire() per call, clear() once per second by the client's timer
+        self.limit = limit
+
+        # Calls made in the current one-second window
+        self.used = 0
+
+        self.condition = threading.Condition(threading.Lock())
+
+        # Time calls spent waiting for a free slot, kept apart from request latency
+        self.wait = LatencyHistogram()
+
+
+    def acquire(self, blocking=True, timeout=None):
+        start = time.perf_counter()
+
+        with self.condition:
+            acquired = self.condition.wait_for(lambda: self.used < self.limit, timeout=timeout if blocking else 0)
+
+            if acquired:
+                self.used += 1
+
+            self.wait.observe((time.perf_counter() - start) * 1000)
+
+        return acquired
+
+
+    def clear(self):
+        with self.condition:
+            self.used = 0
+
+            self.condition.notify_all()
+
+
+    def state(self):
+        with self.condition:
+            return dict(limit=self.limit,
+                        used=self.used,
+                        saturation=round(self.used / self.limit, 3) if self.limit > 0 else None,
+                        wait=self.wait.as_dict())
+
+
+class PooledSession(requests.Session):
+
+    def __init__(self, timeout=(3.05, 10), pool_connections=4, pool_maxsize=16, max_retries=0, observe=None):
+        super(PooledSession, self).__init__()
+
+        # (connect, read) timeout applied to every request that doesn't set its own
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=max_retries)
+
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+        self.headers.update({'Connection': 'keep-alive'})
+
+        # observe(command, elapsed ms) after every HTTP request, so latency excludes client-side rate limit waits
+        self.observe = observe
+
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        start = time.perf_counter()
+
+        try:
+            return super(PooledSession, self).request(method, url, **kwargs)
+
+        finally:
+            if self.observe is not None:
+                # Poloniex sends the command as a query parameter (public) or form field (private)
+                params = kwargs.get('params') or kwargs.get('data') or {}
+
+                self.observe(params.get('command', url), (time.perf_counter() - start) * 1000)
+
+
+class ExchangeClient(Poloniex):
+
+    def __init__(self, apikey=None, secret=None, timeout=(3.05, 10), pool_maxsize=16, limit=6):
+        # command -> dict(latency=LatencyHistogram of HTTP request time, errors={exception name: count})
+        self.endpoint_metrics = {}
+
+        self.metrics_lock = threading.Lock()
+
+        super(ExchangeClient, self).__init__(apikey, secret, limit=limit, semaphore=RateLimiter(limit),
+                                             session=PooledSession(timeout=timeout, pool_maxsize=pool_maxsize, observe=self.observe))
+
+
+    def _public(self, command, **params):
+        return ExchangeClient.timed_call(self, super(ExchangeClient, self)._public, command, params)
+
+
+    def _private(self, command, **params):
+        return ExchangeClient.timed_call(self, super(ExchangeClient, self)._private, command, params)
+
+
+    def endpoint(self, command):
+        # Caller holds self.metrics_lock
+        if command not in self.endpoint_metrics:
+            self.endpoint_metrics[command] = dict(latency=LatencyHistogram(), errors={})
+
+        return self.endpoint_metrics[command]
+
+
+    def observe(self, command, elapsed_ms):
+        with self.metrics_lock:
+            ExchangeClient.endpoint(self, command)['latency'].observe(elapsed_ms)
+
+
+    def timed_call(self, call, command, params):
+        # Latency is recorded by the session around the HTTP request; this counts errors, including API error responses
+        start = time.perf_counter()
+
+        try:
+            return call(command, **params)
+
+        except Exception as e:
+            error = type(e).__name__
+
+            with self.metrics_lock:
+                errors = ExchangeClient.endpoint(self, command)['errors']
+
+                errors[error] = errors.get(error, 0) + 1
+
+            logger.warning(command + ' failed after ' + str(round((time.perf_counter() - start) * 1000, 1)) + ' ms (' + error + ').')
+
+            raise
+
+
+    def metrics(self):
+        with self.metrics_lock:
+            return {command: dict(latency=self.endpoint_metrics[command]['latency'].as_dict(),
+                                  errors=dict(self.endpoint_metrics[command]['errors']))
+                    for command in self.endpoint_metrics}
+
+
+    def rate_limit(self):
+        # Calls used in the current one-second window of the client's request limiter, and time spent waiting on it
+        return self.semaphore.state()
+
+
+    def log_metrics(self):
+        for command, endpoint in sorted(ExchangeClient.metrics(self).items()):
+            logger.info(command + ': n=' + str(endpoint['latency']['count']) +
+                        ' p50=' + str(endpoint['latency']['p50_ms']) + 'ms' +
+                        ' p99=' + str(endpoint['latency']['p99_ms']) + 'ms' +
+                        ' max=' + str(endpoint['latency']['max_ms']) + 'ms' +
+                        ' errors=' + str(sum(endpoint['errors'].values())))
+
+        wait = self.semaphore.wait.as_dict()
+
+        logger.info('rate limit wait: n=' + str(wait['count']) + ' p50=' + str(wait['p50_ms']) + 'ms' +
+                    ' p99=' + str(wait['p99_ms']) + 'ms' + ' max=' + str(wait['max_ms']) + 'ms')
+
+
+def get_client(apikey=None, secret=None, **kwargs):
+    # One pooled client per API key so every trade and the ticker reuse the same connections
+    with clients_lock:
+        if apikey not in clients:
+            clients[apikey] = ExchangeClient(apikey, secret, **kwargs)
+
+        return clients[apikey]
@@ -0,0 +1,114 @@
+import http.server
+import json
+import logging
+from multiprocessing.dummy import Process as Thread
+import socketserver
+import time
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class HealthHandler(http.server.BaseHTTPRequestHandler):
+
+    # GET /health: 200 while the process is serving. GET /ready: 200 only if every check reports ready, else 503.
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+
+        if path not in ['/health', '/ready']:
+            self.send_error(404)
+
+            return
+
+        report = self.server.monitor.report()
+
+        status = 200 if path == '/health' or report['ready'] == True else 503
+
+        body = json.dumps(report, default=str).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        # Probes would otherwise print a line to stderr each
+        logger.debug(self.address_string() + ' ' + (format % args))
+
+
+class HealthServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, monitor, host, port):
+        http.server.HTTPServer.__init__(self, (host, port), HealthHandler)
+
+        self.monitor = monitor
+
+
+class HealthMonitor(object):
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        # Local only by default; port=0 picks a free port (see self.port after start())
+        self.host = host
+        self.port = port
+
+        # (name, check) where check() returns a dict with a 'ready' key
+        self.checks = []
+
+        self.started = time.time()
+
+        self.server = None
+
+
+    def add(self, name, check):
+        self.checks.append((name, check))
+
+
+    def report(self):
+        components = {}
+
+        for name, check in self.checks:
+            try:
+                components[name] = check()
+
+            except Exception as e:
+                # A failing check reports not ready rather than failing the probe
+                components[name] = dict(ready=False, error=type(e).__name__ + ': ' + str(e))
+
+        return dict(ready=all([components[name].get('ready') == True for name in components]),
+                    uptime_s=round(time.time() - self.started, 1),
+                    components=components)
+
+
+    def start(self):
+        self.server = HealthServer(self, self.host, self.port)
+
+        self.port = self.server.server_address[1]
+
+        self.t = Thread(target=self.server.serve_forever)
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.info('Health endpoint at http://' + self.host + ':' + str(self.port) + '/health (readiness at /ready).')
+
+
+    def stop(self):
+        if self.server is None:
+            return
+
+        self.server.shutdown()
+
+        self.server.server_close()
+
+        self.t.join()
+
+        logger.debug('Health endpoint stopped.')
@@ -0,0 +1,426 @@
+import argparse
+import base64
+import collections
+import hashlib
+import itertools
+import json
+import logging
+import math
+import random
+import resource
+import socketserver
+import struct
+import threading
+import time
+
+from exchange import LatencyHistogram
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+websocket_guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def memory_mb():
+    # Current resident set size (Linux), falling back to peak RSS
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return round(int(file.read().split()[1]) * resource.getpagesize() / 1048576, 1)
+
+    except Exception:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class MarketLoad(object):
+
+    def __init__(self, markets=300, rate=1000, seed=None, volatility=0.002, book_ratio=0.0,
+                 burst_factor=1.0, burst_every=60, burst_length=5):
+        # Random-walk tickers for markets pairs at rate messages/s. Market activity is skewed (a few pairs tick
+        # far more often than the rest) and every burst_every seconds the rate is multiplied by burst_factor
+        # for burst_length seconds. book_ratio of messages are order book updates on the market's channel.
+        self.random = random.Random(seed)
+
+        self.rate = rate
+        self.volatility = volatility
+        self.book_ratio = book_ratio
+
+        self.burst_factor = burst_factor
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+
+        self.markets = ['BTC_M' + str(x).zfill(3) for x in range(markets)]
+
+        self.prices = [round(10 ** self.random.uniform(-7, -2), 8) for _ in range(markets)]
+
+        self.spreads = [self.random.uniform(0.0005, 0.005) for _ in range(markets)]
+
+        # Zipf-like activity weights, cumulative for random.choices()
+        self.weights = list(itertools.accumulate([1 / (x + 1) for x in range(markets)]))
+
+        self.seq = [0] * markets
+
+        self.count = 0
+
+
+    def returnTicker(self):
+        # REST ticker snapshot used to populate the ticker collection on connect
+        ticker = {}
+
+        for x in range(len(self.markets)):
+            ticker[self.markets[x]] = MarketLoad.ticker_fields(self, x)
+
+        return ticker
+
+
+    def ticker_fields(self, x):
+        price = self.prices[x]
+
+        return dict(id=x,
+                    last=price,
+                    lowestAsk=round(price * (1 + self.spreads[x] / 2), 8),
+                    highestBid=round(price * (1 - self.spreads[x] / 2), 8),
+                    percentChange=0.0,
+                    baseVolume=100.0,
+                    quoteVolume=round(100.0 / price, 8),
+                    isFrozen=0,
+                    high24hr=round(price * 1.05, 8),
+                    low24hr=round(price * 0.95, 8))
+
+
+    def rate_at(self, elapsed):
+        if self.burst_factor != 1.0 and (elapsed % self.burst_every) < self.burst_length:
+            return self.rate * self.burst_factor
+
+        return self.rate
+
+
+    def next_message(self):
+        x = self.random.choices(range(len(self.markets)), cum_weights=self.weights)[0]
+
+        self.prices[x] = round(self.prices[x] * math.exp(self.random.gauss(0, self.volatility)), 8) or 1e-08
+
+        self.count += 1
+
+        if self.book_ratio > 0 and self.random.random() < self.book_ratio:
+            self.seq[x] += 1
+
+            side = self.random.randint(0, 1)
+
+            rate = self.prices[x] * (1 + (0.5 - side) * self.spreads[x] * self.random.uniform(1, 3))
+
+            return json.dumps([x, self.seq[x], [['o', side, '{:.8f}'.format(rate), '{:.8f}'.format(self.random.uniform(0, 500))]]])
+
+        fields = MarketLoad.ticker_fields(self, x)
+
+        return json.dumps([1002, None, [x, '{:.8f}'.format(fields['last']), '{:.8f}'.format(fields['lowestAsk']),
+                                        '{:.8f}'.format(fields['highestBid']), '0.0', '100.0', str(fields['quoteVolume']), 0,
+                                        '{:.8f}'.format(fields['high24hr']), '{:.8f}'.format(fields['low24hr'])]])
+
+
+class LoadStats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # Scheduled send time of each message not yet processed (messages arrive in order)
+        self.due = collections.deque()
+
+        self.sent = 0
+        self.processed = 0
+
+        self.lag = LatencyHistogram()
+        self.window_lag = LatencyHistogram()
+
+
+    def on_sent(self, due):
+        with self.lock:
+            self.due.append(due)
+
+            self.sent += 1
+
+
+    def on_processed(self):
+        done = time.time()
+
+        with self.lock:
+            lag_ms = (done - self.due.popleft()) * 1000
+
+            self.processed += 1
+
+            self.lag.observe(lag_ms)
+            self.window_lag.observe(lag_ms)
+
+
+    def window(self):
+        with self.lock:
+            window_lag = self.window_lag
+
+            self.window_lag = LatencyHistogram()
+
+        return window_lag
+
+
+def drive(load, send, stats, duration, running=None):
+    # Open-loop pacing: message n is due at its scheduled time whether or not ingestion has kept up,
+    # so a slow consumer shows up as growing lag rather than a lower offered rate
+    start = time.time()
+
+    due = start
+
+    while time.time() - start < duration and (running is None or running.is_set()):
+        now = time.time()
+
+        if due > now:
+            time.sleep(min(due - now, 0.01))
+
+            continue
+
+        stats.on_sent(due)
+
+        send(load.next_message())
+
+        due += 1 / load.rate_at(due - start)
+
+
+class TickerStreamHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        request = b''
+
+        while b'\r\n\r\n' not in request:
+            chunk = self.request.recv(4096)
+
+            if not chunk:
+                return
+
+            request += chunk
+
+        headers = {}
+
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+
+                headers[name.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + websocket_guid).encode()).digest()).decode()
+
+        self.request.sendall(('HTTP/1.1 101 Switching Protocols\r\n'
+                              'Upgrade: websocket\r\n'
+                              'Connection: Upgrade\r\n'
+                              'Sec-WebSocket-Accept: ' + accept + '\r\n\r\n').encode())
+
+        # Subscription acknowledgement, as sent by the exchange (counted so sent/processed stay paired)
+        self.server.stats.on_sent(time.time())
+
+        TickerStreamHandler.send(self, json.dumps([1002, 1]))
+
+        try:
+            drive(self.server.load, lambda message: TickerStreamHandler.send(self, message), self.server.stats,
+                  self.server.duration, running=self.server.running)
+
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning('Ticker stream client disconnected.')
+
+        self.server.finished.set()
+
+        # Closing now would reset the connection and drop frames the client hasn't read yet
+        while self.server.running.is_set():
+            time.sleep(0.1)
+
+
+    def send(self, text):
+        # Unmasked server-to-client text frame
+        payload = text.encode()
+
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x81, len(payload))
+
+        elif len(payload) < 65536:
+            header = struct.pack('!BBH', 0x81, 126, len(payload))
+
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(payload))
+
+        self.request.sendall(header + payload)
+
+
+class LocalTickerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+
+    # Minimal local websocket stand-in for the exchange ticker feed; streams one MarketLoad per connection
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, load, stats, duration, port=0):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', port), TickerStreamHandler)
+
+        self.load = load
+        self.stats = stats
+        self.duration = duration
+
+        self.running = threading.Event()
+        self.running.set()
+
+        self.finished = threading.Event()
+
+
+    def url(self):
+        return 'ws://127.0.0.1:' + str(self.server_address[1]) + '/'
+
+
+def report(stats, start, baseline_mb, last):
+    now = time.time()
+
+    window_lag = stats.window()
+
+    row = dict(elapsed_s=round(now - start, 1),
+               sent=stats.sent,
+               processed=stats.processed,
+               backlog=stats.sent - stats.processed,
+               window_rate=round((stats.processed - last['processed']) / (now - last['time']), 1) if now > last['time'] else None,
+               window_lag_p50_ms=window_lag.percentile(50),
+               window_lag_p99_ms=window_lag.percentile(99),
+               memory_mb=memory_mb())
+
+    row['memory_growth_mb'] = round(row['memory_mb'] - baseline_mb, 1)
+
+    last['processed'] = stats.processed
+    last['time'] = now
+
+    logger.info(json.dumps(row))
+
+    return row
+
+
+def run(ticker_generator, load, duration, mode='direct', report_interval=10):
+    # Drives ticker_generator (a TickerGenerator) with load for duration seconds and returns the report
+    stats = LoadStats()
+
+    original_on_message = ticker_generator.on_message
+
+    def on_message(ws, message):
+        original_on_message(ws, message)
+
+        stats.on_processed()
+
+    ticker_generator.on_message = on_message
+
+    # Populates the ticker collection on connect instead of the exchange REST ticker
+    ticker_generator.api = load
+
+    baseline_mb = memory_mb()
+
+    start = time.time()
+
+    last = dict(processed=0, time=start)
+
+    rows = []
+
+    if mode == 'direct':
+        for market, fields in load.returnTicker().items():
+            ticker_generator.db.update_one({'_id': market}, {'$set': fields}, upsert=True)
+
+        stop_time = start + duration
+
+        while time.time() < stop_time:
+            drive(load, lambda message: on_message(None, message), stats, min(report_interval, stop_time - time.time()))
+
+            rows.append(report(stats, start, baseline_mb, last))
+
+    else:
+        server = LocalTickerServer(load, stats, duration)
+
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+        ticker_generator.ws.url = server.url()
+        ticker_generator.ws.on_message = on_message
+
+        ticker_generator.start()
+
+        while server.finished.wait(report_interval) == False:
+            rows.append(report(stats, start, baseline_mb, last))
+
+        # Let the consumer drain what was already sent
+        drain_start = time.time()
+
+        while stats.processed < stats.sent and time.time() - drain_start < 30:
+            time.sleep(0.1)
+
+        rows.append(report(stats, start, baseline_mb, last))
+
+        server.running.clear()
+
+        ticker_generator.ws.close()
+
+        server.shutdown()
+
+        server.server_close()
+
+    elapsed = time.time() - start
+
+    return dict(mode=mode,
+                markets=len(load.markets),
+                offered_rate=load.rate,
+                duration_s=round(elapsed, 1),
+                sent=stats.sent,
+                processed=stats.processed,
+                throughput=round(stats.processed / elapsed, 1),
+                lag=stats.lag.as_dict(),
+                memory_start_mb=baseline_mb,
+                memory_end_mb=memory_mb(),
+                memory_growth_mb=round(memory_mb() - baseline_mb, 1),
+                windows=rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--markets', type=int, default=300, help='Number of markets.')
+    parser.add_argument('-r', '--rate', type=float, default=1000, help='Offered messages per second.')
+    parser.add_argument('-d', '--duration', type=float, default=60, help='Run length in seconds.')
+    parser.add_argument('--mode', type=str, default='direct', choices=['direct', 'websocket'],
+                        help='Call TickerGenerator.on_message directly, or stream through a local websocket.')
+    parser.add_argument('--mongo', type=str, default=None, help='MongoDB URI (default in-memory stand-in).')
+    parser.add_argument('--book_ratio', type=float, default=0.0, help='Fraction of messages that are order book updates.')
+    parser.add_argument('--burst_factor', type=float, default=1.0, help='Rate multiplier during bursts.')
+    parser.add_argument('--burst_every', type=float, default=60, help='Seconds between burst starts.')
+    parser.add_argument('--burst_length', type=float, default=5, help='Burst length in seconds.')
+    parser.add_argument('--seed', type=int, default=None, help='Random walk seed.')
+    parser.add_argument('-i', '--report_interval', type=float, default=10, help='Seconds between progress reports.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write JSON report to this file (default stdout).')
+    args = parser.parse_args()
+
+    from ticker import TickerGenerator
+
+    logging.getLogger('ticker').setLevel(logging.WARNING)
+
+    if args.mongo != None:
+        from pymongo import MongoClient
+
+        db = MongoClient(args.mongo).loadgen['ticker']
+
+    else:
+        import mongomock
+
+        db = mongomock.MongoClient().loadgen['ticker']
+
+    db.drop()
+
+    slack_info = dict(client=None, channels=dict(alerts=(None, None), exceptions=(None, None)))
+
+    ticker_generator = TickerGenerator(slack_info, args.mongo, db=db)
+
+    load = MarketLoad(markets=args.markets, rate=args.rate, seed=args.seed, book_ratio=args.book_ratio,
+                      burst_factor=args.burst_factor, burst_every=args.burst_every, burst_length=args.burst_length)
+
+    result = run(ticker_generator, load, args.duration, mode=args.mode, report_interval=args.report_interval)
+
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=2)
+
+    else:
+        print(json.dumps(result, indent=2))
@@ -1,65 +1,209 @@
 import argparse
 import configparser
 import datetime
-import json
 import logging
 import multiprocessing as mp
 import os
 import sys
+import threading
 import time
 
-from poloniex import Poloniex
-from pymongo import MongoClient
-
+from account import AccountNotifier
+from candles import CandleStore
+from clock import Clock
+import money
+from portfolio import PortfolioTracker
+from reconcile import OpenOrdersReconciler
+from recovery import recover_trades
+import settings
+from tracing import Tracer
+import tradelogic
+from triggers import TriggerBook
 from ticker import Ticker
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-r', '--restticker', action='store_true', default=False, help='Use REST API for ticker data rather than MongoDB ticker.')
-parser.add_argument('-l', '--live', action='store_true', default=False, help='Activate live trading mode.')
-parser.add_argument('-d', '--dropdb', action='store_true', default=False, help='Drop MongoDB trade collection and start fresh.')
-args = parser.parse_args()
-
-rest_ticker = args.restticker
-live_mode = args.live
-drop_db = args.dropdb
-
-mongo_ip = 'mongodb://192.168.1.179:27017/'
-
-order_number_debug = 10000000000
-trade_id_debug = 10000000
-global_trade_id_debug = 100000000
-
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
 class MarcoPolo:
-    def __init__(self, config_path, ws_ticker=True, slack_alerts=False, debug_mode=False):
-        config = configparser.ConfigParser()
-        config.read(config_path)
+    def __init__(self, config_path, ws_ticker=True, slack_alerts=False, debug_mode=False,
+                 account_notifier=None, reconcile_interval=60, trailing_engine=None, trigger_book=None,
+                 reconciler=None, tracer=None, simulator=None, clock=None, db=None, ticker=None, order_log=None,
+                 trade_archive=None, portfolio=None, mongo_uri=None, max_tick_age=60, candles=None):
+        # Imported here so programs that only embed the engine (ex. the supervisor) don't load Poloniex/requests/pymongo until a trade is created
+        from pymongo import MongoClient
+
+        from archive import TradeArchive
+        from exchange import get_client
+        from orderlog import OrderLog
+        from simulator import ExchangeSimulator
+
+        self.debug_mode = debug_mode
+
+        # All trade cycle waits and timestamps go through the clock (a VirtualClock runs simulated time instantly)
+        self.clock = clock if clock != None else Clock()
+
+        if self.debug_mode == False:
+            config = configparser.ConfigParser()
+            config.read(config_path)
+
+            polo_api = config['poloniex']['api']
+            polo_secret = config['poloniex']['secret']
+
+            # Shared pooled client, reused by every trade created with the same API key
+            self.polo = get_client(polo_api, polo_secret)
+
+            self.public = self.polo
+
+        else:
+            # Orders go to an in-memory matching engine; market data still comes from the exchange
+            self.polo = simulator if simulator != None else ExchangeSimulator(seed=0, time_source=self.clock.time)
+
+            self.public = get_client()
 
-        polo_api = config['poloniex']['api']
-        polo_secret = config['poloniex']['secret']
+        # Chart data for debug_triggers(), fetched once per range instead of on every monitor iteration
+        # (created on first use when not shared, so it wraps whatever self.public is by then)
+        self.candles = candles
 
-        self.polo = Poloniex(polo_api, polo_secret)
+        if mongo_uri == None and (db == None or ticker == None):
+            # [mongodb] section of the same config file the supervisor and ticker use
+            mongo_uri = settings.mongo_uri(settings.load_config(config_path))
 
-        self.db = MongoClient(mongo_ip).marcopolo['trades']
+        self.db = db if db != None else MongoClient(mongo_uri).marcopolo['trades']
+
+        # Raw order responses go to an append-only collection next to the trades; trade docs keep summaries only
+        self.order_log = order_log if order_log != None else OrderLog(self.db.database['orders'])
+
+        # Completed trades are moved here so the next trade on the same market doesn't overwrite them
+        self.trade_archive = trade_archive if trade_archive != None else TradeArchive(self.db.database['trade_archive'])
 
         #if drop_db == True:
         #self.db.drop()
 
-        #self.ticker = MongoClient(mongo_ip).poloniex['ticker']
-        self.ticker = Ticker(mongo_ip)
+        self.ticker = ticker if ticker != None else Ticker(mongo_uri)
 
         self.ws_ticker = ws_ticker
 
-        self.debug_mode = debug_mode
+        # Set by account updates and fired price triggers to wake the monitor loop early
+        self.wake_event = threading.Event()
+
+        # Set by stop(); checked between order steps so the cycle exits with its trade document resumable
+        self.stopping = threading.Event()
+
+        # Pushed order/fill updates from private account websocket (REST polling becomes reconciliation fallback)
+        self.account = account_notifier
+
+        if self.account != None:
+            self.account.add_listener(self.on_account_update)
+
+        self.reconcile_interval = reconcile_interval
+
+        # Shared account-wide open orders snapshot (one returnOpenOrders call per interval for all trades)
+        self.reconciler = reconciler
+
+        # Shared engine recalculating trailing stops for all active trades in one pass per tick batch
+        self.trailing = trailing_engine
+
+        # Shared per-market index of threshold/stop price levels, so ticks are only checked against crossed levels
+        self.triggers = trigger_book
+
+        self.fired_triggers = []
+
+        # (tick received time, ticker read time) of the tick that fired the latest trigger
+        self.fired_trigger_tick = (None, None)
+
+        # Tick-to-order latency spans (path=None keeps spans in memory only)
+        self.tracer = tracer if tracer != None else Tracer(path=None)
+
+        # Shared exposure/PnL aggregator across all open trades, fed by this trade's ticks and fills
+        self.portfolio = portfolio
+
+        # Order decisions are deferred while this market's latest tick is older than this (seconds, None disables)
+        self.max_tick_age = max_tick_age
+
+        # decision -> number of times deferred on a stale tick
+        self.stale_ticks = {}
+
+        self.stale = False
+
+
+    def on_account_update(self, update_type, data):
+        self.wake_event.set()
+
+
+    def stop(self):
+        self.stopping.set()
+
+        self.wake_event.set()
+
+
+    def stop_requested(self):
+        if self.stopping.is_set() == False:
+            return False
+
+        logger.info('Stopping ' + self.market + ' trade cycle between order steps. Trade document left for recovery.')
+
+        return True
+
+
+    def on_trigger(self, trigger):
+        self.fired_trigger_tick = (trigger.tick_time, trigger.polled)
+
+        self.fired_triggers.append(trigger.kind)
+
+        self.wake_event.set()
+
+
+    def get_tick(self):
+        # Tracing measures real latency, so spans stay on wall time
+        polled = time.time()
+
+        if self.ws_ticker == True:
+            tick = self.ticker(self.market)
+        else:
+            tick = self.public.returnTicker()[self.market]
+
+        if self.debug_mode == True:
+            # Simulated book follows the live quote
+            self.polo.set_quote(self.market, tick['highestBid'], tick['lowestAsk'])
+
+        if self.portfolio != None:
+            self.portfolio.mark(self.market, tick['highestBid'])
+
+        span = self.tracer.begin(self.market, tick.get('received'), polled=polled)
+
+        return tick, span
+
+
+    def tick_fresh(self, tick, decision):
+        # REST ticks carry no 'received' and are current when read
+        if self.max_tick_age == None or tick.get('received') == None:
+            return True
+
+        age = self.clock.time() - tick['received']
+
+        if age <= self.max_tick_age:
+            if self.stale == True:
+                logger.info(self.market + ' ticker data fresh again.')
+
+                self.stale = False
+
+            return True
+
+        self.stale_ticks[decision] = self.stale_ticks.get(decision, 0) + 1
+
+        if self.stale == False:
+            logger.warning(self.market + ' last tick is ' + str(round(age, 1)) + ' s old. Deferring order decisions until it updates.')
+
+            self.stale = True
+
+        return False
 
 
     def create_trade(self, market, buy_target, profit_level, stop_level, stop_price=None,
                      spend_proportion=0.01, price_tolerance=0.001, entry_timeout=5,
-                     taker_fee_ok=True, clean_db=False):
+                     taker_fee_ok=True, trail_level=None, clean_db=False):
         create_trade_successful = True
 
         try:
@@ -75,7 +219,7 @@ class MarcoPolo:
             self.buy_target = buy_target
             logger.debug('self.buy_target: ' + str(self.buy_target))
 
-            self.buy_max = round(self.buy_target * (1 + price_tolerance), 8)
+            self.buy_max = tradelogic.buy_max_price(self.buy_target, price_tolerance)
             logger.debug('self.buy_max: ' + str(self.buy_max))
 
             self.spend_proportion = spend_proportion
@@ -97,7 +241,7 @@ class MarcoPolo:
 
             logger.debug('balance_base_currency: ' + str(balance_base_currency))
 
-            self.spend_amount = round(balance_base_currency * self.spend_proportion, 8)
+            self.spend_amount = money.to_value(money.scaled(money.to_units(balance_base_currency), self.spend_proportion))
             logger.debug('self.spend_amount: ' + str(self.spend_amount))
 
             #self.buy_amount_target = round(self.spend_amount * self.buy_target, 8)
@@ -106,14 +250,14 @@ class MarcoPolo:
             self.profit_level = profit_level
             logger.debug('self.profit_level: ' + str(self.profit_level))
 
-            self.sell_price = round(self.buy_target * (1 + self.profit_level), 8)
+            self.sell_price = tradelogic.target_price(self.buy_target, self.profit_level)
             logger.debug('self.sell_price: ' + str(self.sell_price))
 
             self.stop_level = stop_level
             logger.debug('self.stop_level: ' + str(self.stop_level))
 
             if stop_price == None:
-                self.stop_price = round(self.buy_target * (1 - self.stop_level), 8)
+                self.stop_price = tradelogic.stop_loss_price(self.buy_target, self.stop_level)
                 logger.debug('self.stop_price: ' + str(self.stop_price))
 
             else:
@@ -128,7 +272,10 @@ class MarcoPolo:
             self.price_tolerance = price_tolerance
             logger.debug('self.price_tolerance: ' + str(self.price_tolerance))
 
-            self.abort_time = datetime.datetime.now() + datetime.timedelta(minutes=entry_timeout)
+            self.trail_level = trail_level
+            logger.debug('self.trail_level: ' + str(self.trail_level))
+
+            self.abort_time = self.clock.now() + datetime.timedelta(minutes=entry_timeout)
             logger.debug('self.abort_time: ' + str(self.abort_time))
 
             fee_info = self.polo.returnFeeInfo()
@@ -142,7 +289,12 @@ class MarcoPolo:
             self.taker_fee_ok = taker_fee_ok
             logger.debug('self.taker_fee_ok: ' + str(self.taker_fee_ok))
 
-            trade_doc = dict(market=self.market, time=datetime.datetime.now(),
+            from bson import ObjectId
+
+            self.trade_id = str(ObjectId())
+            logger.debug('self.trade_id: ' + self.trade_id)
+
+            trade_doc = dict(market=self.market, trade_id=self.trade_id, time=self.clock.now(),
                              buy=dict(target=self.buy_target,
                                       max=self.buy_max,
                                       spend=self.spend_amount,
@@ -151,18 +303,25 @@ class MarcoPolo:
                                       price_actual=None,
                                       abort_time=self.abort_time,
                                       complete=False,
-                                      orders=[]),
+                                      spend_filled=0,
+                                      amount_filled=0,
+                                      order_count=0),
                              sell=dict(target=self.sell_price,
                                        amount=None,
                                        stop=self.stop_price,
+                                       trail=self.trail_level,
+                                       high_water=None,
                                        threshold=None,
                                        gain_actual=None,
                                        amount_actual=None,
+                                       amount_filled=0,
+                                       gain_filled=0,
                                        complete=False,
                                        result=None,
                                        order_number=None,
                                        stop_active=None,
-                                       orders=[]),
+                                       order_count=0,
+                                       cancel_count=0),
                              fees=dict(maker=self.maker_fee, taker=self.taker_fee),
                              parameters=dict(market=market,
                                              buy_target=buy_target,
@@ -172,7 +331,8 @@ class MarcoPolo:
                                              spend_proportion=spend_proportion,
                                              price_tolerance=price_tolerance,
                                              entry_timeout=entry_timeout,
-                                             taker_fee_ok=taker_fee_ok))
+                                             taker_fee_ok=taker_fee_ok,
+                                             trail_level=trail_level))
 
             if clean_db == True:
                 logger.info('Searching for old MongoDB trade document.')
@@ -214,163 +374,153 @@ class MarcoPolo:
             return create_trade_successful
 
 
-    def run_trade_cycle(self):
-        def debug_triggers():
-            global order_number_debug
-            global global_trade_id_debug
-            global trade_id_debug
-            global order_trades_debug
+    def load_trade(self, trade_doc):
+        # Restore trade parameters from a persisted trade document (crash recovery)
+        parameters = trade_doc['parameters']
 
-            trade_doc = self.db.find_one({'_id': self.market})
+        self.market = trade_doc['market']
+        self.trade_id = trade_doc.get('trade_id', self.market)
+        self.base_currency = self.market.split('_')[0]
+        self.trade_currency = self.market.split('_')[1]
 
-            candle_current = polo.returnChartData(currencyPair=self.market, period=300, start=(datetime.datetime.now().timestamp() - 301))[-1]
+        self.buy_target = trade_doc['buy']['target']
+        self.buy_max = trade_doc['buy']['max']
+        self.spend_proportion = parameters['spend_proportion']
+        self.spend_amount = trade_doc['buy']['spend']
 
-            if candle_current['high'] >= self.sell_price:
-                global_trade_id_debug += 1
-                trade_id_debug += 1
+        self.profit_level = parameters['profit_level']
+        self.sell_price = trade_doc['sell']['target']
 
-                order_trades_debug = []
+        self.stop_level = parameters['stop_level']
+        self.stop_price = trade_doc['sell']['stop']
 
-                order = dict(amount=trade_doc['sell']['amount'],
-                             currencyPair=self.market,
-                             date=datetime.datetime.utcnow().isoformat(sep=' ', timespec='seconds'),
-                             fee=self.maker_fee,
-                             globalTradeID=global_trade_id_debug,
-                             rate=trade_doc['sell']['target'],
-                             total=round((trade_doc['sell']['amount'] * trade_doc['sell']['target']) * (1 - self.maker_fee), 8),
-                             tradeID=trade_id_debug,
-                             type='sell')
+        self.price_tolerance = parameters['price_tolerance']
+        self.trail_level = parameters.get('trail_level')
 
-                order_trades_debug.append(order)
+        self.abort_time = trade_doc['buy']['abort_time']
 
+        self.maker_fee = trade_doc['fees']['maker']
+        self.taker_fee = trade_doc['fees']['taker']
+        self.taker_fee_ok = parameters['taker_fee_ok']
 
-        def generate_debug_order(order_type, rate=None, amount=None, order_number=None):
-            import random
+        logger.info('Loaded trade document for ' + self.market + '.')
 
-            global order_number_debug
-            global trade_id_debug
 
-            order_return = {'success': True, 'result': {}}
+    def apply_trailing_stop(self, trade_doc):
+        # Takes up a stop the trailing engine has raised since the last check; True if the stop moved
+        if self.trail_level == None or self.trailing == None:
+            return False
 
-            try:
-                if order_type == 'buy':
-                    if rate == None or amount == None:
-                        logger.error('Must provide rate and amount for buy order.')
+        trail_stop = self.trailing.stop_price(self.market)
 
-                        order_return['success'] = False
+        if trail_stop == None or trail_stop <= self.stop_price:
+            return False
 
-                    else:
-                        order_number_debug += 1
-
-                        rand_props = []
-                        rand_props.append(round(random.uniform(0.1, 0.9), 8))
-                        rand_props.append(1 - rand_props[0])
-
-                        trade_id_debug_list = []
-                        trade_total_debug_list = []
-
-                        for x in range(0, 2):
-                            trade_id_debug += 1
-                            trade_id_debug_list.append(trade_id_debug)
-
-                            trade_total_debug_list.append((round(amount * rand_props[x], 8), round((amount * rand_props[x]) * (1 - self.taker_fee), 8)))
-
-                        dt_utc = datetime.datetime.utcnow()
-
-                        dt_debug_list = [dt_utc.isoformat(sep=' ', timespec='seconds'), (dt_utc + datetime.timedelta(seconds=1)).isoformat(sep=' ', timespec='seconds')]
-
-                        order_return['result'] = {
-                            'orderNumber': order_number_debug,
-                            'resultingTrades': [
-                                {
-                                    'amount': trade_total_debug_list[0][1],
-                                    'date': dt_debug_list[0],
-                                    'rate': rate,
-                                    'total': (rate * trade_total_debug_list[0][0]),
-                                    'tradeID': trade_id_debug_list[0],
-                                    'type': 'buy'
-                                },
-                                {
-                                    'amount': trade_total_debug_list[1][1],
-                                    'date': dt_debug_list[1],
-                                    'rate': rate,
-                                    'total': (rate * trade_total_debug_list[1][0]),
-                                    'tradeID': trade_id_debug_list[1],
-                                    'type': 'buy'
-                                }
-                            ],
-                            'amountUnfilled': 0.0
-                        }
-
-                elif order_type == 'sell':
-                    if rate == None or amount == None:
-                        logger.error('Must provide rate and amount for buy order.')
-
-                        order_return['success'] = False
+        high_water = self.trailing.high_water_mark(self.market)
 
-                    else:
-                        order_number_debug += 1
+        self.stop_price = trail_stop
 
-                        order_return['result'] = {
-                            'orderNumber': order_number_debug,
-                            'resultingTrades': []
-                        }
+        self.threshold = tradelogic.monitor_threshold(high_water, self.stop_price, self.price_tolerance)
 
-                        open_orders_debug.append(order_return['result'])
+        trade_doc['sell']['stop'] = self.stop_price
+        trade_doc['sell']['high_water'] = high_water
+        trade_doc['sell']['threshold'] = self.threshold
 
-                elif order_type == 'cancel':
-                    if order_number == None:
-                        logger.error('Must provide order number to cancel order.')
+        self.db.update_one({'_id': self.market}, {'$set': {'sell.stop': self.stop_price,
+                                                           'sell.high_water': high_water,
+                                                           'sell.threshold': self.threshold}})
 
-                        order_return['success'] = False
+        logger.info('Trailing stop raised to ' + str(self.stop_price) + ' ' + self.base_currency + '.')
 
-                    else:
-                        trade_doc = self.db.find_one({'_id': self.market})
+        return True
 
-                        cancel_message = 'Order #' + str(trade_doc['sell']['order']) + ' canceled.'
 
-                        order_return['result'] = {
-                            'success': int(1),
-                            'amount': trade_doc['sell']['amount'],
-                            'message': cancel_message
-                        }
+    def execute_stop_loss(self, trade_doc):
+        # immediateOrCancel sells at or below the stop until the sell amount is gone. Fills are saved after each order,
+        # so a cycle resumed mid stop-loss only sells what is left. Returns False if stopped between orders.
+        sell_price = self.stop_price
 
-                        del_pos = -1
+        sold_units = money.to_units(trade_doc['sell'].get('amount_filled', 0))
+        gain_units = money.to_units(trade_doc['sell'].get('gain_filled', 0))
 
-                        for x in range(0, len(open_orders_debug)):
-                            if open_orders_debug[x]['orderNumber'] == trade_doc['sell']['order']:
-                                del_pos = x
+        while (True):
+            if MarcoPolo.stop_requested(self) == True:
+                return False
 
-                                break
+            tick, span = self.get_tick()
 
-                        open_orders_debug.remove(open_orders_debug[del_pos])
+            highest_bid = tick['highestBid']
+            logger.debug('highest_bid: ' + str(highest_bid))
 
-                elif order_type == 'open_orders':
-                    order_return['result'] = open_orders_debug
+            if highest_bid < sell_price:
+                sell_price = highest_bid
 
-                elif order_type == 'order_trades':
-                    order_return['result'] = order_trades_debug
+            sell_amount = money.to_value(money.to_units(trade_doc['sell']['amount']) - sold_units)
 
-            except Exception as e:
-                logger.exception('Exception while generating debug results.')
-                logger.exception(e)
+            span.mark('evaluated')
 
-                order_return['success'] = False
+            span.mark('submitted')
 
-            finally:
-                return order_return
+            result = self.polo.sell(currencyPair=self.market, rate=sell_price, amount=sell_amount, immediateOrCancel=1)
 
+            span.mark('response')
 
-        if self.debug_mode == True:
-            polo_data_file_debug = '../resources/polo_data.json'
+            self.tracer.finish(span, 'stop_loss')
+
+            logger.debug('result: ' + str(result))
+
+            self.order_log.record(self.trade_id, self.market, 'sell', 'stop_loss', result, self.clock.now())
+
+            trade_doc['sell']['order_count'] += 1
+
+            if len(result['resultingTrades']) > 0:
+                for trade in result['resultingTrades']:
+                    sold_units += money.to_units(trade['amount'])
+                    gain_units += money.to_units(trade['total'])
+
+                    if self.portfolio != None:
+                        self.portfolio.fill(self.trade_id, 'sell', trade['amount'], trade['total'], trade['rate'], self.taker_fee)
 
-            # Load debug order and trade data
-            with open(polo_data_file_debug, 'r', encoding='utf-8') as file:
-                polo_data_debug = json.load(file)
+                trade_doc['sell']['amount_filled'] = money.to_value(sold_units)
+                trade_doc['sell']['gain_filled'] = money.to_value(gain_units)
+
+                if result['amountUnfilled'] == 0:
+                    logger.info('Stop-loss order executed successfully.')
+
+                    trade_doc['sell']['amount_actual'] = money.to_value(sold_units)
+                    trade_doc['sell']['gain_actual'] = money.to_value(gain_units)
+
+                    trade_doc['sell']['complete'] = True
+                    trade_doc['sell']['result'] = 'stop'
+
+                    update_result = self.db.update_one({'_id': self.market}, {'$set': trade_doc})
+                    logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
+                    logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
 
-                open_orders_debug = polo_data_debug['open_orders']
+                    return True
+
+                # Running fill totals, so a restart mid stop-loss resumes with the right remaining amount
+                self.db.update_one({'_id': self.market}, {'$set': {'sell.amount_filled': trade_doc['sell']['amount_filled'],
+                                                                   'sell.gain_filled': trade_doc['sell']['gain_filled'],
+                                                                   'sell.order_count': trade_doc['sell']['order_count']}})
+
+                logger.info('Sell partially filled. Continuing.')
+
+            else:
+                logger.info('Sell not executed at requested price. Recalculating and trying again.')
+
+
+    def run_trade_cycle(self):
+        def debug_triggers():
+            # Trade the simulator through the current candle so resting orders the live market reached are filled
+            if self.candles == None:
+                self.candles = CandleStore(self.public, clock=self.clock)
+
+            candle_current = self.candles.latest(self.market, period=300)
+
+            if candle_current != None:
+                self.polo.apply_candle(self.market, candle_current)
 
-                order_trades_debug = {}
 
         ## Main Trade Cycle ##
         trade_cycle_success = True
@@ -378,13 +528,36 @@ class MarcoPolo:
         try:
             trade_doc = self.db.find_one({'_id': self.market})
 
+            # Documents written before order history moved to the order log have no counters
+            trade_doc['buy'].setdefault('order_count', 0)
+            trade_doc['sell'].setdefault('order_count', 0)
+            trade_doc['sell'].setdefault('cancel_count', 0)
+            trade_doc['sell'].setdefault('amount_filled', 0)
+            trade_doc['sell'].setdefault('gain_filled', 0)
+
             ## Entry buy ##
-            entry_buy_complete = False
+            # On resume, fills from before the restart count toward the entry and a completed entry is skipped
+            entry_buy_complete = trade_doc['buy']['complete'] == True
+
+            # Fill totals are kept in integer units (see money.py) so partial fills add up exactly
+            spend_units = money.to_units(trade_doc['buy'].get('spend_filled', 0))
+            amount_units = money.to_units(trade_doc['buy'].get('amount_filled', 0))
 
-            spend_total = 0
-            amount_total = 0
+            if self.portfolio != None:
+                # Entry buys are immediateOrCancel, so fills before a restart paid the taker fee
+                self.portfolio.add(self.trade_id, self.market, amount=money.to_value(amount_units), cost=money.to_value(spend_units),
+                                   fees=money.to_value(money.scaled(spend_units, self.taker_fee)))
+
+                if trade_doc['sell']['amount_filled'] > 0:
+                    # Stop-loss fills from before the restart
+                    self.portfolio.fill(self.trade_id, 'sell', trade_doc['sell']['amount_filled'], trade_doc['sell']['gain_filled'],
+                                        money.to_value(money.div(money.to_units(trade_doc['sell']['gain_filled']),
+                                                                 money.to_units(trade_doc['sell']['amount_filled']))), self.taker_fee)
 
             while entry_buy_complete == False:
+                if MarcoPolo.stop_requested(self) == True:
+                    return trade_cycle_success
+
                 try:
                     if self.taker_fee_ok == True:
                         # Place immediateOrCancel buy at lowest ask
@@ -393,18 +566,16 @@ class MarcoPolo:
                         # If yes, place another immediateOrCancel buy at lowest ask
                         # Continue until spend amount fulfilled or timeout
 
-                        if self.ws_ticker == True:
-                            tick = self.ticker(self.market)
-                        else:
-                            tick = self.polo.returnTicker()[self.market]
+                        tick, span = self.get_tick()
 
                         lowest_ask = tick['lowestAsk']
 
                         logger.info('Lowest Ask: ' + str(lowest_ask) + ' / Max. Buy Price: ' + str(self.buy_max) + ' ' + self.base_currency)
 
-                        if lowest_ask <= self.buy_max:
+                        # A frozen ask could be far from the market, so the buy waits for a fresh tick
+                        if MarcoPolo.tick_fresh(self, tick, 'entry_buy') == True and tradelogic.entry_price_ok(lowest_ask, self.buy_max):
                             #buy_amount = round(lowest_ask * (trade_doc['buy']['spend'] - spend_total), 8)
-                            buy_amount = round((trade_doc['buy']['spend'] - spend_total) / lowest_ask, 8)
+                            buy_amount = tradelogic.entry_buy_amount(money.to_value(money.to_units(trade_doc['buy']['spend']) - spend_units), lowest_ask)
                             logger.debug('buy_amount: ' + str(buy_amount))
 
                             if buy_amount <= 0:
@@ -414,28 +585,37 @@ class MarcoPolo:
 
                                 break
 
-                            if self.debug_mode == False:
-                                result = polo.buy(currencyPair=self.market, rate=lowest_ask, amount=buy_amount, immediateOrCancel=1)
-                            else:
-                                # Simulate buy fulfilment
-                                result = generate_debug_order(order_type='buy', rate=lowest_ask, amount=buy_amount)
+                            span.mark('evaluated')
 
-                                if result['success'] == True:
-                                    result = result['result']
+                            span.mark('submitted')
 
-                                else:
-                                    logger.error('Failed to generate debug trade return. Exiting.')
+                            result = self.polo.buy(currencyPair=self.market, rate=lowest_ask, amount=buy_amount, immediateOrCancel=1)
 
-                                    sys.exit(1)
+                            span.mark('response')
+
+                            self.tracer.finish(span, 'entry_buy')
 
                             logger.debug('result: ' + str(result))
 
-                            if len(result['resultingTrades']) > 0:
-                                trade_doc['buy']['orders'].append(result)
+                            self.order_log.record(self.trade_id, self.market, 'buy', 'entry_buy', result, self.clock.now())
+
+                            trade_doc['buy']['order_count'] += 1
 
+                            if len(result['resultingTrades']) > 0:
                                 for trade in result['resultingTrades']:
-                                    spend_total += trade['total']
-                                    amount_total += trade['amount']
+                                    spend_units += money.to_units(trade['total'])
+                                    amount_units += money.to_units(trade['amount'])
+
+                                    if self.portfolio != None:
+                                        self.portfolio.fill(self.trade_id, 'buy', trade['amount'], trade['total'], trade['rate'], self.taker_fee)
+
+                                trade_doc['buy']['spend_filled'] = money.to_value(spend_units)
+                                trade_doc['buy']['amount_filled'] = money.to_value(amount_units)
+
+                                # Running fill totals, so a restart mid-entry resumes with the right remaining spend
+                                self.db.update_one({'_id': self.market}, {'$set': {'buy.spend_filled': trade_doc['buy']['spend_filled'],
+                                                                                   'buy.amount_filled': trade_doc['buy']['amount_filled'],
+                                                                                   'buy.order_count': trade_doc['buy']['order_count']}})
 
                                 if result['amountUnfilled'] == 0:
                                     logger.info('Entry buy complete.')
@@ -452,11 +632,11 @@ class MarcoPolo:
                         # Create "BFB" order that follows price
                         pass
 
-                    if datetime.datetime.now() >= self.abort_time:
+                    if self.clock.now() >= self.abort_time:
                         logger.warning('Entry buy not completed before timeout reached.')
 
                         # If no buys executed
-                        if spend_total == 0:
+                        if spend_units == 0:
                             logger.warning('No buys executed. Removing trade document and exiting.')
 
                             delete_result = self.db.delete_one({'_id': self.market})
@@ -469,20 +649,20 @@ class MarcoPolo:
 
                             logger.warning('Continuing trade cycle with partial buy amount.')
 
-                    time.sleep(0.2)     # To keep API calls to under 6 per second (very conservatively)
+                    self.clock.sleep(0.2)     # To keep API calls to under 6 per second (very conservatively)
 
                 except Exception as e:
                     logger.exception('Exception while placing entry buy.')
                     logger.exception(e)
 
             if entry_buy_complete == True:
-                trade_doc['buy']['spend_actual'] = round(spend_total, 8)
-                trade_doc['buy']['amount_actual'] = round(amount_total, 8)
-                trade_doc['buy']['price_actual'] = round(spend_total / amount_total, 8)
+                trade_doc['buy']['spend_actual'] = money.to_value(spend_units)
+                trade_doc['buy']['amount_actual'] = money.to_value(amount_units)
+                trade_doc['buy']['price_actual'] = money.to_value(money.div(spend_units, amount_units))
 
                 trade_doc['buy']['complete'] = True
 
-                trade_doc['sell']['amount'] = round(amount_total, 8)
+                trade_doc['sell']['amount'] = money.to_value(amount_units)
 
                 update_result = self.db.update_one({'_id': self.market}, {'$set': trade_doc}, upsert=True)
                 logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
@@ -496,28 +676,25 @@ class MarcoPolo:
 
             trade_doc = self.db.find_one({'_id': self.market})
 
-            while (True):
+            # Resumed trades with a resting sell or active stop-loss monitor go straight to monitoring
+            while trade_doc['sell'].get('order') == None and trade_doc['sell']['stop_active'] != True:
+                if MarcoPolo.stop_requested(self) == True:
+                    return trade_cycle_success
+
                 try:
                     ## Place sell order ##
-                    if self.debug_mode == False:
-                        result = polo.sell(currencyPair=self.market, rate=self.sell_price, amount=trade_doc['sell']['amount'])
-                    else:
-                        # Simulate sell fulfilment
-                        result = generate_debug_order(order_type='sell', rate=self.sell_price, amount=trade_doc['sell']['amount'])
-
-                        if result['success'] == True:
-                            result = result['result']
-
-                        else:
-                            logger.error('Failed to generate debug trade return. Exiting.')
-
-                            sys.exit(1)
+                    result = self.polo.sell(currencyPair=self.market, rate=self.sell_price, amount=trade_doc['sell']['amount'])
 
                     logger.debug('result: ' + str(result))
 
                     trade_doc['sell']['order'] = result['orderNumber']
 
-                    trade_doc['sell']['orders'].append(result)
+                    self.order_log.record(self.trade_id, self.market, 'sell', 'sell', result, self.clock.now())
+
+                    trade_doc['sell']['order_count'] += 1
+
+                    if self.reconciler != None and self.debug_mode == False:
+                        self.reconciler.track(result['orderNumber'])
 
                     update_result = self.db.update_one({'_id': self.market}, {'$set': trade_doc})
                     logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
@@ -530,27 +707,33 @@ class MarcoPolo:
 
                     logger.warning('Failed to place sell order. Retrying in 30 seconds.')
 
-                    time.sleep(30)
+                    self.clock.sleep(30)
 
-            logger.info('Sell order placed at ' + str(self.sell_price) + ' ' + self.base_currency + '.')
+            logger.info('Sell order at ' + str(self.sell_price) + ' ' + self.base_currency + ': #' + str(trade_doc['sell']['order']))
 
             ## Monitor conditions in real-time
 
-            stop_active = False
+            stop_active = trade_doc['sell']['stop_active'] == True
 
             trade_doc['sell']['stop_active'] = stop_active
 
-            if trade_doc['buy']['price_actual'] < self.buy_target:
-                baseline = trade_doc['buy']['price_actual']
-
-            else:
-                baseline = self.buy_target
+            baseline = tradelogic.threshold_baseline(trade_doc['buy']['price_actual'], self.buy_target)
 
-            self.threshold = round(baseline - ((baseline - self.stop_price) * self.price_tolerance), 8)
+            self.threshold = tradelogic.monitor_threshold(baseline, self.stop_price, self.price_tolerance)
 
             trade_doc['sell']['threshold'] = self.threshold
             logger.debug('trade_doc[\'sell\'][\'threshold\']: ' + str(trade_doc['sell']['threshold']))
 
+            if self.trail_level != None and self.trailing != None:
+                high_water = trade_doc['sell'].get('high_water') if trade_doc['sell'].get('high_water') != None else baseline
+
+                self.stop_price = self.trailing.add(self.market, self.market, high_water, self.trail_level, stop_price=self.stop_price)
+
+                trade_doc['sell']['stop'] = self.stop_price
+                trade_doc['sell']['high_water'] = high_water
+
+                logger.info('Trailing stop active at ' + str(self.stop_price) + ' ' + self.base_currency + '.')
+
             update_result = self.db.update_one({'_id': self.market}, {'$set': trade_doc})
             logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
             logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
@@ -559,52 +742,83 @@ class MarcoPolo:
 
             main_monitor_start = 0
 
+            last_reconcile = 0
+
+            threshold_trigger = None
+
+            stop_triggers = None
+
             while (True):
+                if MarcoPolo.stop_requested(self) == True:
+                    return trade_cycle_success
+
                 try:
                     ## Monitor price/sell order status and execute stop-loss if necessary ##
 
+                    if MarcoPolo.apply_trailing_stop(self, trade_doc) == True and threshold_trigger != None:
+                        # Re-added at the new threshold below
+                        self.triggers.remove(threshold_trigger)
+
+                        threshold_trigger = None
+
                     # If market price above (buy_target * (1 - price_tolerance)), set limit sell
                     # If market price below (buy_target * (1 - price_tolerance)), remove limit sell and monitor for stop-loss execution trigger
 
                     # Limit sell currently on book
                     if stop_active == False:
-                        if self.ws_ticker == True:
-                            tick = self.ticker(self.market)
+                        if self.triggers != None:
+                            # Trigger index fires once this market's bid crosses the threshold
+                            if threshold_trigger == None:
+                                threshold_trigger = self.triggers.add(self.market, self.market, 'threshold', self.threshold, 'below', callback=self.on_trigger)
+
+                            below_threshold = 'threshold' in self.fired_triggers
+
+                            if below_threshold == True:
+                                span = self.tracer.begin(self.market, self.fired_trigger_tick[0], polled=self.fired_trigger_tick[1])
+
+                                del self.fired_triggers[:]
+
+                                threshold_trigger = None
+
                         else:
-                            tick = self.polo.returnTicker()[self.market]
+                            tick, span = self.get_tick()
 
-                        highest_bid = tick['highestBid']
+                            highest_bid = tick['highestBid']
 
-                        if (time.time() - main_monitor_start) > 300:
-                            logger.debug('highest_bid: ' + str(highest_bid) + ' / self.threshold: ' + str(self.threshold))
+                            if (self.clock.time() - main_monitor_start) > 300:
+                                logger.debug('highest_bid: ' + str(highest_bid) + ' / self.threshold: ' + str(self.threshold))
+
+                                main_monitor_start = self.clock.time()
 
-                            main_monitor_start = time.time()
+                            below_threshold = MarcoPolo.tick_fresh(self, tick, 'threshold') == True and tradelogic.below_threshold(highest_bid, self.threshold)
+
+                        if below_threshold == True:
+                            span.mark('evaluated')
 
-                        if highest_bid < self.threshold:
                             logger.info('Highest bid below stop-loss monitoring threshold. Canceling current sell order.')
 
                             while (True):
-                                # Remove sell order
-                                if self.debug_mode == False:
-                                    cancel_result = polo.cancelOrder(trade_doc['sell']['order'])
-                                else:
-                                    # Simulate successful cancel
-                                    cancel_result = generate_debug_order(order_type='cancel', order_number=trade_doc['sell']['order'])
+                                if MarcoPolo.stop_requested(self) == True:
+                                    return trade_cycle_success
 
-                                    if cancel_result['success'] == True:
-                                        cancel_result = cancel_result['result']
+                                # Remove sell order
+                                span.mark('submitted')
 
-                                    else:
-                                        logger.error('Failed to generate debug trade return. Exiting.')
+                                cancel_result = self.polo.cancelOrder(trade_doc['sell']['order'])
 
-                                        sys.exit(1)
+                                span.mark('response')
 
                                 logger.debug('cancel_result: ' + str(cancel_result))
 
                                 if cancel_result['success'] == 1:
+                                    self.tracer.finish(span, 'cancel')
+
                                     logger.info(cancel_result['message'])
 
-                                    trade_doc['sell']['orders'].append(cancel_result)
+                                    self.order_log.record(self.trade_id, self.market, 'sell', 'cancel',
+                                                          dict(cancel_result, orderNumber=trade_doc['sell']['order']), self.clock.now())
+
+                                    trade_doc['sell']['cancel_count'] += 1
 
                                     logger.info('Sell order cancelled successfully.')
 
@@ -631,42 +845,62 @@ class MarcoPolo:
                                         logger.info('cancel_result[\'message\']: ' + cancel_result['message'])
 
                         else:
-                            if self.debug_mode == False:
-                                open_orders = polo.returnOpenOrders(currencyPair=self.market)
-                            else:
-                                # Simulate sell if target price has been reached
-                                debug_triggers()
+                            order_open = None
 
-                                #open_orders = trade_doc['sell']['orders']
-                                open_orders = generate_debug_order(order_type='open_orders')
+                            if self.account is not None and self.debug_mode == False and self.account.ready() == True:
+                                order_open = self.account.is_open(trade_doc['sell']['order'])
 
-                                if open_orders['success'] == True:
-                                    open_orders = open_orders['result']
+                                if order_open != False:
+                                    if (self.clock.time() - last_reconcile) < self.reconcile_interval:
+                                        # Trust pushed order state between slow REST reconciliations
+                                        order_open = True
 
-                                else:
-                                    logger.error('Failed to generate debug trade return. Exiting.')
+                                    else:
+                                        order_open = None
 
-                                    sys.exit(1)
+                            if order_open == None:
+                                open_orders = []
 
-                            for order in open_orders:
-                                if order['orderNumber'] == trade_doc['sell']['order']:
-                                    break
+                                if self.debug_mode == False and self.reconciler != None:
+                                    order_open = self.reconciler.is_open(trade_doc['sell']['order'])
 
-                            else:
-                                logger.info('Sell order not found in open orders. Checking order info.')
+                                if self.debug_mode == True:
+                                    # Simulate sell if target price has been reached
+                                    debug_triggers()
+
+                                    open_orders = self.polo.returnOpenOrders(currencyPair=self.market)
+
+                                elif order_open == None:
+                                    # No shared snapshot can answer (none taken yet, or refreshes failing)
+                                    open_orders = self.polo.returnOpenOrders(currencyPair=self.market)
+
+                                last_reconcile = self.clock.time()
+
+                                for order in open_orders:
+                                    if order['orderNumber'] == trade_doc['sell']['order']:
+                                        order_open = True
+
+                                        break
 
-                                if self.debug_mode == False:
-                                    order_trades = polo.returnOrderTrades(trade_doc['sell']['order'])
                                 else:
-                                    order_trades = generate_debug_order(order_type='order_trades')
+                                    if order_open == None:
+                                        order_open = False
 
-                                    if order_trades['success'] == True:
-                                        order_trades = order_trades['result']
+                            if order_open == False:
+                                logger.info('Sell order not found in open orders. Checking order info.')
 
-                                    else:
-                                        logger.error('Failed to generate debug trade return. Exiting.')
+                                order_trades = []
+
+                                if self.account is not None and self.debug_mode == False:
+                                    if self.account.close_reason(trade_doc['sell']['order']) == 'filled':
+                                        order_trades = self.account.get_order_trades(trade_doc['sell']['order'])
+
+                                        if money.total([trade['amount'] for trade in order_trades]) < money.to_units(trade_doc['sell']['amount']):
+                                            # Notifier missed some fills (ex. reconnect), so take the full list from REST
+                                            order_trades = []
 
-                                        sys.exit(1)
+                                if len(order_trades) == 0:
+                                    order_trades = self.polo.returnOrderTrades(trade_doc['sell']['order'])
 
                                 logger.debug('order_trades: ' + str(order_trades))
 
@@ -675,19 +909,21 @@ class MarcoPolo:
                                     # Make sure amount bought = amount sold
                                     # Log to db
                                     # Archive trade doc?
-                                    order_trades_dict = {'order_trades': order_trades}
+                                    self.order_log.record(self.trade_id, self.market, 'sell', 'order_trades',
+                                                          {'orderNumber': trade_doc['sell']['order'], 'order_trades': order_trades}, self.clock.now())
 
-                                    trade_doc['sell']['orders'].append(order_trades_dict)
-
-                                    amount_total = 0
-                                    gain_total = 0
+                                    amount_units = 0
+                                    gain_units = 0
 
                                     for trade in order_trades:
-                                        amount_total += trade['amount']
-                                        gain_total += trade['total']
+                                        amount_units += money.to_units(trade['amount'])
+                                        gain_units += money.to_units(trade['total'])
+
+                                        if self.portfolio != None:
+                                            self.portfolio.fill(self.trade_id, 'sell', trade['amount'], trade['total'], trade['rate'], self.maker_fee)
 
-                                    trade_doc['sell']['amount_actual'] = amount_total
-                                    trade_doc['sell']['gain_actual'] = gain_total
+                                    trade_doc['sell']['amount_actual'] = money.to_value(amount_units)
+                                    trade_doc['sell']['gain_actual'] = money.to_value(gain_units)
 
                                     trade_doc['sell']['complete'] = True
                                     trade_doc['sell']['result'] = 'target'
@@ -716,43 +952,96 @@ class MarcoPolo:
                         stop_monitor_start = 0
 
                         while (True):
+                            if MarcoPolo.stop_requested(self) == True:
+                                return trade_cycle_success
+
+                            if trade_doc['sell']['amount_filled'] > 0:
+                                # Stop-loss interrupted after partial fills (restart or exception) sells the rest without waiting for the trigger again
+                                logger.info('Resuming stop-loss with ' + str(trade_doc['sell']['amount_filled']) + ' ' + self.trade_currency + ' already sold.')
+
+                                if MarcoPolo.execute_stop_loss(self, trade_doc) == False:
+                                    return trade_cycle_success
+
+                                break
+
+                            if MarcoPolo.apply_trailing_stop(self, trade_doc) == True and stop_triggers != None:
+                                # Re-added at the new threshold and stop approach levels below
+                                for trigger_id in stop_triggers:
+                                    self.triggers.remove(trigger_id)
+
+                                stop_triggers = None
+
                             # Monitor for stop-loss condition and execute if necessary
-                            if self.ws_ticker == True:
-                                tick = self.ticker(self.market)
+                            if self.triggers != None:
+                                if stop_triggers == None:
+                                    stop_triggers = [self.triggers.add(self.market, self.market, 'rearm', self.threshold, 'above', callback=self.on_trigger),
+                                                     self.triggers.add(self.market, self.market, 'stop_approach', tradelogic.stop_approach_price(self.stop_price, self.price_tolerance),
+                                                                       'below', inclusive=True, callback=self.on_trigger)]
+
+                                self.clock.wait(self.wake_event, 1)
+
+                                self.wake_event.clear()
+
+                                if len(self.fired_triggers) == 0:
+                                    continue
+
+                                span = self.tracer.begin(self.market, self.fired_trigger_tick[0], polled=self.fired_trigger_tick[1])
+
+                                above_threshold = 'rearm' in self.fired_triggers
+                                approaching_stop = 'stop_approach' in self.fired_triggers
+
+                                del self.fired_triggers[:]
+
+                                for trigger_id in stop_triggers:
+                                    self.triggers.remove(trigger_id)
+
+                                stop_triggers = None
+
                             else:
-                                tick = polo.returnTicker()[self.market]
+                                tick, span = self.get_tick()
 
-                            highest_bid = tick['highestBid']
+                                highest_bid = tick['highestBid']
 
-                            if (time.time() - stop_monitor_start) > 300:
-                                logger.debug('highest_bid: ' + str(highest_bid) + ' / self.threshold: ' + str(self.threshold))
+                                if (self.clock.time() - stop_monitor_start) > 300:
+                                    logger.debug('highest_bid: ' + str(highest_bid) + ' / self.threshold: ' + str(self.threshold))
+
+                                    stop_monitor_start = self.clock.time()
 
-                                stop_monitor_start = time.time()
+                                fresh = MarcoPolo.tick_fresh(self, tick, 'stop_monitor')
+
+                                above_threshold = fresh == True and tradelogic.above_threshold(highest_bid, self.threshold)
+                                approaching_stop = fresh == True and tradelogic.approaching_stop(highest_bid, self.stop_price, self.price_tolerance)
+
+                            if above_threshold == True:
+                                span.mark('evaluated')
 
-                            if highest_bid > self.threshold:
                                 logger.info('Price above stop-loss monitoring threshold. Placing sell order.')
 
                                 while (True):
+                                    if MarcoPolo.stop_requested(self) == True:
+                                        return trade_cycle_success
+
                                     try:
                                         ## Place sell order ##
-                                        if self.debug_mode == False:
-                                            result = polo.sell(currencyPair=self.market, rate=self.sell_price, amount=trade_doc['sell']['amount'])
-                                        else:
-                                            # Simulate sell fulfilment
-                                            result = generate_debug_order(order_type='sell', rate=self.sell_price, amount=trade_doc['sell']['amount'])
+                                        span.mark('submitted')
 
-                                            if result['success'] == True:
-                                                result = result['result']
+                                        result = self.polo.sell(currencyPair=self.market, rate=self.sell_price, amount=trade_doc['sell']['amount'])
 
-                                            else:
-                                                logger.error('Failed to generate debug trade return. Exiting.')
+                                        span.mark('response')
 
-                                                sys.exit(1)
+                                        self.tracer.finish(span, 'rearm_sell')
 
                                         logger.debug('result: ' + str(result))
 
                                         trade_doc['sell']['order'] = result['orderNumber']
 
+                                        self.order_log.record(self.trade_id, self.market, 'sell', 'sell', result, self.clock.now())
+
+                                        trade_doc['sell']['order_count'] += 1
+
+                                        if self.reconciler != None and self.debug_mode == False:
+                                            self.reconciler.track(result['orderNumber'])
+
                                         update_result = self.db.update_one({'_id': self.market}, {'$set': trade_doc})
                                         logger.debug('update_result.matched_count: ' + str(update_result.matched_count))
                                         logger.debug('update_result.modified_count: ' + str(update_result.modified_count))
@@ -764,7 +1053,7 @@ class MarcoPolo:
 
                                         logger.warning('Failed to place sell order. Retrying.')
 
-                                        time.sleep(5)
+                                        self.clock.sleep(5)
 
                                 logger.info('Sell order placed at ' + str(self.sell_price) + ' ' + self.base_currency + '.')
 
@@ -780,88 +1069,83 @@ class MarcoPolo:
 
                                 break
 
-                            elif highest_bid <= (self.stop_price * (1 + self.price_tolerance)):
+                            elif approaching_stop == True:
                                 logger.info('Price approaching stop-loss trigger level. Beginning orderbook monitoring.')
 
                                 # Begin orderbook checks for stop-loss triggering
-                                if self.ws_ticker == True:
-                                    tick = self.ticker(self.market)
-                                else:
-                                    tick = polo.returnTicker()[self.market]
+                                tick, span = self.get_tick()
 
                                 highest_bid = tick['highestBid']
                                 logger.debug('highest_bid: ' + str(highest_bid))
 
-                                while highest_bid <= (self.stop_price * (1 + self.price_tolerance)):
-                                    ob = polo.returnOrderBook(currencyPair=self.market)
+                                while tradelogic.approaching_stop(highest_bid, self.stop_price, self.price_tolerance):
+                                    if MarcoPolo.stop_requested(self) == True:
+                                        return trade_cycle_success
 
-                                    amount_total = 0
-                                    for bid in ob['bids']:
-                                        amount_total += float(bid[1])
+                                    ob = self.polo.returnOrderBook(currencyPair=self.market)
 
-                                        if amount_total >= trade_doc['sell']['amount']:
-                                            if float(bid[0]) <= self.stop_price:
-                                                # Execute stop-loss order
-                                                sell_price = self.stop_price
+                                    # Price at which the bid side can absorb the full sell amount
+                                    depth_price = tradelogic.depth_price(ob['bids'], trade_doc['sell']['amount'])
 
-                                                sold_total = 0
+                                    if depth_price != None and tradelogic.stop_triggered(depth_price, self.stop_price):
+                                        # Execute stop-loss order
+                                        if MarcoPolo.execute_stop_loss(self, trade_doc) == False:
+                                            return trade_cycle_success
 
-                                                while (True):
-                                                    if self.ws_ticker == True:
-                                                        tick = self.ticker(self.market)
-                                                    else:
-                                                        tick = self.polo.returnTicker()[self.market]
-
-                                                    highest_bid = tick['highestBid']
-                                                    logger.debug('highest_bid: ' + str(highest_bid))
+                                        break
 
-                                                    if highest_bid < sell_price:
-                                                        sell_price = highest_bid
+                                    self.clock.sleep(0.2)
 
-                                                    sell_amount = trade_doc['sell']['amount'] - sold_total
+                                    tick, span = self.get_tick()
 
-                                                    if self.debug_mode == False:
-                                                        result = polo.sell(currencyPair=self.market, rate=sell_price, amount=sell_amount, immedateOrCancel=1)
-                                                    else:
-                                                        # Simulate sell fulfilment
-                                                        result = generate_debug_order(order_type='sell', rate=sell_price, amount=sell_amount)
+                                    highest_bid = tick['highestBid']
 
-                                                        if result['success'] == True:
-                                                            result = result['result']
+                                if trade_doc['sell']['complete'] == True:
+                                    break
 
-                                                        else:
-                                                            logger.error('Failed to generate debug trade return. Exiting.')
+                            else:
+                                # Polling between threshold and stop approach level
+                                self.clock.sleep(0.2)
 
-                                                            sys.exit(1)
+                    if trade_doc['sell']['complete'] == True:
+                        break
 
-                                                    logger.debug('result: ' + str(result))
+                    if stop_active == False and ((self.account != None and self.account.ready() == True) or self.triggers != None):
+                        # Wakes immediately on order/fill push or fired trigger instead of sleeping the full interval
+                        self.clock.wait(self.wake_event, 5)
 
-                                                    if len(result['resultingTrades']) > 0:
-                                                        trade_doc['sell']['orders'].append(result)
+                        self.wake_event.clear()
 
-                                                        for trade in result['resultingTrades']:
-                                                            sold_total += trade['amount']
+                    else:
+                        self.clock.sleep(5)
 
-                                                        if result['amountUnfilled'] == 0:
-                                                            logger.info('Stop-loss order executed successfully.')
+                except Exception as e:
+                    logger.exception('Exception while monitoring sell conditions.')
+                    logger.exception(e)
 
-                                                            trade_doc['sell']['complete'] = True
-                                                            trade_doc['sell']['result'] = 'stop'
+            if self.trailing != None:
+                self.trailing.remove(self.market)
 
-                                                            break
+            if self.triggers != None:
+                self.triggers.remove_trade(self.market)
 
-                                                        else:
-                                                            logger.info('Sell partially filled. Continuing.')
+            if self.portfolio != None:
+                self.portfolio.remove(self.trade_id)
 
-                                                    else:
-                                                        logger.info('Sell not executed at requested price. Recalculating and trying again.')
+            if len(self.stale_ticks) > 0:
+                logger.warning('Order decisions deferred on stale ticks: ' + str(self.stale_ticks))
 
-                                    time.sleep(0.2)
+            if trade_doc['sell']['complete'] == True:
+                try:
+                    archived = self.trade_archive.archive(trade_doc, self.clock.now())
+                    logger.info('Trade archived with PnL ' + str(archived['pnl']) + ' ' + self.base_currency + '.')
 
-                    time.sleep(5)
+                    delete_result = self.db.delete_one({'_id': self.market})
+                    logger.debug('delete_result.deleted_count: ' + str(delete_result.deleted_count))
 
                 except Exception as e:
-                    logger.exception('Exception while monitoring sell conditions.')
+                    # Live document is left in place so the completed trade isn't lost
+                    logger.exception('Exception while archiving completed trade.')
                     logger.exception(e)
 
             logger.info('Exiting trade cycle.')
@@ -877,12 +1161,30 @@ class MarcoPolo:
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--restticker', action='store_true', default=False, help='Use REST API for ticker data rather than MongoDB ticker.')
+    parser.add_argument('-l', '--live', action='store_true', default=False, help='Activate live trading mode.')
+    parser.add_argument('-d', '--dropdb', action='store_true', default=False, help='Drop MongoDB trade collection and start fresh.')
+    parser.add_argument('-R', '--recover', action='store_true', default=False, help='Resume unfinished trade cycles from MongoDB trade documents.')
+    args = parser.parse_args()
+
+    rest_ticker = args.restticker
+    live_mode = args.live
+    drop_db = args.dropdb
+    recover_mode = args.recover
+
     #import multiprocessing as mp
 
+    from pymongo import MongoClient
+
+    from exchange import get_client
+    from simulator import ExchangeSimulator
+    from trailing import TrailingStopEngine
+
     try:
-        polo = Poloniex()
+        polo = get_client()
 
-        test_config_path = '../config/config.ini'
+        test_config_path = settings.config_path_default
 
         if rest_ticker == True:
             ws_ticker_switch = False
@@ -898,7 +1200,61 @@ if __name__ == '__main__':
         ws_ticker_switch = True
         ################
 
-        marcopolo = MarcoPolo(config_path=test_config_path, ws_ticker=ws_ticker_switch, debug_mode=debug_switch)
+        account_notifier = None
+
+        if live_mode == True:
+            config = configparser.ConfigParser()
+            config.read(test_config_path)
+
+            logger.info('Starting account notification websocket.')
+
+            account_notifier = AccountNotifier(config['poloniex']['api'], config['poloniex']['secret'], markets=polo.returnTicker())
+
+            account_notifier.start()
+
+        mongo_uri = settings.mongo_uri(settings.load_config(test_config_path))
+
+        trailing_engine = TrailingStopEngine(db=MongoClient(mongo_uri).marcopolo['trades'])
+
+        trigger_book = TriggerBook(max_tick_age=60)
+
+        portfolio = PortfolioTracker(db=MongoClient(mongo_uri).marcopolo['portfolio'])
+
+        reconciler = None
+
+        if live_mode == True:
+            reconciler = OpenOrdersReconciler(get_client(config['poloniex']['api'], config['poloniex']['secret']), interval=30)
+
+            reconciler.start()
+
+        # One simulated exchange shared by every trade cycle in debug mode
+        simulator = ExchangeSimulator(seed=0) if debug_switch == True else None
+
+        marcopolo = MarcoPolo(config_path=test_config_path, ws_ticker=ws_ticker_switch, debug_mode=debug_switch,
+                              account_notifier=account_notifier, trailing_engine=trailing_engine, trigger_book=trigger_book,
+                              reconciler=reconciler, tracer=Tracer(path='trace.log'), simulator=simulator, portfolio=portfolio)
+
+        trailing_engine.start(marcopolo.ticker)
+
+        trigger_book.start(marcopolo.ticker)
+
+        portfolio.start(marcopolo.ticker)
+
+        if recover_mode == True:
+            logger.info('Recovering unfinished trade cycles.')
+
+            recovered = recover_trades(marcopolo.db, marcopolo.polo,
+                                       lambda: MarcoPolo(config_path=test_config_path, ws_ticker=ws_ticker_switch, debug_mode=debug_switch,
+                                                         account_notifier=account_notifier, trailing_engine=trailing_engine,
+                                                         trigger_book=trigger_book, reconciler=reconciler, tracer=marcopolo.tracer,
+                                                         simulator=simulator, portfolio=portfolio))
+
+            for recovered_marcopolo, recovered_thread in recovered:
+                recovered_thread.join()
+
+            logger.info('All recovered trade cycles finished.')
+
+            sys.exit()
 
         test_market = 'BTC_STR'
         logger.debug('test_market: ' + test_market)
@@ -961,11 +1317,15 @@ if __name__ == '__main__':
             logger.warning('Could not stop trade cycle process. It may not have been started.')
 
     finally:
-        ################
-        delete_result = marcopolo.db.delete_one({'_id': marcopolo.market})
-        #logger.debug('delete_result.matched_count: ' + str(delete_result.matched_count))
-        #logger.debug('delete_result.modified_count: ' + str(delete_result.modified_count))
-        logger.debug('delete_result.deleted_count: ' + str(delete_result.deleted_count))
-        ################
+        polo.log_metrics()
+
+        marcopolo.polo.log_metrics()
+
+        # Unfinished live trade documents are kept so the cycle can be resumed with --recover
+        if live_mode == False and recover_mode == False:
+            delete_result = marcopolo.db.delete_one({'_id': marcopolo.market})
+            #logger.debug('delete_result.matched_count: ' + str(delete_result.matched_count))
+            #logger.debug('delete_result.modified_count: ' + str(delete_result.modified_count))
+            logger.debug('delete_result.deleted_count: ' + str(delete_result.deleted_count))
 
         logger.info('Exiting.')
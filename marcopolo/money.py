@@ -0,0 +1,80 @@
+# Prices, amounts and totals as integer counts of 1e-8 (the exchange's precision), so fill totals add up exactly.
+# Values cross into units at the edges (API responses, config, trade documents) and back out as floats that round-trip exactly.
+
+import decimal
+
+precision = 8
+
+scale = 10 ** precision
+
+
+def to_units(value):
+    # Decimal strings (ex. API responses) convert exactly; floats round to the nearest unit
+    if isinstance(value, str):
+        return int(decimal.Decimal(value).scaleb(precision).to_integral_value(rounding=decimal.ROUND_HALF_EVEN))
+
+    return int(round(float(value) * scale))
+
+
+def to_value(units):
+    # Nearest float to the exact decimal, which converts back to the same units
+    return units / scale
+
+
+def quantize(value):
+    # Replaces round(value, 8) where a float has to stay a float
+    return to_value(to_units(value))
+
+
+def div_round(numerator, denominator):
+    # Integer division rounded half to even, like round()
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+
+    quotient, remainder = divmod(numerator, denominator)
+
+    if remainder * 2 > denominator or (remainder * 2 == denominator and quotient % 2 == 1):
+        quotient += 1
+
+    return quotient
+
+
+def mul(a, b):
+    # Units x units (ex. rate x amount = total)
+    return div_round(a * b, scale)
+
+
+def div(a, b):
+    # Units / units (ex. total / rate = amount)
+    return div_round(a * scale, b)
+
+
+def scaled(units, factor):
+    # Units x a plain float factor (ex. 1 - fee, 1 + profit_level)
+    return int(round(units * factor))
+
+
+def total(values):
+    return sum([to_units(value) for value in values])
+
+
+def to_units_array(values):
+    # int64 units for vectorized work (order book levels, candle columns)
+    import numpy as np
+
+    return np.rint(np.asarray(values, dtype=np.float64) * scale).astype(np.int64)
+
+
+def to_value_array(units):
+    return units / scale
+
+
+def depth_index(amounts, amount):
+    # First index at which cumulative int64 amounts cover amount, or None if the levels run out first
+    import numpy as np
+
+    cumulative = np.cumsum(amounts)
+
+    index = int(np.searchsorted(cumulative, amount, side='left'))
+
+    return index if index < len(cumulative) else None
@@ -0,0 +1,44 @@
+import logging
+
+from pymongo import ASCENDING
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class OrderLog(object):
+
+    def __init__(self, collection):
+        # Append-only order events (raw API responses) kept out of the live trade document
+        self.collection = collection
+
+        self.collection.create_index([('trade_id', ASCENDING), ('time', ASCENDING)])
+
+
+    def record(self, trade_id, market, side, event, response, time):
+        # event: 'entry_buy', 'sell', 'cancel', 'order_trades' or 'stop_loss'
+        order_number = response.get('orderNumber') if isinstance(response, dict) else None
+
+        try:
+            self.collection.insert_one(dict(trade_id=trade_id,
+                                            market=market,
+                                            side=side,
+                                            event=event,
+                                            order_number=order_number,
+                                            response=response,
+                                            time=time))
+
+        except Exception as e:
+            # Losing a history entry must not interrupt the trade cycle
+            logger.exception('Exception while recording order event.')
+            logger.exception(e)
+
+
+    def history(self, trade_id, event=None):
+        query = {'trade_id': trade_id}
+
+        if event is not None:
+            query['event'] = event
+
+        return list(self.collection.find(query, {'_id': False}).sort('time', ASCENDING))
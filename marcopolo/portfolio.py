@@ -0,0 +1,235 @@
+import datetime
+import logging
+from multiprocessing.dummy import Process as Thread
+import threading
+import time
+
+import money
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Per-position values summed into the per-base-currency portfolio totals
+total_fields = ['exposure', 'cost', 'unrealized', 'realized', 'fees']
+
+# Position fields held as integer units (see money.py), so adding and removing contributions leaves the totals exact
+unit_fields = ['amount'] + total_fields
+
+
+def position_values(position):
+    return {field: money.to_value(position[field]) if field in unit_fields else position[field] for field in position}
+
+
+class PortfolioTracker(object):
+
+    def __init__(self, db=None):
+        # Collection that snapshots are written to (None keeps the tracker in memory only)
+        self.db = db
+
+        self.lock = threading.Lock()
+
+        # trade_id -> position, market -> trade_ids holding it
+        self.positions = {}
+        self.markets = {}
+
+        # Latest highest bid per market
+        self.marks = {}
+
+        # base currency -> running totals, adjusted by the change in each position rather than recomputed
+        self.totals = {}
+
+        self.running = False
+
+
+    def apply(self, position, sign):
+        # Adds (sign=1) or removes (sign=-1) a position's contribution to its base currency totals
+        totals = self.totals.setdefault(position['base_currency'], dict.fromkeys(total_fields, 0))
+
+        for field in total_fields:
+            totals[field] += sign * position[field]
+
+
+    def revalue(self, position):
+        mark = self.marks.get(position['market'])
+
+        if mark is None:
+            # No tick yet, so the position is carried at cost
+            mark = money.to_value(money.div(position['cost'], position['amount'])) if position['amount'] > 0 else 0.0
+
+        position['mark'] = mark
+        position['exposure'] = money.mul(position['amount'], money.to_units(mark))
+        position['unrealized'] = position['exposure'] - position['cost']
+
+
+    def add(self, trade_id, market, amount=0, cost=0, fees=0):
+        # Opens (or re-seeds after recovery) a position from fill totals already persisted in the trade document
+        with self.lock:
+            if trade_id in self.positions:
+                PortfolioTracker.apply(self, self.positions[trade_id], -1)
+
+            position = dict(trade_id=trade_id,
+                            market=market,
+                            base_currency=market.split('_')[0],
+                            amount=money.to_units(amount),
+                            cost=money.to_units(cost),
+                            realized=0,
+                            fees=money.to_units(fees))
+
+            PortfolioTracker.revalue(self, position)
+
+            self.positions[trade_id] = position
+            self.markets.setdefault(market, set()).add(trade_id)
+
+            PortfolioTracker.apply(self, position, 1)
+
+
+    def fill(self, trade_id, side, amount, total, rate, fee):
+        # Fill accounting follows the trade cycle: buy amount is net of fee, sell total is net of fee
+        with self.lock:
+            position = self.positions.get(trade_id)
+
+            if position is None:
+                return
+
+            PortfolioTracker.apply(self, position, -1)
+
+            amount = money.to_units(amount)
+            total = money.to_units(total)
+
+            if side == 'buy':
+                position['amount'] += amount
+                position['cost'] += total
+                position['fees'] += money.scaled(total, fee)
+
+            else:
+                # Cost basis released in proportion to the amount sold
+                released = money.div_round(position['cost'] * min(amount, position['amount']), position['amount']) if position['amount'] > 0 else 0
+
+                position['amount'] = max(position['amount'] - amount, 0)
+                position['cost'] -= released
+                position['realized'] += total - released
+                position['fees'] += money.scaled(money.mul(amount, money.to_units(rate)), fee)
+
+            PortfolioTracker.revalue(self, position)
+
+            PortfolioTracker.apply(self, position, 1)
+
+
+    def mark(self, market, price):
+        # Only positions in the ticked market are revalued
+        with self.lock:
+            self.marks[market] = price
+
+            for trade_id in self.markets.get(market, ()):
+                position = self.positions[trade_id]
+
+                PortfolioTracker.apply(self, position, -1)
+
+                PortfolioTracker.revalue(self, position)
+
+                PortfolioTracker.apply(self, position, 1)
+
+
+    def remove(self, trade_id):
+        # Closed positions leave exposure, but their realized PnL and fees stay in the totals
+        with self.lock:
+            position = self.positions.pop(trade_id, None)
+
+            if position is None:
+                return
+
+            PortfolioTracker.apply(self, position, -1)
+
+            totals = self.totals[position['base_currency']]
+
+            totals['realized'] += position['realized']
+            totals['fees'] += position['fees']
+
+            self.markets[position['market']].discard(trade_id)
+
+            if len(self.markets[position['market']]) == 0:
+                del self.markets[position['market']]
+
+
+    def position(self, trade_id):
+        with self.lock:
+            position = self.positions.get(trade_id)
+
+            return position_values(position) if position is not None else None
+
+
+    def summary(self, base_currency='BTC'):
+        # Portfolio totals for one base currency, read without touching any collection
+        with self.lock:
+            totals = {field: money.to_value(units) for field, units in self.totals.get(base_currency, dict.fromkeys(total_fields, 0)).items()}
+
+            totals['open_trades'] = len([trade_id for trade_id in self.positions if self.positions[trade_id]['base_currency'] == base_currency])
+
+        return totals
+
+
+    def snapshot(self):
+        with self.lock:
+            return dict(time=datetime.datetime.now(),
+                        totals={base_currency: {field: money.to_value(self.totals[base_currency][field]) for field in total_fields}
+                                for base_currency in self.totals},
+                        positions=[position_values(self.positions[trade_id]) for trade_id in self.positions])
+
+
+    def write_snapshot(self):
+        snapshot = PortfolioTracker.snapshot(self)
+
+        if self.db is not None:
+            try:
+                self.db.insert_one(snapshot)
+
+            except Exception as e:
+                logger.exception('Exception while writing portfolio snapshot.')
+                logger.exception(e)
+
+        return snapshot
+
+
+    def run(self, ticker, interval, snapshot_interval):
+        last_snapshot = time.time()
+
+        while self.running == True:
+            try:
+                # Covers markets whose trade cycles are sleeping between their own ticks
+                for market in list(self.markets):
+                    tick = ticker(market)
+
+                    if tick is not None:
+                        PortfolioTracker.mark(self, market, tick['highestBid'])
+
+                if time.time() - last_snapshot >= snapshot_interval:
+                    PortfolioTracker.write_snapshot(self)
+
+                    last_snapshot = time.time()
+
+            except Exception as e:
+                logger.exception('Exception in portfolio update loop.')
+                logger.exception(e)
+
+            time.sleep(interval)
+
+
+    def start(self, ticker, interval=1, snapshot_interval=60):
+        self.running = True
+
+        self.t = Thread(target=self.run, args=(ticker, interval, snapshot_interval))
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.debug('Portfolio tracker started.')
+
+
+    def stop(self):
+        self.running = False
+
+        self.t.join()
+
+        logger.debug('Portfolio tracker stopped.')
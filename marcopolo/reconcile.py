@@ -0,0 +1,140 @@
+import logging
+from multiprocessing.dummy import Process as Thread
+import threading
+import time
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class OpenOrdersReconciler(object):
+
+    def __init__(self, polo, interval=30, debounce=0.5):
+        self.polo = polo
+
+        self.interval = interval
+
+        # Requested refreshes wait this long, so orders placed by several trades in one burst share a snapshot
+        self.debounce = debounce
+
+        self.lock = threading.Lock()
+
+        # orderNumber -> open order (with 'market' added) from latest account-wide snapshot
+        self.open_orders = {}
+
+        # Time the latest snapshot request was sent (orders placed after this can't be judged from it)
+        self.snapshot_time = None
+
+        # orderNumber -> time order was placed, for orders placed by trades sharing this reconciler
+        self.tracked = {}
+
+        self.refresh_event = threading.Event()
+
+        self.running = False
+
+
+    def refresh(self):
+        request_time = time.time()
+
+        try:
+            open_orders_all = self.polo.returnOpenOrders(currencyPair='all')
+
+        except Exception as e:
+            logger.exception('Exception while fetching open orders.')
+            logger.exception(e)
+
+            return False
+
+        open_orders = {}
+
+        for market in open_orders_all:
+            for order in open_orders_all[market]:
+                order['market'] = market
+
+                open_orders[int(order['orderNumber'])] = order
+
+        with self.lock:
+            self.open_orders = open_orders
+
+            self.snapshot_time = request_time
+
+            # Orders older than this snapshot are answered by it from now on
+            for order_number in [order_number for order_number in self.tracked if self.tracked[order_number] < request_time]:
+                del self.tracked[order_number]
+
+        logger.debug('Open orders snapshot: ' + str(len(open_orders)) + ' orders.')
+
+        return True
+
+
+    def track(self, order_number):
+        # Call right after placing an order so a snapshot taken before it isn't read as "filled"
+        with self.lock:
+            self.tracked[int(order_number)] = time.time()
+
+        # The next shared snapshot is taken early to cover the new order
+        OpenOrdersReconciler.request_refresh(self)
+
+
+    def is_open(self, order_number):
+        # Returns True/False from the shared snapshot, or None if no snapshot can answer (yet, or any more).
+        # Orders placed after the latest snapshot count as open until the refresh track() requested covers them.
+        order_number = int(order_number)
+
+        with self.lock:
+            if self.snapshot_time is None:
+                return None
+
+            # Failed refreshes keep the previous snapshot, which stops answering once it misses two intervals
+            if time.time() - self.snapshot_time > 2 * self.interval:
+                return None
+
+            if order_number in self.open_orders:
+                return True
+
+            if order_number in self.tracked and self.tracked[order_number] >= self.snapshot_time:
+                return True
+
+            return False
+
+
+    def get_order(self, order_number):
+        with self.lock:
+            return self.open_orders.get(int(order_number))
+
+
+    def request_refresh(self):
+        self.refresh_event.set()
+
+
+    def run(self):
+        while self.running == True:
+            OpenOrdersReconciler.refresh(self)
+
+            if self.refresh_event.wait(self.interval) == True and self.running == True:
+                time.sleep(self.debounce)
+
+            self.refresh_event.clear()
+
+
+    def start(self):
+        self.running = True
+
+        self.t = Thread(target=self.run)
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.debug('Open orders reconciler started.')
+
+
+    def stop(self):
+        self.running = False
+
+        self.refresh_event.set()
+
+        self.t.join()
+
+        logger.debug('Open orders reconciler stopped.')
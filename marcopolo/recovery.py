@@ -0,0 +1,87 @@
+import datetime
+import logging
+from multiprocessing.dummy import Process as Thread
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def reconcile_trades(db, polo, exclude=None):
+    # Brings every unfinished trade document up to date with exchange order state using one open orders call.
+    # run_trade_cycle() then resumes each trade from its document (entry fills, resting sell, stop monitor, stop-loss fills).
+    query = {'sell.complete': {'$ne': True}}
+
+    if exclude:
+        # Markets whose trade cycles are already running in this process
+        query['_id'] = {'$nin': list(exclude)}
+
+    trade_docs = list(db.find(query))
+
+    logger.info('Found ' + str(len(trade_docs)) + ' unfinished trade documents.')
+
+    if len(trade_docs) == 0:
+        return []
+
+    open_orders_all = polo.returnOpenOrders(currencyPair='all')
+
+    open_order_numbers = set()
+
+    for market in open_orders_all:
+        for order in open_orders_all[market]:
+            open_order_numbers.add(int(order['orderNumber']))
+
+    reconciled = []
+
+    for trade_doc in trade_docs:
+        market = trade_doc['_id']
+
+        if trade_doc['buy']['complete'] != True:
+            filled = trade_doc['buy'].get('amount_filled', 0)
+
+            if filled == 0 and datetime.datetime.now() >= trade_doc['buy']['abort_time']:
+                logger.info(market + ': entry timed out with no fills while down. Removing trade document.')
+
+                db.delete_one({'_id': market})
+
+                continue
+
+        elif (trade_doc['sell']['stop_active'] != True and trade_doc['sell'].get('order') != None and
+              int(trade_doc['sell']['order']) not in open_order_numbers):
+            # Only orders that left the book while down need an individual lookup; filled ones are found by the cycle's reconciliation
+            order_trades = polo.returnOrderTrades(trade_doc['sell']['order'])
+
+            if len(order_trades) == 0:
+                logger.warning(market + ': sell order #' + str(trade_doc['sell']['order']) + ' canceled without fills. Re-placing.')
+
+                db.update_one({'_id': market}, {'$set': {'sell.order': None}})
+
+                trade_doc['sell']['order'] = None
+
+        logger.info(market + ': resuming unfinished trade.')
+
+        reconciled.append(trade_doc)
+
+    return reconciled
+
+
+def recover_trades(db, polo, create_marcopolo, exclude=None):
+    # create_marcopolo() returns a new MarcoPolo sharing the caller's clients/engines; one thread per trade
+    recovered = []
+
+    for trade_doc in reconcile_trades(db, polo, exclude=exclude):
+        marcopolo = create_marcopolo()
+
+        marcopolo.load_trade(trade_doc)
+
+        t = Thread(target=marcopolo.run_trade_cycle)
+
+        t.daemon = True
+
+        t.start()
+
+        recovered.append((marcopolo, t))
+
+    logger.info('Resumed ' + str(len(recovered)) + ' trade cycles.')
+
+    return recovered
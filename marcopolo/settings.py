@@ -0,0 +1,30 @@
+import configparser
+import os
+
+# config/config.ini at the repository root, independent of the working directory
+config_path_default = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.ini')
+
+mongo_uri_default = 'mongodb://localhost:27017/'
+
+# Completed returnChartData() candles kept between runs (see candles.py)
+candle_cache_default = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'candles')
+
+
+def load_config(config_path=None):
+    config = configparser.ConfigParser()
+
+    config.read(config_path if config_path != None else config_path_default)
+
+    return config
+
+
+def mongo_uri(config, atlas=False):
+    # [mongodb] uri_local, or uri_atlas with atlas_user/atlas_pass when atlas=True
+    if 'mongodb' not in config:
+        return mongo_uri_default
+
+    if atlas == True:
+        return ('mongodb+srv://' + config['mongodb']['atlas_user'] + ':' + config['mongodb']['atlas_pass'] +
+                '@' + config['mongodb']['uri_atlas'])
+
+    return config['mongodb'].get('uri_local', mongo_uri_default)
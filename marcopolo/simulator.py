@@ -0,0 +1,449 @@
+import bisect
+import datetime
+import itertools
+import logging
+import random
+import threading
+import time
+
+from poloniex import PoloniexCommandException
+
+import money
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class BookSide(object):
+
+    def __init__(self, side):
+        # 'bids' sort highest rate first, 'asks' lowest rate first; equal rates by arrival (price-time priority)
+        self.side = side
+
+        self.keys = []
+        self.orders = []
+
+
+    def key(self, order):
+        return (-order['rate'] if self.side == 'bids' else order['rate'], order['seq'])
+
+
+    def add(self, order):
+        key = BookSide.key(self, order)
+
+        position = bisect.bisect(self.keys, key)
+
+        self.keys.insert(position, key)
+        self.orders.insert(position, order)
+
+
+    def remove(self, order):
+        position = bisect.bisect_left(self.keys, BookSide.key(self, order))
+
+        del self.keys[position]
+        del self.orders[position]
+
+
+    def best(self):
+        return self.orders[0] if len(self.orders) > 0 else None
+
+
+    def pop_best(self):
+        del self.keys[0]
+
+        return self.orders.pop(0)
+
+
+    def crosses(self, rate):
+        # True if the best resting order here would trade against an incoming order at rate
+        best = BookSide.best(self)
+
+        if best is None:
+            return False
+
+        return best['rate'] <= rate if self.side == 'asks' else best['rate'] >= rate
+
+
+    def remove_external(self):
+        kept = [i for i, order in enumerate(self.orders) if order['owner'] is not None]
+
+        self.keys = [self.keys[i] for i in kept]
+        self.orders = [self.orders[i] for i in kept]
+
+
+class ExchangeSimulator(object):
+
+    def __init__(self, seed=None, maker_fee=0.001, taker_fee=0.002, default_balance=10, depth_levels=10,
+                 depth_amount=(50, 500), tick_size=1e-08, time_source=time.time):
+        # Seeded stand-in for the Poloniex client methods used by the trade cycle. External liquidity comes from
+        # load_book()/set_quote(); orders placed through buy()/sell() match against it and rest in the same book.
+        self.random = random.Random(seed)
+
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+
+        # Balances not set explicitly start at default_balance
+        self.default_balance = default_balance
+        self.balances = {}
+
+        self.depth_levels = depth_levels
+        self.depth_amount = depth_amount
+        self.tick_size = tick_size
+
+        self.time_source = time_source
+
+        self.lock = threading.RLock()
+
+        # market -> {'bids': BookSide, 'asks': BookSide}
+        self.books = {}
+
+        self.last = {}
+
+        # orderNumber -> order (own orders only)
+        self.orders = {}
+
+        # orderNumber -> [trade, ...] (own fills only)
+        self.order_trades = {}
+
+        self.order_numbers = itertools.count(10000000001)
+        self.trade_ids = itertools.count(10000001)
+        self.global_trade_ids = itertools.count(100000001)
+        self.seqs = itertools.count(1)
+
+
+    def date(self):
+        return datetime.datetime.utcfromtimestamp(self.time_source()).isoformat(sep=' ', timespec='seconds')
+
+
+    def balance(self, currency):
+        if currency not in self.balances:
+            self.balances[currency] = self.default_balance
+
+        return self.balances[currency]
+
+
+    def adjust_balance(self, currency, change):
+        self.balances[currency] = money.to_value(money.to_units(ExchangeSimulator.balance(self, currency)) + money.to_units(change))
+
+
+    def book(self, market):
+        if market not in self.books:
+            self.books[market] = {'bids': BookSide('bids'), 'asks': BookSide('asks')}
+
+        return self.books[market]
+
+
+    ## Market state ##
+
+    def load_book(self, market, bids, asks):
+        # bids/asks as [[rate, amount], ...] (ex. a returnOrderBook() response); replaces all external liquidity
+        # and then lets resting own orders trade against it
+        with self.lock:
+            book = ExchangeSimulator.book(self, market)
+
+            book['bids'].remove_external()
+            book['asks'].remove_external()
+
+            for side, levels in (('bids', bids), ('asks', asks)):
+                for rate, amount in levels:
+                    book[side].add(dict(owner=None, rate=float(rate), amount=float(amount), seq=next(self.seqs)))
+
+            ExchangeSimulator.match_book(self, market)
+
+
+    def set_quote(self, market, highest_bid, lowest_ask):
+        # Synthetic depth_levels-deep book one tick_size apart around the quote, amounts drawn from the seeded RNG
+        bids = []
+        asks = []
+
+        for level in range(self.depth_levels):
+            bids.append([money.quantize(highest_bid - level * self.tick_size), money.quantize(self.random.uniform(*self.depth_amount))])
+            asks.append([money.quantize(lowest_ask + level * self.tick_size), money.quantize(self.random.uniform(*self.depth_amount))])
+
+        ExchangeSimulator.load_book(self, market, bids, asks)
+
+
+    def apply_candle(self, market, candle):
+        # External flow trading through the candle's range: resting own sells at or below 'high' and own buys
+        # at or above 'low' are filled, then the book is re-quoted around 'close'
+        with self.lock:
+            book = ExchangeSimulator.book(self, market)
+
+            for side, rate in (('asks', candle['high']), ('bids', candle['low'])):
+                for order in [order for order in book[side].orders if order['owner'] is not None]:
+                    if (side == 'asks' and order['rate'] <= rate) or (side == 'bids' and order['rate'] >= rate):
+                        ExchangeSimulator.fill(self, order, order['amount'], order['rate'], maker=True)
+
+                        book[side].remove(order)
+
+                        self.orders.pop(order['orderNumber'], None)
+
+            close = candle['close']
+
+        ExchangeSimulator.set_quote(self, market, money.quantize(close - self.tick_size), close)
+
+
+    def match_book(self, market):
+        # Crossed book after new external liquidity: the later arrival takes at the resting order's rate
+        book = ExchangeSimulator.book(self, market)
+
+        while book['bids'].best() is not None and book['asks'].best() is not None and book['bids'].best()['rate'] >= book['asks'].best()['rate']:
+            bid = book['bids'].best()
+            ask = book['asks'].best()
+
+            maker, taker = (bid, ask) if bid['seq'] < ask['seq'] else (ask, bid)
+
+            amount = min(bid['amount'], ask['amount'])
+
+            for order in (bid, ask):
+                if order['owner'] is not None:
+                    ExchangeSimulator.fill(self, order, amount, maker['rate'], maker=order is maker)
+
+                else:
+                    order['amount'] = money.to_value(money.to_units(order['amount']) - money.to_units(amount))
+
+            for side, order in (('bids', bid), ('asks', ask)):
+                if order['amount'] <= 0:
+                    book[side].pop_best()
+
+                    if order['owner'] is not None:
+                        self.orders.pop(order['orderNumber'], None)
+
+
+    def fill(self, order, amount, rate, maker):
+        # Fill amounts follow the trade cycle's accounting: buys report amount net of fee, sells report total net of fee
+        fee = self.maker_fee if maker == True else self.taker_fee
+
+        base_currency, trade_currency = order['market'].split('_')
+
+        gross_units = money.mul(money.to_units(amount), money.to_units(rate))
+
+        if order['type'] == 'buy':
+            trade_amount = money.to_value(money.scaled(money.to_units(amount), 1 - fee))
+            trade_total = money.to_value(gross_units)
+
+            ExchangeSimulator.adjust_balance(self, base_currency, -trade_total)
+            ExchangeSimulator.adjust_balance(self, trade_currency, trade_amount)
+
+        else:
+            trade_amount = money.quantize(amount)
+            trade_total = money.to_value(money.scaled(gross_units, 1 - fee))
+
+            ExchangeSimulator.adjust_balance(self, trade_currency, -trade_amount)
+            ExchangeSimulator.adjust_balance(self, base_currency, trade_total)
+
+        order['amount'] = money.to_value(money.to_units(order['amount']) - money.to_units(amount))
+
+        trade = dict(amount=trade_amount,
+                     date=ExchangeSimulator.date(self),
+                     rate=rate,
+                     total=trade_total,
+                     tradeID=next(self.trade_ids),
+                     type=order['type'])
+
+        self.order_trades[order['orderNumber']].append(dict(trade,
+                                                            currencyPair=order['market'],
+                                                            fee=fee,
+                                                            globalTradeID=next(self.global_trade_ids)))
+
+        self.last[order['market']] = rate
+
+        return trade
+
+
+    def place(self, order_type, currencyPair, rate, amount, fillOrKill=None, immediateOrCancel=None, postOnly=None):
+        with self.lock:
+            rate = float(rate)
+            amount = float(amount)
+
+            if rate <= 0 or amount <= 0:
+                raise PoloniexCommandException('Invalid rate or amount.')
+
+            base_currency, trade_currency = currencyPair.split('_')
+
+            if order_type == 'buy' and money.mul(money.to_units(rate), money.to_units(amount)) > money.to_units(ExchangeSimulator.balance(self, base_currency)):
+                raise PoloniexCommandException('Not enough ' + base_currency + '.')
+
+            if order_type == 'sell' and amount > ExchangeSimulator.balance(self, trade_currency):
+                raise PoloniexCommandException('Not enough ' + trade_currency + '.')
+
+            book = ExchangeSimulator.book(self, currencyPair)
+
+            opposite = book['asks'] if order_type == 'buy' else book['bids']
+
+            if postOnly and opposite.crosses(rate):
+                raise PoloniexCommandException('Unable to place post-only order at this price.')
+
+            if fillOrKill:
+                available = 0
+
+                for resting in opposite.orders:
+                    if (order_type == 'buy' and resting['rate'] > rate) or (order_type == 'sell' and resting['rate'] < rate):
+                        break
+
+                    available += resting['amount']
+
+                if available < amount:
+                    raise PoloniexCommandException('Unable to fill order completely.')
+
+            order = dict(owner='self', orderNumber=next(self.order_numbers), market=currencyPair, type=order_type,
+                         rate=rate, amount=money.quantize(amount), startingAmount=money.quantize(amount),
+                         date=ExchangeSimulator.date(self), seq=next(self.seqs))
+
+            self.order_trades[order['orderNumber']] = []
+
+            resulting_trades = []
+
+            while order['amount'] > 0 and opposite.crosses(rate):
+                resting = opposite.best()
+
+                fill_amount = min(order['amount'], resting['amount'])
+
+                resulting_trades.append(ExchangeSimulator.fill(self, order, fill_amount, resting['rate'], maker=False))
+
+                if resting['owner'] is not None:
+                    ExchangeSimulator.fill(self, resting, fill_amount, resting['rate'], maker=True)
+
+                else:
+                    resting['amount'] = money.to_value(money.to_units(resting['amount']) - money.to_units(fill_amount))
+
+                if resting['amount'] <= 0:
+                    opposite.pop_best()
+
+                    if resting['owner'] is not None:
+                        self.orders.pop(resting['orderNumber'], None)
+
+            result = {'orderNumber': order['orderNumber'], 'resultingTrades': resulting_trades}
+
+            if immediateOrCancel:
+                result['amountUnfilled'] = order['amount']
+
+            elif order['amount'] > 0:
+                book['bids' if order_type == 'buy' else 'asks'].add(order)
+
+                self.orders[order['orderNumber']] = order
+
+            return result
+
+
+    ## Client methods ##
+
+    def buy(self, currencyPair, rate, amount, fillOrKill=None, immediateOrCancel=None, postOnly=None):
+        return ExchangeSimulator.place(self, 'buy', currencyPair, rate, amount, fillOrKill, immediateOrCancel, postOnly)
+
+
+    def sell(self, currencyPair, rate, amount, fillOrKill=None, immediateOrCancel=None, postOnly=None):
+        return ExchangeSimulator.place(self, 'sell', currencyPair, rate, amount, fillOrKill, immediateOrCancel, postOnly)
+
+
+    def cancelOrder(self, orderNumber):
+        with self.lock:
+            order = self.orders.pop(int(orderNumber), None)
+
+            if order is None:
+                raise PoloniexCommandException('Invalid order number, or you are not the person who placed the order.')
+
+            ExchangeSimulator.book(self, order['market'])['bids' if order['type'] == 'buy' else 'asks'].remove(order)
+
+            return {'success': 1, 'amount': order['amount'], 'message': 'Order #' + str(order['orderNumber']) + ' canceled.'}
+
+
+    def returnOpenOrders(self, currencyPair='all'):
+        with self.lock:
+            open_orders = {}
+
+            for market in self.books:
+                open_orders[market] = []
+
+            for order in sorted(self.orders.values(), key=lambda order: order['seq']):
+                if order['amount'] <= 0:
+                    continue
+
+                open_orders.setdefault(order['market'], []).append(dict(orderNumber=order['orderNumber'],
+                                                                        type=order['type'],
+                                                                        rate=order['rate'],
+                                                                        startingAmount=order['startingAmount'],
+                                                                        amount=order['amount'],
+                                                                        total=money.to_value(money.mul(money.to_units(order['rate']), money.to_units(order['amount']))),
+                                                                        date=order['date'],
+                                                                        margin=0))
+
+            if currencyPair == 'all':
+                return open_orders
+
+            return open_orders.get(currencyPair, [])
+
+
+    def returnOrderTrades(self, orderNumber):
+        with self.lock:
+            return list(self.order_trades.get(int(orderNumber), []))
+
+
+    def returnTicker(self):
+        with self.lock:
+            ticker = {}
+
+            for market, book in self.books.items():
+                best_bid = book['bids'].best()
+                best_ask = book['asks'].best()
+
+                highest_bid = best_bid['rate'] if best_bid is not None else 0.0
+                lowest_ask = best_ask['rate'] if best_ask is not None else 0.0
+
+                ticker[market] = dict(last=self.last.get(market, lowest_ask),
+                                      lowestAsk=lowest_ask,
+                                      highestBid=highest_bid,
+                                      percentChange=0.0,
+                                      baseVolume=0.0,
+                                      quoteVolume=0.0,
+                                      isFrozen=0)
+
+            return ticker
+
+
+    def returnOrderBook(self, currencyPair='all', depth=20):
+        with self.lock:
+            def levels(side):
+                aggregated = []
+
+                for order in side.orders:
+                    if len(aggregated) > 0 and aggregated[-1][0] == order['rate']:
+                        aggregated[-1][1] = money.to_value(money.to_units(aggregated[-1][1]) + money.to_units(order['amount']))
+
+                    elif len(aggregated) < depth:
+                        aggregated.append([order['rate'], order['amount']])
+
+                    else:
+                        break
+
+                return aggregated
+
+            def market_book(market):
+                book = ExchangeSimulator.book(self, market)
+
+                return {'asks': levels(book['asks']), 'bids': levels(book['bids']), 'isFrozen': 0, 'seq': next(self.seqs)}
+
+            if currencyPair == 'all':
+                return {market: market_book(market) for market in self.books}
+
+            return market_book(currencyPair)
+
+
+    def returnFeeInfo(self):
+        return {'makerFee': self.maker_fee, 'takerFee': self.taker_fee, 'thirtyDayVolume': 0.0, 'nextTier': 0.0}
+
+
+    def returnBalances(self):
+        with self.lock:
+            return dict(self.balances)
+
+
+    def returnAvailableAccountBalances(self, account=None):
+        with self.lock:
+            return {'exchange': {currency: amount for currency, amount in self.balances.items() if amount > 0}}
+
+
+    def log_metrics(self):
+        logger.info('Simulator: ' + str(len(self.orders)) + ' open orders, ' +
+                    str(sum([len(trades) for trades in self.order_trades.values()])) + ' fills, balances ' + str(self.balances))
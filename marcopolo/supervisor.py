@@ -0,0 +1,574 @@
+import argparse
+import logging
+from multiprocessing.dummy import Process as Thread
+import os
+import runpy
+import signal
+import sys
+import threading
+import time
+
+import settings
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def slack_info(config, config_path):
+    # Slack settings for TickerGenerator; alerts are disabled when the config has no [slack] section
+    channels = dict(alerts=(None, None), exceptions=(None, None))
+
+    if 'slack' not in config:
+        return dict(client=None, channels=channels)
+
+    from alerts import connect_slack
+
+    slack = config['slack']
+
+    slack_channel_targets = {'alerts': slack['channel_alerts'],
+                             'exceptions': slack['channel_exceptions']}
+
+    # Channel IDs are cached next to the config file and resolved on the alert dispatcher's thread
+    slack_channel_cache = os.path.join(os.path.dirname(os.path.abspath(config_path)), 'slack_channels.json')
+
+    return dict(client=None,
+                token=slack['token'],
+                connect=lambda: connect_slack(slack['token'], slack_channel_targets, slack_channel_cache),
+                channels=dict(alerts=(slack['channel_alerts'], None),
+                              exceptions=(slack['channel_exceptions'], None)),
+                bot=dict(user=slack['bot_user'],
+                         icon=slack['bot_icon']))
+
+
+class TickerComponent(object):
+
+    def __init__(self, config, config_path, mongo_uri, timeout=30, alert_reset_interval=10, tick_archive=None):
+        self.config = config
+        self.config_path = config_path
+        self.mongo_uri = mongo_uri
+
+        # Directory ticks are archived to (None disables)
+        self.tick_archive = tick_archive
+
+        self.timeout = timeout
+        self.alert_reset_interval = alert_reset_interval
+
+        # Set once the first tick has been written, so dependent components can start
+        self.ready = threading.Event()
+
+        self.ticker_generator = None
+
+        self.running = False
+
+
+    def run(self):
+        from ticker import TickerGenerator
+
+        self.running = True
+
+        self.ticker_generator = TickerGenerator(slack_info=slack_info(self.config, self.config_path), mongo_ip=self.mongo_uri,
+                                                tick_archive=self.tick_archive)
+
+        try:
+            self.ticker_generator.start()
+
+            logger.info('Waiting for ticker generator to be ready.')
+
+            while self.ticker_generator.last_update == None and self.running == True:
+                time.sleep(0.5)
+
+            if self.running == False:
+                return
+
+            self.ready.set()
+
+            logger.info('Ticker ready.')
+
+            self.ticker_generator.send_slack_alert(channel_id=self.ticker_generator.slack_channel_id_alerts,
+                                                   message='Real-time Poloniex ticker data ready for use.')
+
+            self.ticker_generator.monitor(timeout=self.timeout, alert_reset_interval=self.alert_reset_interval)
+
+        finally:
+            self.ready.clear()
+
+            self.ticker_generator.stop()
+
+            # Delivers the shutdown alert
+            self.ticker_generator.alerts.stop()
+
+            if self.ticker_generator.tick_archive != None:
+                self.ticker_generator.tick_archive.close()
+
+            self.ticker_generator.api.log_metrics()
+
+
+    def stop(self):
+        self.running = False
+
+        if self.ticker_generator != None:
+            self.ticker_generator.monitoring = False
+
+
+    def health(self):
+        if self.ticker_generator == None:
+            return dict(ready=False)
+
+        report = self.ticker_generator.health(max_tick_age=self.timeout)
+
+        report['ready'] = report['ready'] == True and self.ready.is_set()
+
+        return report
+
+
+class TraderComponent(object):
+
+    def __init__(self, config, config_path, mongo_uri, live=False, poll_interval=10, max_tick_age=60):
+        self.config = config
+        self.config_path = config_path
+        self.mongo_uri = mongo_uri
+
+        self.live = live
+
+        # Seconds between scans for new or unfinished trade documents
+        self.poll_interval = poll_interval
+
+        # Trade cycles don't start until the ticker collection has a tick at least this recent, and defer decisions on older ticks
+        self.max_tick_age = max_tick_age
+
+        self.ready = threading.Event()
+
+        self.engines = None
+
+        # market -> (MarcoPolo, thread); kept across restarts so running cycles aren't started twice
+        self.cycles = {}
+
+        # Clear while run() is executing, so engines aren't stopped under it
+        self.idle = threading.Event()
+
+        self.idle.set()
+
+        self.running = False
+
+
+    def start_engines(self):
+        # Shared by every trade cycle, and kept when the component is restarted
+        from pymongo import MongoClient
+
+        from account import AccountNotifier
+        from candles import CandleStore
+        from exchange import get_client
+        from portfolio import PortfolioTracker
+        from reconcile import OpenOrdersReconciler
+        from simulator import ExchangeSimulator
+        from ticker import Ticker
+        from tracing import Tracer
+        from trailing import TrailingStopEngine
+        from triggers import TriggerBook
+
+        client = MongoClient(self.mongo_uri)
+
+        engines = dict(db=client.marcopolo['trades'],
+                       polo=None,
+                       public=None,
+                       candles=None,
+                       ticker=Ticker(None, db=client.poloniex['ticker']),
+                       account_notifier=None,
+                       reconciler=None,
+                       simulator=None,
+                       tracer=Tracer(path='trace.log'),
+                       trailing_engine=TrailingStopEngine(db=client.marcopolo['trades']),
+                       trigger_book=TriggerBook(max_tick_age=self.max_tick_age),
+                       portfolio=PortfolioTracker(db=client.marcopolo['portfolio']))
+
+        if self.live == True:
+            # Same pooled client MarcoPolo gets for this API key
+            engines['polo'] = get_client(self.config['poloniex']['api'], self.config['poloniex']['secret'])
+
+            engines['account_notifier'] = AccountNotifier(self.config['poloniex']['api'], self.config['poloniex']['secret'],
+                                                          markets=engines['polo'].returnTicker())
+
+            engines['account_notifier'].start()
+
+            engines['reconciler'] = OpenOrdersReconciler(engines['polo'], interval=30)
+
+            engines['reconciler'].start()
+
+            engines['public'] = engines['polo']
+
+        else:
+            # One simulated exchange shared by every trade cycle
+            engines['simulator'] = ExchangeSimulator(seed=0)
+
+            engines['polo'] = engines['simulator']
+
+            # Market data still comes from the exchange through the shared public client
+            engines['public'] = get_client()
+
+            # Candles the simulator is traded through, shared by every trade cycle and kept between runs
+            engines['candles'] = CandleStore(engines['public'], root=settings.candle_cache_default)
+
+        engines['trailing_engine'].start(engines['ticker'])
+        engines['trigger_book'].start(engines['ticker'])
+        engines['portfolio'].start(engines['ticker'])
+
+        self.engines = engines
+
+
+    def stop_engines(self):
+        for name in ['portfolio', 'trigger_book', 'trailing_engine', 'reconciler', 'account_notifier']:
+            if self.engines[name] != None:
+                try:
+                    self.engines[name].stop()
+
+                except Exception as e:
+                    logger.exception('Exception while stopping ' + name + '.')
+                    logger.exception(e)
+
+        self.engines = None
+
+
+    def create_marcopolo(self):
+        from marcopolo import MarcoPolo
+
+        return MarcoPolo(config_path=self.config_path, debug_mode=(self.live == False), mongo_uri=self.mongo_uri,
+                         db=self.engines['db'], ticker=self.engines['ticker'], simulator=self.engines['simulator'],
+                         account_notifier=self.engines['account_notifier'], reconciler=self.engines['reconciler'],
+                         trailing_engine=self.engines['trailing_engine'], trigger_book=self.engines['trigger_book'],
+                         portfolio=self.engines['portfolio'], tracer=self.engines['tracer'], max_tick_age=self.max_tick_age,
+                         candles=self.engines['candles'])
+
+
+    def ticker_fresh(self):
+        newest = self.engines['ticker'].db.find_one({'received': {'$gte': time.time() - self.max_tick_age}}, {'_id': True})
+
+        return newest != None
+
+
+    def run(self):
+        from recovery import recover_trades
+
+        self.running = True
+
+        self.idle.clear()
+
+        try:
+            if self.engines == None:
+                TraderComponent.start_engines(self)
+
+            logger.info('Waiting for fresh ticker data.')
+
+            while TraderComponent.ticker_fresh(self) == False and self.running == True:
+                time.sleep(1)
+
+            if self.running == True:
+                self.ready.set()
+
+                logger.info('Trader ready (' + ('live' if self.live == True else 'simulated') + ' orders).')
+
+            while self.running == True:
+                for market in [market for market in self.cycles if self.cycles[market][1].is_alive() == False]:
+                    del self.cycles[market]
+
+                # New trade documents (from create_trade) and unfinished ones are both picked up here
+                for marcopolo, t in recover_trades(self.engines['db'], self.engines['polo'], lambda: TraderComponent.create_marcopolo(self),
+                                                   exclude=set(self.cycles)):
+                    self.cycles[marcopolo.market] = (marcopolo, t)
+
+                for _ in range(self.poll_interval):
+                    if self.running == False:
+                        break
+
+                    time.sleep(1)
+
+        finally:
+            self.ready.clear()
+
+            self.idle.set()
+
+
+    def health(self):
+        engines = self.engines
+
+        if engines == None:
+            return dict(ready=False, engines=False)
+
+        cycles = [self.cycles[market][0] for market in list(self.cycles) if self.cycles[market][1].is_alive()]
+
+        stale_decisions = {}
+
+        for marcopolo in cycles:
+            for decision in marcopolo.stale_ticks:
+                stale_decisions[decision] = stale_decisions.get(decision, 0) + marcopolo.stale_ticks[decision]
+
+        report = dict(ready=self.ready.is_set(),
+                      mode='live' if self.live == True else 'simulated',
+                      active_trades=len(cycles),
+                      markets=sorted([marcopolo.market for marcopolo in cycles]),
+                      ticker_fresh=TraderComponent.ticker_fresh(self),
+                      triggers_pending=engines['trigger_book'].pending(),
+                      trigger_stale_ticks=engines['trigger_book'].stale_ticks,
+                      trailing_stops=len(engines['trailing_engine'].slots),
+                      stale_decisions=stale_decisions,
+                      portfolio=engines['portfolio'].summary(),
+                      rate_limit=engines['public'].rate_limit())
+
+        if engines['candles'] != None:
+            report['candles'] = engines['candles'].stats()
+
+        if engines['account_notifier'] != None:
+            report['account'] = dict(connected=engines['account_notifier'].connected, subscribed=engines['account_notifier'].subscribed)
+
+        return report
+
+
+    def stop(self, timeout=30):
+        self.running = False
+
+        deadline = time.time() + timeout
+
+        self.idle.wait(timeout)
+
+        # Cycles finish their current order step and exit, so engines aren't stopped under an order in flight
+        for market in list(self.cycles):
+            self.cycles[market][0].stop()
+
+        for market in list(self.cycles):
+            self.cycles[market][1].join(max(deadline - time.time(), 0))
+
+            if self.cycles[market][1].is_alive() == False:
+                del self.cycles[market]
+
+        if len(self.cycles) > 0:
+            # Trade documents stay in MongoDB and are resumed on the next start
+            logger.warning('Leaving ' + str(len(self.cycles)) + ' trade cycles that did not stop in time to be resumed on next start: ' +
+                           ', '.join(self.cycles))
+
+        if self.engines != None:
+            TraderComponent.stop_engines(self)
+
+
+class Supervisor(object):
+
+    def __init__(self, backoff_initial=1, backoff_max=60, stable_after=300, stop_timeout=30, health_port=8765):
+        # Restart delay doubles per consecutive failure, and resets after a run lasting stable_after seconds
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+
+        self.stop_timeout = stop_timeout
+
+        # (name, component, names of components that must be ready first), in start order
+        self.components = []
+
+        self.threads = {}
+
+        self.restarts = {}
+
+        self.stop_event = threading.Event()
+
+        # Local HTTP readiness endpoint (None disables)
+        self.health_port = health_port
+
+        self.health_monitor = None
+
+
+    def add(self, name, component, requires=()):
+        self.components.append((name, component, requires))
+
+
+    def supervise(self, name, component):
+        failures = 0
+
+        while self.stop_event.is_set() == False:
+            run_start = time.time()
+
+            try:
+                component.run()
+
+                if self.stop_event.is_set() == False:
+                    logger.error(name + ' exited unexpectedly.')
+
+            except Exception as e:
+                logger.exception('Exception in ' + name + '.')
+                logger.exception(e)
+
+            if self.stop_event.is_set() == True:
+                break
+
+            failures = 1 if time.time() - run_start >= self.stable_after else failures + 1
+
+            delay = min(self.backoff_initial * 2 ** (failures - 1), self.backoff_max)
+
+            self.restarts[name] = self.restarts.get(name, 0) + 1
+
+            logger.warning('Restarting ' + name + ' in ' + str(delay) + ' s (restart #' + str(self.restarts[name]) + ').')
+
+            self.stop_event.wait(delay)
+
+        logger.info(name + ' stopped.')
+
+
+    def start(self):
+        components = {name: component for name, component, requires in self.components}
+
+        for name, component, requires in self.components:
+            for required in requires:
+                logger.info(name + ' waiting for ' + required + ' to be ready.')
+
+                while components[required].ready.wait(1) == False:
+                    if self.stop_event.is_set() == True:
+                        return
+
+            logger.info('Starting ' + name + '.')
+
+            self.threads[name] = Thread(target=self.supervise, args=(name, component))
+
+            self.threads[name].daemon = True
+
+            self.threads[name].start()
+
+
+    def stop(self, *args):
+        # Also the SIGINT/SIGTERM handler
+        if self.stop_event.is_set() == True:
+            return
+
+        logger.info('Stopping components.')
+
+        self.stop_event.set()
+
+
+    def shutdown(self):
+        # Reverse start order, so dependents stop before what they depend on
+        for name, component, requires in reversed(self.components):
+            try:
+                component.stop()
+
+            except Exception as e:
+                logger.exception('Exception while stopping ' + name + '.')
+                logger.exception(e)
+
+            if name in self.threads:
+                self.threads[name].join(self.stop_timeout)
+
+                if self.threads[name].is_alive():
+                    logger.warning(name + ' did not stop within ' + str(self.stop_timeout) + ' s.')
+
+
+    def health(self):
+        return dict(ready=self.stop_event.is_set() == False,
+                    running={name: self.threads[name].is_alive() for name in list(self.threads)},
+                    restarts=dict(self.restarts))
+
+
+    def run(self):
+        from health import HealthMonitor
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        if self.health_port != None:
+            self.health_monitor = HealthMonitor(port=self.health_port)
+
+            self.health_monitor.add('supervisor', self.health)
+
+            for name, component, requires in self.components:
+                self.health_monitor.add(name, component.health)
+
+            try:
+                self.health_monitor.start()
+
+            except Exception as e:
+                # Trading doesn't depend on the probe, so a taken port only loses the endpoint
+                logger.exception('Could not start health endpoint.')
+                logger.exception(e)
+
+                self.health_monitor = None
+
+        try:
+            # Components started in the background so a signal during a readiness wait still stops everything
+            starter = Thread(target=self.start)
+
+            starter.daemon = True
+
+            starter.start()
+
+            while self.stop_event.wait(1) == False:
+                pass
+
+        finally:
+            Supervisor.shutdown(self)
+
+            if self.health_monitor != None:
+                self.health_monitor.stop()
+
+            logger.info('Exiting.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='marcopolo')
+    parser.add_argument('-c', '--config', type=str, default=settings.config_path_default, help='Path to config file.')
+    parser.add_argument('-a', '--atlas', action='store_true', default=False, help='Use MongoDB Atlas instead of local database.')
+    parser.add_argument('--health_port', type=int, default=8765, help='Local port for the /health and /ready endpoint (0 disables).')
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    for command, description in [('ticker', 'Run the websocket ticker writer.'),
+                          ('trader', 'Run trade cycles for trade documents (needs a running ticker).'),
+                          ('all', 'Run the ticker, then the trader once the ticker is ready.')]:
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument('--backoff_max', type=float, default=60, help='Longest delay between restarts of a failed component.')
+
+        if command != 'trader':
+            subparser.add_argument('--tick_archive', type=str, default=None, help='Directory to archive ticks to as daily columnar files.')
+
+        if command != 'ticker':
+            subparser.add_argument('-l', '--live', action='store_true', default=False, help='Place real orders (default simulated).')
+            subparser.add_argument('--poll', type=int, default=10, help='Seconds between scans for new trade documents.')
+            subparser.add_argument('--max_tick_age', type=float, default=60, help='Seconds after which a market\'s tick is too old to trade on.')
+
+    for command, module, description in [('bench', 'bench', 'Run the offline benchmark suite (bench.py arguments follow).'),
+                                         ('replay', 'backtest', 'Replay historical candles or archived ticks through the trade logic (backtest.py arguments follow).')]:
+        # Everything after the subcommand (including -h) goes to the module's own parser
+        subparser = subparsers.add_parser(command, help=description, add_help=False)
+        subparser.set_defaults(module=module)
+
+    args, arguments = parser.parse_known_args(argv)
+
+    if args.command == None:
+        parser.print_help()
+
+        sys.exit(2)
+
+    if args.command in ['bench', 'replay']:
+        # These keep their own command lines
+        sys.argv = [args.module + '.py'] + arguments
+
+        runpy.run_module(args.module, run_name='__main__')
+
+        return
+
+    if len(arguments) > 0:
+        parser.error('unrecognized arguments: ' + ' '.join(arguments))
+
+    config = settings.load_config(args.config)
+
+    mongo_uri = settings.mongo_uri(config, atlas=args.atlas)
+
+    supervisor = Supervisor(backoff_max=args.backoff_max, health_port=args.health_port if args.health_port > 0 else None)
+
+    if args.command in ['ticker', 'all']:
+        supervisor.add('ticker', TickerComponent(config, args.config, mongo_uri, tick_archive=args.tick_archive))
+
+    if args.command in ['trader', 'all']:
+        supervisor.add('trader', TraderComponent(config, args.config, mongo_uri, live=args.live, poll_interval=args.poll,
+                                                       max_tick_age=args.max_tick_age),
+                       requires=['ticker'] if args.command == 'all' else [])
+
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+
+from backtest import Backtester, MarketData, summarize
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# create_trade() parameters that may be swept
+sweep_parameters = ['profit_level', 'stop_level', 'price_tolerance', 'entry_timeout', 'spend_proportion']
+
+# Set in each worker process by init_worker()
+worker_data = None
+worker_backtester = None
+
+
+def parse_range(value):
+    # 'start:stop:step' (stop inclusive) or comma separated values
+    if ':' in value:
+        start, stop, step = [float(x) for x in value.split(':')]
+
+        values = []
+
+        i = 0
+
+        while start + i * step <= stop + step * 1e-9:
+            values.append(round(start + i * step, 10))
+
+            i += 1
+
+        return values
+
+    return [float(x) for x in value.split(',')]
+
+
+def grid(ranges):
+    # ranges: parameter -> list of values
+    names = sorted(ranges)
+
+    for values in itertools.product(*[ranges[name] for name in names]):
+        yield dict(zip(names, values))
+
+
+def sample(ranges, count, seed=None):
+    # Uniform random sample between the min and max of each range
+    rng = random.Random(seed)
+
+    names = sorted(ranges)
+
+    for _ in range(count):
+        yield {name: round(rng.uniform(min(ranges[name]), max(ranges[name])), 6) for name in names}
+
+
+def load_samples(samples_path, ranges, count, seed=None):
+    # Random sample persisted next to the results, so a resumed sweep evaluates the same sets.
+    # The stored sample is reused while ranges and count (and seed, if given) match; otherwise a new one is drawn.
+    if os.path.exists(samples_path):
+        with open(samples_path, 'r', encoding='utf-8') as file:
+            stored = json.load(file)
+
+        if stored['ranges'] == ranges and stored['count'] == count and (seed == None or stored['seed'] == seed):
+            logger.info('Resuming random sample of ' + str(count) + ' sets (seed ' + str(stored['seed']) + ') from ' + samples_path + '.')
+
+            return stored['parameter_sets']
+
+        logger.warning('Ranges, count or seed differ from ' + samples_path + '. Drawing a new sample.')
+
+    if seed == None:
+        seed = random.randrange(2 ** 32)
+
+    parameter_sets = list(sample(ranges, count, seed=seed))
+
+    with open(samples_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(dict(ranges=ranges, count=count, seed=seed, parameter_sets=parameter_sets), file)
+
+    os.replace(samples_path + '.tmp', samples_path)
+
+    logger.info('Sampled ' + str(count) + ' sets with seed ' + str(seed) + ' (saved to ' + samples_path + ').')
+
+    return parameter_sets
+
+
+def parameter_key(parameters):
+    return json.dumps(parameters, sort_keys=True, separators=(',', ':'))
+
+
+def init_worker(market, data_path, maker_fee, taker_fee):
+    # Market data is mapped read-only once per worker; every evaluation shares the same pages
+    global worker_data
+    global worker_backtester
+
+    worker_data = MarketData.load(market, data_path)
+
+    worker_backtester = Backtester(maker_fee=maker_fee, taker_fee=taker_fee)
+
+
+def evaluate(parameters):
+    run_start = time.perf_counter()
+
+    trades = worker_backtester.run(worker_data, **parameters)
+
+    summary = summarize(trades)
+
+    summary['return'] = round(summary['profit'] / summary['spend'], 6) if summary['spend'] > 0 else 0.0
+
+    return dict(key=parameter_key(parameters), parameters=parameters, summary=summary,
+                seconds=round(time.perf_counter() - run_start, 4))
+
+
+def load_results(results_path):
+    results = {}
+
+    if os.path.exists(results_path):
+        with open(results_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    result = json.loads(line)
+
+                except ValueError:
+                    # Partial line from an interrupted run
+                    continue
+
+                results[result['key']] = result
+
+    return results
+
+
+def rank(results, metric='profit'):
+    return sorted(results, key=lambda result: result['summary'][metric], reverse=True)
+
+
+def run_sweep(market, data_path, parameter_sets, results_path, processes=None, maker_fee=0.001, taker_fee=0.002):
+    # Appends one JSON line per evaluated parameter set to results_path; sets already there are skipped,
+    # so an interrupted sweep resumes where it stopped
+    results = load_results(results_path)
+
+    pending = []
+
+    for parameters in parameter_sets:
+        key = parameter_key(parameters)
+
+        if key not in results:
+            pending.append(parameters)
+
+            results[key] = None
+
+    logger.info(str(len(pending)) + ' parameter sets to evaluate (' + str(len(results) - len(pending)) + ' already done).')
+
+    if len(pending) > 0:
+        sweep_start = time.perf_counter()
+
+        pool = multiprocessing.Pool(processes=processes, initializer=init_worker,
+                                    initargs=(market, data_path, maker_fee, taker_fee))
+
+        try:
+            with open(results_path, 'a', encoding='utf-8', buffering=1) as file:
+                for count, result in enumerate(pool.imap_unordered(evaluate, pending, chunksize=4), 1):
+                    file.write(json.dumps(result) + '\n')
+
+                    results[result['key']] = result
+
+                    if count % 100 == 0:
+                        logger.debug(str(count) + '/' + str(len(pending)) + ' evaluated.')
+
+            pool.close()
+
+        finally:
+            pool.terminate()
+
+            pool.join()
+
+        logger.info('Evaluated ' + str(len(pending)) + ' parameter sets in ' +
+                    str(round(time.perf_counter() - sweep_start, 2)) + ' s.')
+
+    return [result for result in results.values() if result is not None]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('market', type=str, help='Market to sweep (ex. BTC_STR).')
+    parser.add_argument('-d', '--data', type=str, default=None, help='MarketData .npy file (written from --candles if given).')
+    parser.add_argument('-c', '--candles', type=str, default=None, help='JSON file of returnChartData() candles.')
+    parser.add_argument('-r', '--results', type=str, default='sweep.jsonl', help='Results file (appended to and resumed from).')
+    parser.add_argument('--profit_level', type=str, default='0.005:0.03:0.005', help='start:stop:step or comma separated values.')
+    parser.add_argument('--stop_level', type=str, default='0.005:0.03:0.005', help='start:stop:step or comma separated values.')
+    parser.add_argument('--price_tolerance', type=str, default='0.0005,0.001,0.002', help='start:stop:step or comma separated values.')
+    parser.add_argument('--entry_timeout', type=str, default='5', help='start:stop:step or comma separated values.')
+    parser.add_argument('--spend_proportion', type=str, default='0.01', help='start:stop:step or comma separated values.')
+    parser.add_argument('-n', '--samples', type=int, default=None, help='Random sample of this many sets instead of the full grid.')
+    parser.add_argument('--seed', type=int, default=None, help='Random sample seed (default random, saved with the sample for resume).')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='Worker processes (default CPU count).')
+    parser.add_argument('--metric', type=str, default='profit', help='Summary field to rank by.')
+    parser.add_argument('-t', '--top', type=int, default=20, help='Ranked results to display.')
+    args = parser.parse_args()
+
+    data_path = args.data if args.data != None else args.market + '.npy'
+
+    if args.candles != None:
+        with open(args.candles, 'r', encoding='utf-8') as file:
+            MarketData.from_candles(args.market, json.load(file)).save(data_path)
+
+        logger.info('Saved market data to ' + data_path + '.')
+
+    ranges = {name: parse_range(getattr(args, name)) for name in sweep_parameters}
+
+    if args.samples != None:
+        parameter_sets = load_samples(os.path.splitext(args.results)[0] + '_samples.json', ranges, args.samples, seed=args.seed)
+
+    else:
+        parameter_sets = grid(ranges)
+
+    ranked = rank(run_sweep(args.market, data_path, parameter_sets, args.results, processes=args.processes), metric=args.metric)
+
+    ranked_path = os.path.splitext(args.results)[0] + '_ranked.json'
+
+    with open(ranked_path, 'w', encoding='utf-8') as file:
+        json.dump(ranked, file, indent=2)
+
+    logger.info('Ranked results written to ' + ranked_path + '.')
+
+    print('{:>4} {:>12} {:>8} {:>7} {:>5} {:>5}  {}'.format('rank', args.metric, 'return', 'trades', 'tgt', 'stop', 'parameters'))
+
+    for i, result in enumerate(ranked[:args.top], 1):
+        summary = result['summary']
+
+        print('{:>4} {:>12} {:>8} {:>7} {:>5} {:>5}  {}'.format(i, summary[args.metric], summary['return'], summary['trades'],
+                                                              summary['target'], summary['stop'], result['key']))
@@ -0,0 +1,55 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+ticker_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ticker.py')
+
+
+def run_legacy_script(arguments, timeout=5):
+    # Returns (exit code or None if still running after timeout, stderr)
+    process = subprocess.Popen([sys.executable, ticker_script] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    try:
+        stderr = process.communicate(timeout=timeout)[1]
+
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+        stderr = process.communicate()[1]
+
+        return None, stderr.decode(errors='replace')
+
+    return process.returncode, stderr.decode(errors='replace')
+
+
+def test_legacy_script_arguments():
+    # 'python marcopolo/ticker.py -c CONFIG' and '-a' keep working now that the script runs the supervisor's ticker command
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, 'config.ini')
+
+        with open(config_path, 'w', encoding='utf-8') as file:
+            file.write('[mongodb]\nuri_local = mongodb://localhost:1/\natlas_user = user\natlas_pass = pass\nuri_atlas = localhost:1/\n')
+
+        for arguments in [['-c', config_path], ['-c', config_path, '-a'], ['--config', config_path, '--atlas']]:
+            returncode, stderr = run_legacy_script(arguments + ['--health_port', '0'])
+
+            assert 'unrecognized arguments' not in stderr, stderr
+            assert returncode != 2, stderr
+
+
+if __name__ == '__main__':
+    try:
+        test_legacy_script_arguments()
+
+        logger.info('Legacy ticker.py arguments accepted.')
+
+    except AssertionError as e:
+        logger.exception(e)
+
+        sys.exit(1)
@@ -0,0 +1,390 @@
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import money
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Daily per-market tick files: <root>/<YYYY-MM-DD>/<market>.ticks
+#
+#   magic (8 bytes) | header length, data offset (2 x uint32) | JSON header | padding | sparse time index | columns
+#
+# Columns are contiguous fixed-width arrays: receive time as float64, prices and 24h base volume as int64 units (see money.py).
+# Ticks are appended to <market>.rows staging files during the day and rolled into the columnar file afterwards.
+magic = b'MPTICKS1'
+
+columns = [('time', '<f8'), ('bid', '<i8'), ('ask', '<i8'), ('last', '<i8'), ('base_volume', '<i8')]
+
+row_dtype = np.dtype(columns)
+
+# Every index_every-th receive time is copied to the index, so a seek only touches one block of the time column
+index_every = 1024
+
+# Column data starts on a page-friendly boundary
+alignment = 64
+
+file_suffix = '.ticks'
+staging_suffix = '.rows'
+
+
+def day_of(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+
+def day_start(day):
+    return (datetime.datetime.strptime(day, '%Y-%m-%d') - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def write_day(path, market, day, rows):
+    # rows: row_dtype array sorted by time. Written to a temporary file and renamed, so readers never see a partial file.
+    index = np.ascontiguousarray(rows['time'][::index_every])
+
+    offset = index.nbytes
+
+    layout = []
+
+    for name, dtype in columns:
+        layout.append([name, dtype, offset])
+
+        offset += len(rows) * np.dtype(dtype).itemsize
+
+    header = json.dumps(dict(market=market, day=day, rows=len(rows), index_every=index_every, index=len(index),
+                             columns=layout)).encode()
+
+    data_offset = -(-(len(magic) + 8 + len(header)) // alignment) * alignment
+
+    with open(path + '.tmp', 'wb') as file:
+        file.write(magic)
+        file.write(struct.pack('<II', len(header), data_offset))
+        file.write(header)
+        file.write(b'\0' * (data_offset - len(magic) - 8 - len(header)))
+
+        file.write(index.tobytes())
+
+        for name, dtype in columns:
+            file.write(np.ascontiguousarray(rows[name], dtype=dtype).tobytes())
+
+    os.replace(path + '.tmp', path)
+
+
+class TickFile(object):
+
+    def __init__(self, path):
+        # Column arrays are read-only views of the mapped file; nothing is read until a page is touched
+        self.path = path
+
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+
+        if bytes(self.buffer[:len(magic)]) != magic:
+            raise ValueError('Not a tick archive file: ' + path)
+
+        header_length, self.data_offset = struct.unpack('<II', bytes(self.buffer[len(magic):len(magic) + 8]))
+
+        self.header = json.loads(bytes(self.buffer[len(magic) + 8:len(magic) + 8 + header_length]).decode())
+
+        self.market = self.header['market']
+        self.day = self.header['day']
+        self.rows = self.header['rows']
+        self.index_every = self.header['index_every']
+
+        self.index = TickFile.view(self, 0, self.header['index'], '<f8')
+
+        self.columns = {name: TickFile.view(self, offset, self.rows, dtype) for name, dtype, offset in self.header['columns']}
+
+
+    def view(self, offset, count, dtype):
+        return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.data_offset + offset)
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+    def seek(self, timestamp, side='left'):
+        # Row of the first tick at (side='left') or after (side='right') timestamp.
+        # Binary search of the sparse index, then of the one block of the time column it points to.
+        block = int(np.searchsorted(self.index, timestamp, side=side))
+
+        if block == 0:
+            return 0
+
+        lo = (block - 1) * self.index_every
+        hi = min(block * self.index_every, self.rows)
+
+        return lo + int(np.searchsorted(self.columns['time'][lo:hi], timestamp, side=side))
+
+
+    def range(self, start=None, end=None):
+        # Column views for ticks received in [start, end)
+        lo = TickFile.seek(self, start) if start != None else 0
+        hi = TickFile.seek(self, end) if end != None else self.rows
+
+        return {name: self.columns[name][lo:hi] for name in self.columns}
+
+
+class TickArchive(object):
+
+    def __init__(self, root):
+        self.root = root
+
+        # (market, day) -> TickFile, so repeated scans reuse the same mapping
+        self.files = {}
+
+
+    def path(self, market, day):
+        return os.path.join(self.root, day, market + file_suffix)
+
+
+    def days(self):
+        return sorted([day for day in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, day))]) if os.path.isdir(self.root) else []
+
+
+    def markets(self, day):
+        return sorted([os.path.basename(path)[:-len(file_suffix)] for path in glob.glob(os.path.join(self.root, day, '*' + file_suffix))])
+
+
+    def open(self, market, day):
+        if (market, day) not in self.files:
+            path = TickArchive.path(self, market, day)
+
+            if os.path.exists(path) == False:
+                return None
+
+            self.files[(market, day)] = TickFile(path)
+
+        return self.files[(market, day)]
+
+
+    def scan(self, day):
+        # market -> TickFile for every market archived on day
+        return {market: TickArchive.open(self, market, day) for market in TickArchive.markets(self, day)}
+
+
+    def range(self, market, start=None, end=None):
+        # Columns for ticks received in [start, end). Views of the mapped file within one day; spanning days concatenates.
+        days = TickArchive.days(self)
+
+        if start != None:
+            days = [day for day in days if day >= day_of(start)]
+
+        if end != None:
+            days = [day for day in days if day <= day_of(end)]
+
+        parts = [TickArchive.open(self, market, day) for day in days]
+
+        parts = [tick_file.range(start, end) for tick_file in parts if tick_file != None]
+
+        if len(parts) == 0:
+            return {name: np.zeros(0, dtype=dtype) for name, dtype in columns}
+
+        if len(parts) == 1:
+            return parts[0]
+
+        return {name: np.concatenate([part[name] for part in parts]) for name, dtype in columns}
+
+
+    def close(self):
+        self.files = {}
+
+
+class TickArchiveWriter(object):
+
+    def __init__(self, root, flush_rows=256, flush_interval=5):
+        self.root = root
+
+        # Buffered ticks are appended to staging files every flush_rows ticks per market or flush_interval seconds
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+
+        # (market, day) -> [row tuple, ...]
+        self.buffers = {}
+
+        self.last_flush = time.time()
+
+        self.day = day_of(time.time())
+
+        self.written = 0
+
+        os.makedirs(root, exist_ok=True)
+
+        # Staging files left by an earlier run (ex. a crash before midnight) are rolled first
+        TickArchiveWriter.roll(self, before=self.day)
+
+
+    def append(self, market, timestamp, bid, ask, last=0, base_volume=0):
+        # Called from the ticker's websocket callback, so this only buffers unless a flush is due
+        with self.lock:
+            day = day_of(timestamp)
+
+            self.buffers.setdefault((market, day), []).append((timestamp, money.to_units(bid), money.to_units(ask),
+                                                               money.to_units(last), money.to_units(base_volume)))
+
+            if day > self.day:
+                # First tick of a new UTC day closes out the previous one
+                TickArchiveWriter.write_buffers(self)
+
+                TickArchiveWriter.roll(self, before=day)
+
+                self.day = day
+
+            elif len(self.buffers[(market, day)]) >= self.flush_rows or time.time() - self.last_flush >= self.flush_interval:
+                TickArchiveWriter.write_buffers(self)
+
+
+    def write_buffers(self):
+        # Caller holds self.lock
+        for (market, day), buffer in self.buffers.items():
+            if len(buffer) == 0:
+                continue
+
+            os.makedirs(os.path.join(self.root, day), exist_ok=True)
+
+            with open(os.path.join(self.root, day, market + staging_suffix), 'ab') as file:
+                file.write(np.array(buffer, dtype=row_dtype).tobytes())
+
+            self.written += len(buffer)
+
+        self.buffers = {}
+
+        self.last_flush = time.time()
+
+
+    def flush(self):
+        with self.lock:
+            TickArchiveWriter.write_buffers(self)
+
+
+    def roll(self, before=None):
+        # Rolls staging files of days before 'before' (all days if None) into columnar files
+        for path in sorted(glob.glob(os.path.join(self.root, '*', '*' + staging_suffix))):
+            day = os.path.basename(os.path.dirname(path))
+            market = os.path.basename(path)[:-len(staging_suffix)]
+
+            if before != None and day >= before:
+                continue
+
+            try:
+                rows = np.fromfile(path, dtype=row_dtype)
+
+                output = os.path.join(self.root, day, market + file_suffix)
+
+                if os.path.exists(output):
+                    # Day already rolled once (ex. by close() before a restart on the same day)
+                    existing = TickFile(output)
+
+                    merged = np.zeros(len(existing) + len(rows), dtype=row_dtype)
+
+                    for name, dtype in columns:
+                        merged[name][:len(existing)] = existing[name]
+
+                    merged[len(existing):] = rows
+
+                    del existing
+
+                    rows = merged
+
+                rows = rows[np.argsort(rows['time'], kind='stable')]
+
+                write_day(output, market, day, rows)
+
+                os.remove(path)
+
+                logger.debug('Rolled ' + str(len(rows)) + ' ticks for ' + market + ' on ' + day + '.')
+
+            except Exception as e:
+                logger.exception('Exception while rolling tick archive file ' + path + '.')
+                logger.exception(e)
+
+
+    def close(self):
+        with self.lock:
+            TickArchiveWriter.write_buffers(self)
+
+            TickArchiveWriter.roll(self)
+
+        logger.debug('Tick archive closed. Ticks written: ' + str(self.written))
+
+
+def import_ticker_docs(writer, ticker_docs):
+    # Stored ticker records with '_id' or 'market', 'received', 'highestBid', 'lowestAsk' (ex. a Mongo tick history)
+    count = 0
+
+    for doc in ticker_docs:
+        writer.append(doc.get('market', doc.get('_id')), doc['received'], doc['highestBid'], doc['lowestAsk'],
+                      doc.get('last', 0), doc.get('baseVolume', 0))
+
+        count += 1
+
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', type=str, help='Tick archive directory.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('roll', help='Roll all staging files into daily columnar files.')
+    scan_parser = subparsers.add_parser('scan', help='Map every market of a day and report its ticks.')
+    scan_parser.add_argument('day', type=str, nargs='?', default=None, help='Day to scan, YYYY-MM-DD (default latest).')
+    import_parser = subparsers.add_parser('import', help='Archive tick documents from a Mongo collection.')
+    import_parser.add_argument('collection', type=str, help='Source collection as database.collection.')
+    import_parser.add_argument('-m', '--mongo', type=str, default=None, help='MongoDB URI (default from config).')
+    args = parser.parse_args()
+
+    if args.command == 'roll':
+        TickArchiveWriter(args.root).close()
+
+    elif args.command == 'scan':
+        archive = TickArchive(args.root)
+
+        day = args.day if args.day != None else archive.days()[-1]
+
+        scan_start = time.perf_counter()
+
+        rows = 0
+
+        for market, tick_file in archive.scan(day).items():
+            # Touches every price once, as a backtest pass would
+            if len(tick_file) > 0:
+                logger.info(market + ': ' + str(len(tick_file)) + ' ticks, bid ' + str(money.to_value(int(tick_file['bid'].min()))) +
+                            ' - ' + str(money.to_value(int(tick_file['bid'].max()))))
+
+            rows += len(tick_file)
+
+        logger.info('Scanned ' + str(rows) + ' ticks on ' + day + ' in ' + str(round(time.perf_counter() - scan_start, 3)) + ' s.')
+
+    elif args.command == 'import':
+        from pymongo import MongoClient
+
+        import settings
+
+        mongo_uri = args.mongo if args.mongo != None else settings.mongo_uri(settings.load_config())
+
+        database, collection = args.collection.split('.', 1)
+
+        writer = TickArchiveWriter(args.root)
+
+        count = import_ticker_docs(writer, MongoClient(mongo_uri)[database][collection].find().sort('received', 1))
+
+        writer.close()
+
+        logger.info('Archived ' + str(count) + ' ticks.')
+
+    else:
+        parser.print_help()
@@ -1,26 +1,11 @@
-import argparse
-import configparser
 import datetime
 import json
 import logging
 from multiprocessing.dummy import Process as Thread
-import time
+import sys
 
-from poloniex import Poloniex
-from pymongo import MongoClient
-from slackclient import SlackClient
-import websocket
-
-config_path_default = '../config/config.ini'
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-c', '--config', type=str, default=config_path_default, help='Path to config file.')
-parser.add_argument('-a', '--atlas', action='store_true', default=False,
-                    help='Use MongoDB Atlas instead of local database.')
-args = parser.parse_args()
-
-use_mongodb_atlas = args.atlas
-config_path = args.config
+from alerts import AlertDispatcher
+from clock import Clock
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -29,14 +14,26 @@ logger.setLevel(logging.DEBUG)
 
 class TickerGenerator(object):
 
-    def __init__(self, slack_info, mongo_ip):
-        self.api = Poloniex()
+    def __init__(self, slack_info, mongo_ip, clock=None, db=None, ws_url='wss://api2.poloniex.com/', alerts=None, tick_archive=None):
+        # Imported here so programs that only read the ticker don't load websocket/Poloniex/pymongo
+        import websocket
+
+        from exchange import get_client
+
+        self.api = get_client()
+
+        self.clock = clock if clock != None else Clock()
 
-        self.db = MongoClient(mongo_uri).poloniex['ticker']
+        if db == None:
+            from pymongo import MongoClient
+
+            db = MongoClient(mongo_ip).poloniex['ticker']
+
+        self.db = db
 
         self.db.drop()
 
-        self.ws = websocket.WebSocketApp("wss://api2.poloniex.com/",
+        self.ws = websocket.WebSocketApp(ws_url,
                                          on_message=self.on_message,
                                          on_error=self.on_error,
                                          on_close=self.on_close)
@@ -45,11 +42,39 @@ class TickerGenerator(object):
 
         self.slack_client = slack_info['client']
 
-        self.slack_channel_id_alerts = slack_info['channels']['alerts'][1]
-        self.slack_channel_id_exceptions = slack_info['channels']['exceptions'][1]
+        # Channel IDs resolved in the background are unknown here, so alerts go to the target and the dispatcher maps it
+        self.slack_channel_id_alerts = slack_info['channels']['alerts'][1] if slack_info['channels']['alerts'][1] != None else 'alerts'
+        self.slack_channel_id_exceptions = slack_info['channels']['exceptions'][1] if slack_info['channels']['exceptions'][1] != None else 'exceptions'
+
+        # Alerts are posted from a background worker so websocket callbacks never wait on Slack
+        if alerts != None:
+            self.alerts = alerts
+
+        else:
+            slack_bot = slack_info.get('bot', {})
+
+            self.alerts = AlertDispatcher(self.slack_client, bot_user=slack_bot.get('user'), bot_icon=slack_bot.get('icon'),
+                                          connect=slack_info.get('connect'))
 
         self.last_update = None
 
+        # Cleared to end monitor() (ex. by the supervisor on shutdown)
+        self.monitoring = False
+
+        # Channels acknowledged by the exchange on the current connection
+        self.subscribed = set()
+
+        # Optional tick history directory; the writer (and NumPy) is only loaded when one is given
+        self.tick_archive = None
+
+        if tick_archive != None:
+            from tickarchive import TickArchiveWriter
+
+            self.tick_archive = TickArchiveWriter(tick_archive)
+
+        # Websocket ticker updates identify markets by currency pair ID
+        self.market_ids = {}
+
 
     def __call__(self, market=None):
         if market:
@@ -76,12 +101,16 @@ class TickerGenerator(object):
                 #print('Subscribed to ticker')
                 logger.debug('Subscribed to ticker.')
 
+                self.subscribed.add(1002)
+
                 return
 
             if message[1] == 0:
                 #print('Unsubscribed to ticker')
                 logger.debug('Unsubscribed from ticker.')
 
+                self.subscribed.discard(1002)
+
                 return
 
             data = message[2]
@@ -96,11 +125,18 @@ class TickerGenerator(object):
                           'quoteVolume': float(data[6]),
                           'isFrozen': float(data[7]),
                           'high24hr': float(data[8]),
-                          'low24hr': float(data[9])
-                          }},
+                          'low24hr': float(data[9]),
+                          'received': self.clock.time()
+                          },
+                 # Per-market update count, so readers can tell a repeated read from a new tick
+                 '$inc': {'seq': 1}},
                 upsert=True)
 
-            self.last_update = time.time()
+            self.last_update = self.clock.time()
+
+            if self.tick_archive != None and int(data[0]) in self.market_ids:
+                # Strings straight from the message, so archived prices are exact
+                self.tick_archive.append(self.market_ids[int(data[0])], self.last_update, data[3], data[2], data[1], data[5])
 
 
     def on_error(self, ws, error):
@@ -116,10 +152,13 @@ class TickerGenerator(object):
         logger.debug('slack_return: ' + str(slack_return))
 
 
-    def on_close(self, ws):
+    def on_close(self, ws, *args):
+        # Newer websocket-client versions also pass close status code and message
         #print("Websocket closed!")
         logger.debug('Websocket closed.')
 
+        self.subscribed.clear()
+
         slack_message = 'Websocket closed.'
 
         #slack_return = Ticker.send_slack_alert(self, channel_id=self.slack_channel_id_alerts, message=slack_message)
@@ -131,10 +170,21 @@ class TickerGenerator(object):
     def on_open(self, ws):
         tick = self.api.returnTicker()
 
+        received = self.clock.time()
+
         for market in tick:
+            tick[market]['received'] = received
+
+            self.market_ids[int(tick[market]['id'])] = market
+
+            if self.tick_archive != None:
+                self.tick_archive.append(market, received, tick[market]['highestBid'], tick[market]['lowestAsk'],
+                                         tick[market]['last'], tick[market]['baseVolume'])
+
             self.db.update_one(
                 {'_id': market},
-                {'$set': tick[market]},
+                {'$set': tick[market],
+                 '$inc': {'seq': 1}},
                 upsert=True)
 
         #print('Populated markets database with ticker data')
@@ -161,6 +211,10 @@ class TickerGenerator(object):
 
 
     def start(self):
+        # Also called by monitor() on reconnect, where the dispatcher is already running
+        if self.alerts.running == False:
+            self.alerts.start()
+
         self.t = Thread(target=self.ws.run_forever)
 
         self.t.daemon = True
@@ -171,7 +225,7 @@ class TickerGenerator(object):
         logger.debug('Thread started.')
 
         #slack_message = 'Ticker startup initialized.'
-        slack_message = '\n*_Ticker startup initialized at ' + str(datetime.datetime.now()) + '._*\n\n'
+        slack_message = '\n*_Ticker startup initialized at ' + str(self.clock.now()) + '._*\n\n'
 
         #slack_return = Ticker.send_slack_alert(self, channel_id=self.slack_channel_id_alerts, message=slack_message)
         slack_return = TickerGenerator.send_slack_alert(self, channel_id=self.slack_channel_id_alerts, message=slack_message)
@@ -187,7 +241,7 @@ class TickerGenerator(object):
         #print('Thread joined')
         logger.debug('Thread joined.')
 
-        slack_message = '*TICKER SHUTDOWN COMPLETED AT ' + str(datetime.datetime.now()) + '.*'
+        slack_message = '*TICKER SHUTDOWN COMPLETED AT ' + str(self.clock.now()) + '.*'
 
         #slack_return = Ticker.send_slack_alert(self, channel_id=self.slack_channel_id_alerts, message=slack_message)
         slack_return = TickerGenerator.send_slack_alert(self, channel_id=self.slack_channel_id_alerts, message=slack_message)
@@ -211,12 +265,14 @@ class TickerGenerator(object):
 
         logger.debug('slack_return: ' + str(slack_return))
 
-        while (True):
+        self.monitoring = True
+
+        while self.monitoring == True:
             try:
                 #logger.debug('ticker.last_update: ' + str(ticker.last_update))
                 #if (datetime.datetime.now() - ticker.last_update) > error_timeout:
                 #if (time.time() - ticker.last_update) > error_timeout:
-                if (time.time() - self.last_update) > error_timeout:
+                if (self.clock.time() - self.last_update) > error_timeout:
                     if error_message_sent == False:
                         error_message = '*NO TICKER DATA RECEIVED IN 30 SECONDS.*\n'
                         error_message += 'Restarting websocket connection.\n'
@@ -228,19 +284,19 @@ class TickerGenerator(object):
 
                         error_message_sent = True
 
-                        error_message_time = datetime.datetime.now()
+                        error_message_time = self.clock.now()
 
                         logger.info('Stopping websocket connection.')
 
                         TickerGenerator.stop(self)
 
-                        time.sleep(5)
+                        self.clock.sleep(5)
 
                         logger.info('Restarting websocket connection.')
 
                         TickerGenerator.start(self)
 
-                        time.sleep(5)
+                        self.clock.sleep(5)
 
                         logger.info('Websocket connection restored.')
 
@@ -251,12 +307,12 @@ class TickerGenerator(object):
 
                         logger.debug('slack_return: ' + str(slack_return))
 
-                if error_message_sent == True and (datetime.datetime.now() - error_message_time) > error_message_reset:
+                if error_message_sent == True and (self.clock.now() - error_message_time) > error_message_reset:
                     logger.info('Resetting error message sent switch to allow another alert.')
 
                     error_message_sent = False
 
-                time.sleep(1)
+                self.clock.sleep(1)
 
             except Exception as e:
                 logger.exception('Exception in inner loop.')
@@ -275,202 +331,69 @@ class TickerGenerator(object):
         logger.debug('slack_return: ' + str(slack_return))
 
 
-    def send_slack_alert(self, channel_id, message):
-        alert_return = {'Exception': False, 'result':{}}
-
-        try:
-            alert_return['result'] = slack_client.api_call(
-                'chat.postMessage',
-                channel=channel_id,
-                text=message,
-                username=slack_bot_user,
-                icon_url=slack_bot_icon
-            )
+    def health(self, max_tick_age=30):
+        now = self.clock.time()
 
-        except Exception as e:
-            logger.exception('Exception raised in TickerGenerator.send_slack_alert().')
-            logger.exception(e)
+        market_age = {tick['_id']: round(now - tick['received'], 3) for tick in self.db.find({}, {'received': True}) if tick.get('received') != None}
 
-            alert_return['Exception'] = True
+        stale_markets = sorted([market for market in market_age if market_age[market] > max_tick_age])
 
-        finally:
-            return alert_return
+        sock = getattr(self.ws, 'sock', None)
 
+        connected = sock is not None and sock.connected == True
 
-class Ticker:
-
-    def __init__(self, mongo_ip):
-        self.db = MongoClient(mongo_ip).poloniex['ticker']
-
-
-    def __call__(self, market=None):
-        if market:
-            return self.db.find_one({'_id': market})
-
-        return list(self.db.find())
-
-
-if __name__ == "__main__":
-    try:
-        config = configparser.ConfigParser()
-        config.read(config_path)
+        last_update_age = round(now - self.last_update, 3) if self.last_update != None else None
 
-        slack_token = config['slack']['token']
-        slack_channel_alerts = config['slack']['channel_alerts']
-        slack_channel_exceptions = config['slack']['channel_exceptions']
-        slack_bot_user = config['slack']['bot_user']
-        slack_bot_icon = config['slack']['bot_icon']
+        return dict(ready=connected == True and 1002 in self.subscribed and last_update_age != None and last_update_age <= max_tick_age,
+                    websocket=dict(connected=connected, subscribed=sorted(self.subscribed)),
+                    last_update_age_s=last_update_age,
+                    markets=len(market_age),
+                    stale_markets=stale_markets,
+                    oldest_tick_age_s=max(market_age.values()) if len(market_age) > 0 else None,
+                    market_age_s=market_age,
+                    alerts=self.alerts.health(),
+                    rate_limit=self.api.rate_limit())
 
-        logger.info('Initializing Slack client.')
 
-        # Slack connection
-        slack_client = SlackClient(slack_token)
-
-        channel_list = slack_client.api_call('channels.list')
-        group_list = slack_client.api_call('groups.list')
-
-        slack_channel_targets = {'alerts': slack_channel_alerts,
-                                 'exceptions': slack_channel_exceptions}
-
-        for target in slack_channel_targets:
-            try:
-                logger.debug('channel_list.get(\'ok\'): ' + str(channel_list.get('ok')))
-                if channel_list.get('ok'):
-                    for chan in channel_list['channels']:
-                        logger.debug('chan[\'name\']: ' + chan['name'])
-                        if chan['name'] == slack_channel_targets[target]:
-                            if target == 'alerts':
-                                slack_channel_id_alerts = chan['id']
-
-                            elif target == 'exceptions':
-                                slack_channel_id_exceptions = chan['id']
-
-                            break
-                    else:
-                        logger.error('No valid Slack channel found for alert in channel list.')
-
-                        sys.exit(1)
-
-                else:
-                    logger.error('Channel list API call failed.')
-
-                    sys.exit(1)
-
-            except:
-                logger.debug('group_list.get(\'ok\'): ' + str(group_list.get('ok')))
-                if group_list.get('ok'):
-                    for group in group_list['groups']:
-                        logger.debug('group[\'name\']: ' + group['name'])
-                        if group['name'] == slack_channel_targets[target]:
-                            if target == 'alerts':
-                                slack_channel_id_alerts = group['id']
-
-                            elif target == 'exceptions':
-                                slack_channel_id_exceptions = group['id']
-
-                            break
-                    else:
-                        logger.error('No valid Slack channel found for alert in group list.')
-
-                        sys.exit(1)
-
-                else:
-                    logger.error('Group list API call failed.')
-
-                    sys.exit(1)
-
-        logger.info('Slack channel for alerts: #' + slack_channel_alerts +
-                    ' (' + slack_channel_id_alerts + ')')
-
-        logger.info('Slack channel for exceptions: #' + slack_channel_exceptions +
-                    ' (' + slack_channel_id_exceptions + ')')
-
-        slack_info = dict(client=slack_client,
-                          token=slack_token,
-                          channels=dict(alerts=(slack_channel_alerts, slack_channel_id_alerts),
-                                        exceptions=(slack_channel_exceptions, slack_channel_id_exceptions)),
-                          bot=dict(user=slack_bot_user,
-                                   icon=slack_bot_icon))
-
-        logger.info('Initializing ticker.')
-
-        # websocket.enableTrace(True)
-
-        if use_mongodb_atlas == True:
-            atlas_user = config['mongodb']['atlas_user']
-            atlas_pass = config['mongodb']['atlas_pass']
-
-            cluster_uri = config['mongodb']['uri_atlas']
-
-            mongo_uri = 'mongodb+srv://' + atlas_user + ':' + atlas_pass + '@' + cluster_uri
-
-        else:
-            mongo_uri = config['mongodb']['uri_local']
-
-        logger.debug('mongo_uri: ' + mongo_uri)
-
-        #ticker = Ticker(slack_info=slack_info, mongo_ip=mongo_ip_local)
-        ticker_generator = TickerGenerator(slack_info=slack_info, mongo_ip=mongo_uri)
-
-        #logger.info('Starting ticker thread.')
-        logger.info('Starting ticker generator in separate thread.')
-
-        #ticker.start()
-        ticker_generator.start()
-
-        #logger.info('Waiting for ticker to be ready.')
-        logger.info('Waiting for ticker generator to be ready.')
-
-        #while ticker.last_update == None:
-        while ticker_generator.last_update == None:
-            #logger.debug('ticker.last_update: ' + str(ticker.last_update))
-            logger.debug('ticker_generator.last_update: ' + str(ticker_generator.last_update))
+    def send_slack_alert(self, channel_id, message):
+        # Queued for the alert dispatcher; returns False if the alert was dropped
+        return self.alerts.send(channel_id, message)
 
-            time.sleep(1)
 
-        #logger.debug('ticker.last_update: ' + str(ticker.last_update))
-        logger.debug('ticker_generator.last_update: ' + str(ticker_generator.last_update))
+class Ticker:
 
-        #last_update = ticker.last_update
-        last_update = ticker_generator.last_update
+    def __init__(self, mongo_ip, db=None, clock=None):
+        # Same clock as the writer's 'received' timestamps
+        self.clock = clock if clock != None else Clock()
 
-        if use_mongodb_atlas == True:
-            mongo_uri_preview = 'on MongoDB Atlas cluster:\n_mongodb+srv://{ATLAS_USER}:{ATLAS_PASS}@' + cluster_uri + '_'
+        if db == None:
+            from pymongo import MongoClient
 
-        else:
-            if mongo_uri.split('.')[0].split('/')[-1] == '192':
-                location = 'local'
-            else:
-                location = 'remote'
+            db = MongoClient(mongo_ip).poloniex['ticker']
 
-            mongo_uri_preview = 'at ' + location + ' ip:\n' + mongo_uri + ''
+        self.db = db
 
-        slack_message = 'Real-time Poloniex ticker data ready for use ' + mongo_uri_preview
 
-        #slack_return = ticker.send_slack_alert(channel_id=slack_channel_id_alerts, message=slack_message)
-        slack_return = ticker_generator.send_slack_alert(channel_id=slack_channel_id_alerts, message=slack_message)
-
-        logger.debug('slack_return: ' + str(slack_return))
+    def __call__(self, market=None):
+        if market:
+            return self.db.find_one({'_id': market})
 
-        logger.info('Starting monitor.')
+        return list(self.db.find())
 
-        #ticker.monitor(timeout=30, alert_reset_interval=10)
-        ticker_generator.monitor(timeout=30, alert_reset_interval=10)
 
-        #logger.info('Exited inner loop.')
-        logger.info('Exited monitor.')
+    def age(self, market):
+        # Seconds since the market's last tick was written, or None if it has never ticked
+        tick = self.db.find_one({'_id': market}, {'received': True})
 
-    except Exception as e:
-        logger.exception('Exception in outer loop.')
-        logger.exception(e)
+        if tick == None or tick.get('received') == None:
+            return None
 
-    except KeyboardInterrupt:
-        logger.info('Exit signal raised in outer try/except.')
+        return self.clock.time() - tick['received']
 
-    finally:
-        logger.info('Shutting down ticker.')
 
-        #ticker.stop()
-        ticker_generator.stop()
+if __name__ == "__main__":
+    # Same as 'python -m marcopolo ticker', which reads the shared config and restarts the ticker on failure
+    from supervisor import main
 
-        logger.info('Exiting.')
+    # The script's own options (-c, -a) are the supervisor's global options, so they go before the subcommand
+    main(sys.argv[1:] + ['ticker'])
@@ -0,0 +1,142 @@
+import argparse
+import json
+import logging
+import threading
+import time
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Stages in the order a tick moves through the trade cycle
+#   received  - ticker generator stored the tick (ticker doc 'received' field)
+#   polled    - trade cycle issued its ticker read
+#   visible   - ticker read returned the tick to the trade cycle
+#   evaluated - threshold/stop comparison (or trigger index) decided to act
+#   submitted - REST order/cancel request sent
+#   response  - exchange response received
+stages = ['received', 'polled', 'visible', 'evaluated', 'submitted', 'response']
+
+
+class Span(object):
+
+    __slots__ = ('market', 'times')
+
+    def __init__(self, market, tick_time):
+        self.market = market
+
+        self.times = {'received': tick_time}
+
+
+    def mark(self, stage, t=None):
+        self.times[stage] = time.time() if t is None else t
+
+
+class Tracer(object):
+
+    def __init__(self, path='trace.log'):
+        # With path=None spans are still created but never written
+        self.path = path
+
+        self.lock = threading.Lock()
+
+        self.file = None
+
+        if self.path is not None:
+            self.file = open(self.path, 'a', encoding='utf-8', buffering=1)
+
+
+    def begin(self, market, tick_time, polled=None):
+        span = Span(market, tick_time)
+
+        if polled is not None:
+            span.times['polled'] = polled
+
+        span.times['visible'] = time.time()
+
+        return span
+
+
+    def finish(self, span, action):
+        # Only spans that led to an order action are written, keyed by originating tick time
+        if self.file is None or 'submitted' not in span.times:
+            return
+
+        line = json.dumps([span.times.get('received'), span.market, action,
+                           [span.times.get(stage) for stage in stages[1:]]], separators=(',', ':'))
+
+        with self.lock:
+            self.file.write(line + '\n')
+
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+            self.file = None
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(path):
+    # Latency of each stage from the previous recorded stage, plus tick-to-response total, in ms
+    latencies = {stage: [] for stage in stages[1:]}
+    latencies['total'] = []
+
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                tick_time, market, action, times = json.loads(line)
+
+            except ValueError:
+                continue
+
+            previous = tick_time
+
+            for stage, t in zip(stages[1:], times):
+                if t is None:
+                    continue
+
+                if previous is not None:
+                    latencies[stage].append((t - previous) * 1000)
+
+                previous = t
+
+            if tick_time is not None and times[-1] is not None:
+                latencies['total'].append((times[-1] - tick_time) * 1000)
+
+    report = {}
+
+    for stage in latencies:
+        values = latencies[stage]
+
+        report[stage] = dict(count=len(values),
+                             p50_ms=percentile(values, 50),
+                             p99_ms=percentile(values, 99),
+                             max_ms=max(values) if len(values) > 0 else None)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str, nargs='?', default='trace.log', help='Trace log to summarize.')
+    args = parser.parse_args()
+
+    report = summarize(args.path)
+
+    print('{:<10} {:>7} {:>12} {:>12} {:>12}'.format('stage', 'count', 'p50 (ms)', 'p99 (ms)', 'max (ms)'))
+
+    for stage in stages[1:] + ['total']:
+        row = report[stage]
+
+        print('{:<10} {:>7} {:>12} {:>12} {:>12}'.format(stage, row['count'],
+                                                         *['-' if row[key] is None else '{:.3f}'.format(row[key])
+                                                           for key in ['p50_ms', 'p99_ms', 'max_ms']]))
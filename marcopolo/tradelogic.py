@@ -0,0 +1,75 @@
+# Price levels and trigger conditions of the trade cycle, shared by MarcoPolo.run_trade_cycle() and the backtester.
+# Comparisons use plain operators so they also work element-wise on NumPy arrays.
+# Price levels are computed in integer units (see money.py) and returned as floats exact to 1e-8.
+
+import money
+
+
+def buy_max_price(buy_target, price_tolerance):
+    return money.to_value(money.scaled(money.to_units(buy_target), 1 + price_tolerance))
+
+
+def target_price(buy_target, profit_level):
+    return money.to_value(money.scaled(money.to_units(buy_target), 1 + profit_level))
+
+
+def stop_loss_price(buy_target, stop_level):
+    return money.to_value(money.scaled(money.to_units(buy_target), 1 - stop_level))
+
+
+def threshold_baseline(price_actual, buy_target):
+    # Stop-loss monitoring threshold is measured from the better of the actual entry and the target entry
+    if price_actual < buy_target:
+        return price_actual
+
+    return buy_target
+
+
+def monitor_threshold(baseline, stop_price, price_tolerance):
+    baseline = money.to_units(baseline)
+
+    return money.to_value(baseline - money.scaled(baseline - money.to_units(stop_price), price_tolerance))
+
+
+def stop_approach_price(stop_price, price_tolerance):
+    return money.to_value(money.scaled(money.to_units(stop_price), 1 + price_tolerance))
+
+
+def entry_buy_amount(spend_remaining, lowest_ask):
+    return money.to_value(money.div(money.to_units(spend_remaining), money.to_units(lowest_ask)))
+
+
+def entry_price_ok(lowest_ask, buy_max):
+    return lowest_ask <= buy_max
+
+
+def below_threshold(highest_bid, threshold):
+    # Resting target sell is pulled and stop-loss monitoring starts
+    return highest_bid < threshold
+
+
+def above_threshold(highest_bid, threshold):
+    # Stop-loss monitoring ends and target sell is placed again
+    return highest_bid > threshold
+
+
+def approaching_stop(highest_bid, stop_price, price_tolerance):
+    return highest_bid <= stop_approach_price(stop_price, price_tolerance)
+
+
+def depth_price(bids, amount):
+    # Walks [price, amount] bid levels and returns the price at which cumulative depth covers amount.
+    # Depth is summed as int64 units, so a book that exactly covers the amount isn't missed by float drift.
+    if len(bids) == 0:
+        return None
+
+    index = money.depth_index(money.to_units_array([bid[1] for bid in bids]), money.to_units(amount))
+
+    if index is None:
+        return None
+
+    return float(bids[index][0])
+
+
+def stop_triggered(bid_price, stop_price):
+    return bid_price <= stop_price
@@ -0,0 +1,213 @@
+import logging
+from multiprocessing.dummy import Process as Thread
+import threading
+import time
+
+import numpy as np
+from pymongo import UpdateOne
+
+import money
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class TrailingStopEngine(object):
+
+    def __init__(self, db=None, capacity=64):
+        # Trade collection that changed stops are written back to (sell.stop / sell.high_water)
+        self.db = db
+
+        self.lock = threading.Lock()
+
+        # Prices are int64 units (see money.py), so ratcheting compares exact values
+        self.high_water = np.zeros(capacity, dtype=np.int64)
+        self.trail = np.zeros(capacity, dtype=np.float64)
+        self.stops = np.zeros(capacity, dtype=np.int64)
+        self.persisted_stops = np.zeros(capacity, dtype=np.int64)
+        self.market_index = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+
+        # trade_id -> slot, and slot -> trade_id
+        self.slots = {}
+        self.slot_ids = [None] * capacity
+
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        # market -> column in per-batch price vector
+        self.markets = {}
+
+        self.running = False
+
+
+    def grow(self):
+        capacity = len(self.slot_ids)
+
+        for name in ['high_water', 'trail', 'stops', 'persisted_stops', 'market_index', 'active']:
+            array = getattr(self, name)
+
+            grown = np.zeros(capacity * 2, dtype=array.dtype)
+            grown[:capacity] = array
+
+            setattr(self, name, grown)
+
+        self.slot_ids.extend([None] * capacity)
+
+        self.free_slots.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+        logger.debug('Trailing stop capacity increased to ' + str(capacity * 2) + '.')
+
+
+    def add(self, trade_id, market, entry_price, trail_level, stop_price=None):
+        with self.lock:
+            if trade_id in self.slots:
+                slot = self.slots[trade_id]
+
+            else:
+                if len(self.free_slots) == 0:
+                    TrailingStopEngine.grow(self)
+
+                slot = self.free_slots.pop()
+
+                self.slots[trade_id] = slot
+                self.slot_ids[slot] = trade_id
+
+            if market not in self.markets:
+                self.markets[market] = len(self.markets)
+
+            stop = money.scaled(money.to_units(entry_price), 1 - trail_level)
+
+            if stop_price is not None and money.to_units(stop_price) > stop:
+                stop = money.to_units(stop_price)
+
+            self.high_water[slot] = money.to_units(entry_price)
+            self.trail[slot] = trail_level
+            self.stops[slot] = stop
+            self.persisted_stops[slot] = stop
+            self.market_index[slot] = self.markets[market]
+            self.active[slot] = True
+
+        stop = money.to_value(stop)
+
+        logger.debug('Trailing stop added for ' + str(trade_id) + ' at ' + str(stop) + ' (trail ' + str(trail_level) + ').')
+
+        return stop
+
+
+    def remove(self, trade_id):
+        with self.lock:
+            slot = self.slots.pop(trade_id, None)
+
+            if slot is None:
+                return
+
+            self.active[slot] = False
+            self.slot_ids[slot] = None
+
+            self.free_slots.append(slot)
+
+
+    def stop_price(self, trade_id):
+        slot = self.slots.get(trade_id)
+
+        if slot is None:
+            return None
+
+        return money.to_value(int(self.stops[slot]))
+
+
+    def high_water_mark(self, trade_id):
+        slot = self.slots.get(trade_id)
+
+        if slot is None:
+            return None
+
+        return money.to_value(int(self.high_water[slot]))
+
+
+    def update(self, prices):
+        # prices: market -> latest highest bid for one tick batch. Returns trade_id -> new stop for changed stops.
+        with self.lock:
+            if len(self.slots) == 0:
+                return {}
+
+            market_prices = np.zeros(len(self.markets), dtype=np.int64)
+            priced = np.zeros(len(self.markets), dtype=bool)
+
+            for market in prices:
+                if market in self.markets:
+                    market_prices[self.markets[market]] = money.to_units(prices[market])
+                    priced[self.markets[market]] = True
+
+            price = market_prices[self.market_index]
+
+            valid = self.active & priced[self.market_index] & (price > self.high_water)
+
+            np.maximum(self.high_water, np.where(valid, price, self.high_water), out=self.high_water)
+
+            # Stops only ratchet upward
+            trailed = np.rint(self.high_water * (1 - self.trail)).astype(np.int64)
+
+            np.maximum(self.stops, np.where(valid, trailed, self.stops), out=self.stops)
+
+            changed = np.flatnonzero(self.active & (self.stops > self.persisted_stops))
+
+            if len(changed) == 0:
+                return {}
+
+            self.persisted_stops[changed] = self.stops[changed]
+
+            updates = {self.slot_ids[slot]: (money.to_value(int(self.stops[slot])), money.to_value(int(self.high_water[slot]))) for slot in changed}
+
+        if self.db is not None:
+            try:
+                self.db.bulk_write([UpdateOne({'_id': trade_id}, {'$set': {'sell.stop': stop, 'sell.high_water': high_water}})
+                                    for trade_id, (stop, high_water) in updates.items()], ordered=False)
+
+            except Exception as e:
+                logger.exception('Exception while persisting trailing stop updates.')
+                logger.exception(e)
+
+        return {trade_id: updates[trade_id][0] for trade_id in updates}
+
+
+    def run(self, ticker, interval):
+        while self.running == True:
+            try:
+                prices = {}
+
+                for tick in ticker():
+                    prices[tick['_id']] = tick['highestBid']
+
+                changed = TrailingStopEngine.update(self, prices)
+
+                if len(changed) > 0:
+                    logger.debug('Trailing stops raised: ' + str(changed))
+
+            except Exception as e:
+                logger.exception('Exception in trailing stop update loop.')
+                logger.exception(e)
+
+            time.sleep(interval)
+
+
+    def start(self, ticker, interval=1):
+        # ticker is a Ticker instance; one read of all markets feeds every active trade per pass
+        self.running = True
+
+        self.t = Thread(target=self.run, args=(ticker, interval))
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.debug('Trailing stop engine started.')
+
+
+    def stop(self):
+        self.running = False
+
+        self.t.join()
+
+        logger.debug('Trailing stop engine stopped.')
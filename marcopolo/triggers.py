@@ -0,0 +1,257 @@
+import heapq
+import itertools
+import logging
+from multiprocessing.dummy import Process as Thread
+import threading
+import time
+
+from clock import Clock
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class Trigger(object):
+
+    __slots__ = ('trigger_id', 'market', 'trade_id', 'kind', 'price', 'direction', 'inclusive', 'callback', 'active',
+                 'tick_time', 'polled')
+
+    def __init__(self, trigger_id, market, trade_id, kind, price, direction, inclusive, callback):
+        self.trigger_id = trigger_id
+        self.market = market
+        self.trade_id = trade_id
+        self.kind = kind
+        self.price = price
+        self.direction = direction
+        self.inclusive = inclusive
+        self.callback = callback
+        self.active = True
+
+        # Received time of the tick that fired this trigger, and when that tick was read (for tracing)
+        self.tick_time = None
+        self.polled = None
+
+
+    def __repr__(self):
+        return ('Trigger(' + str(self.trade_id) + ', ' + self.kind + ', ' + self.direction +
+                (' <=' if self.inclusive else ' <') + ' ' + str(self.price) + ')')
+
+
+class TriggerIndex(object):
+
+    def __init__(self, market):
+        self.market = market
+
+        # 'below' triggers fire when price falls to/through level: max-heap on price (highest level crossed first)
+        # 'above' triggers fire when price rises to/through level: min-heap on price (lowest level crossed first)
+        # Inclusive triggers sort ahead of exclusive ones at the same level.
+        self.below = []
+        self.above = []
+
+        self.count = 0
+
+        self.last_price = None
+
+
+    def add(self, trigger):
+        if trigger.direction == 'below':
+            heapq.heappush(self.below, (-trigger.price, 0 if trigger.inclusive else 1, trigger.trigger_id, trigger))
+
+        elif trigger.direction == 'above':
+            heapq.heappush(self.above, (trigger.price, 0 if trigger.inclusive else 1, trigger.trigger_id, trigger))
+
+        else:
+            raise ValueError('Trigger direction must be \'below\' or \'above\'.')
+
+        self.count += 1
+
+
+    def on_tick(self, price):
+        # Pops only the triggers this price crossed; everything else stays untouched in the heaps
+        fired = []
+
+        while len(self.below) > 0:
+            trigger = self.below[0][3]
+
+            if trigger.active == False:
+                heapq.heappop(self.below)
+
+                continue
+
+            if price < trigger.price or (trigger.inclusive and price == trigger.price):
+                heapq.heappop(self.below)
+
+                fired.append(trigger)
+
+            else:
+                break
+
+        while len(self.above) > 0:
+            trigger = self.above[0][3]
+
+            if trigger.active == False:
+                heapq.heappop(self.above)
+
+                continue
+
+            if price > trigger.price or (trigger.inclusive and price == trigger.price):
+                heapq.heappop(self.above)
+
+                fired.append(trigger)
+
+            else:
+                break
+
+        for trigger in fired:
+            trigger.active = False
+
+        self.count -= len(fired)
+
+        self.last_price = price
+
+        return fired
+
+
+class TriggerBook(object):
+
+    def __init__(self, max_tick_age=None, clock=None):
+        self.lock = threading.Lock()
+
+        # Ticks older than this (seconds since 'received') are not evaluated, so a frozen market can't fire triggers
+        self.max_tick_age = max_tick_age
+
+        # Tick ages are measured on the same clock as the trade cycles' own freshness checks
+        self.clock = clock if clock != None else Clock()
+
+        self.stale_ticks = 0
+
+        # market -> TriggerIndex
+        self.indexes = {}
+
+        # trigger_id -> Trigger, for removal
+        self.triggers = {}
+
+        self.trigger_ids = itertools.count(1)
+
+        self.running = False
+
+
+    def add(self, market, trade_id, kind, price, direction, inclusive=False, callback=None):
+        # callback(trigger) runs on the thread delivering the tick; keep it short (ex. set an Event)
+        with self.lock:
+            trigger = Trigger(next(self.trigger_ids), market, trade_id, kind, price, direction, inclusive, callback)
+
+            if market not in self.indexes:
+                self.indexes[market] = TriggerIndex(market)
+
+            self.indexes[market].add(trigger)
+
+            self.triggers[trigger.trigger_id] = trigger
+
+        return trigger.trigger_id
+
+
+    def remove(self, trigger_id):
+        with self.lock:
+            trigger = self.triggers.pop(trigger_id, None)
+
+            if trigger is None or trigger.active == False:
+                return False
+
+            # Lazy deletion, skipped when it reaches the top of its heap
+            trigger.active = False
+
+            self.indexes[trigger.market].count -= 1
+
+        return True
+
+
+    def remove_trade(self, trade_id):
+        # Ids are collected under the lock (ticks pop fired triggers concurrently); remove() takes it again per trigger
+        with self.lock:
+            trigger_ids = [trigger.trigger_id for trigger in self.triggers.values() if trigger.trade_id == trade_id]
+
+        for trigger_id in trigger_ids:
+            TriggerBook.remove(self, trigger_id)
+
+
+    def pending(self, market=None):
+        if market is not None:
+            return self.indexes[market].count if market in self.indexes else 0
+
+        return sum([index.count for index in self.indexes.values()])
+
+
+    def on_tick(self, market, price, tick_time=None, polled=None):
+        with self.lock:
+            index = self.indexes.get(market)
+
+            if index is None:
+                return []
+
+            fired = index.on_tick(price)
+
+            for trigger in fired:
+                self.triggers.pop(trigger.trigger_id, None)
+
+                trigger.tick_time = tick_time
+                trigger.polled = polled
+
+        for trigger in fired:
+            logger.debug('Trigger fired at ' + str(price) + ': ' + str(trigger))
+
+            if trigger.callback is not None:
+                try:
+                    trigger.callback(trigger)
+
+                except Exception as e:
+                    logger.exception('Exception in trigger callback.')
+                    logger.exception(e)
+
+        return fired
+
+
+    def run(self, ticker, interval):
+        while self.running == True:
+            try:
+                # Tracing measures real latency, so the read time stays on wall time
+                polled = time.time()
+
+                now = self.clock.time()
+
+                for tick in ticker():
+                    if tick['_id'] in self.indexes:
+                        if self.max_tick_age is not None and tick.get('received') is not None and now - tick['received'] > self.max_tick_age:
+                            self.stale_ticks += 1
+
+                            continue
+
+                        TriggerBook.on_tick(self, tick['_id'], tick['highestBid'], tick_time=tick.get('received'), polled=polled)
+
+            except Exception as e:
+                logger.exception('Exception in trigger book update loop.')
+                logger.exception(e)
+
+            time.sleep(interval)
+
+
+    def start(self, ticker, interval=0.2):
+        # ticker is a Ticker instance; one read of all markets is evaluated against every resting trigger
+        self.running = True
+
+        self.t = Thread(target=self.run, args=(ticker, interval))
+
+        self.t.daemon = True
+
+        self.t.start()
+
+        logger.debug('Trigger book started.')
+
+
+    def stop(self):
+        self.running = False
+
+        self.t.join()
+
+        logger.debug('Trigger book stopped.')